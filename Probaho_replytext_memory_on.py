@@ -162,9 +162,15 @@ USE_GEMINI_REST_FOR_GENQUIZ = True
 # ✅ Perplexity (HTTP) — Text/MCQ solving fallback (from main.py)
 # ---------------------------
 # Used ONLY when Gemini3 fails (prevents "REST fallback disabled" error for math/solve).
-PERPLEXITY_API = "https://pplxtyai.vercel.app/api/ask"
+PERPLEXITY_API = os.getenv("PERPLEXITY_API_URL", "").strip() or "https://pplxtyai.vercel.app/api/ask"
 USE_PERPLEXITY_FALLBACK = True
 
+# Base URLs for the Gemini REST API (generateContent / ListModels) and the Gemini web client
+# (/app + StreamGenerate). Point them and PERPLEXITY_API_URL at another server, e.g.
+# benchmarks/fake_ai_backend.py, to measure the fallback chain offline. Empty = the real services.
+GEMINI_API_BASE_URL = (os.getenv("GEMINI_API_BASE_URL", "").strip() or "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_WEB_BASE_URL = (os.getenv("GEMINI_WEB_BASE_URL", "").strip() or "https://gemini.google.com").rstrip("/")
+
 
 # ---------------------------
 # ✅ DeepSeek (OpenAI-compatible) — optional third AI
@@ -1746,7 +1752,7 @@ _G3_CACHE_TTL_SECONDS = 900  # 15 minutes
 
 def scrape_fresh_session():
     session = requests.Session()
-    url = 'https://gemini.google.com/app'
+    url = f'{GEMINI_WEB_BASE_URL}/app'
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
@@ -14446,6 +14452,5315 @@ async def on_solver_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # ===== END FINAL ACADEMIC SAFETY + PRIVATE REPLY HISTORY PATCH =====
 
+
+# ===== AI SINGLE-FLIGHT PATCH (2026-10-19a) =====
+# Goal:
+# 1) When many members tap the solver on the same quiz at once, run ONE backend call.
+# 2) Every waiter gets the same result (or the same error) from that call.
+# 3) Owner can see how many calls were coalesced in /ownerstats.
+import hashlib
+
+_SINGLE_FLIGHT: Dict[str, asyncio.Future] = {}
+_SINGLE_FLIGHT_STATS: Dict[str, int] = {"calls": 0, "leaders": 0, "coalesced": 0, "peak_waiters": 0}
+_SINGLE_FLIGHT_WAITERS: Dict[str, int] = {}
+
+
+def _single_flight_norm(s: Any) -> str:
+    return re.sub(r"\s+", " ", str(s or "")).strip().casefold()
+
+
+def _single_flight_key(kind: str, model: str, scope: str, text: str, options: Optional[List[str]] = None) -> str:
+    parts = [
+        str(kind or "text").lower(),
+        str(model or "G").upper(),
+        str(scope or "").lower(),
+        _single_flight_norm(text),
+    ]
+    for opt in (options or []):
+        parts.append(_single_flight_norm(opt))
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+async def _run_blocking_shared(role: str, key: str, fn, *args, timeout: float | None = None, **kwargs):
+    """_run_blocking with single-flight coalescing.
+
+    Concurrent callers with the same key await the first caller's job instead of
+    queueing their own copy in the role pool.
+    """
+    _SINGLE_FLIGHT_STATS["calls"] += 1
+    fut = _SINGLE_FLIGHT.get(key)
+    if fut is not None and not fut.done():
+        _SINGLE_FLIGHT_STATS["coalesced"] += 1
+        waiters = _SINGLE_FLIGHT_WAITERS.get(key, 0) + 1
+        _SINGLE_FLIGHT_WAITERS[key] = waiters
+        if waiters > _SINGLE_FLIGHT_STATS["peak_waiters"]:
+            _SINGLE_FLIGHT_STATS["peak_waiters"] = waiters
+        return await asyncio.shield(fut)
+
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    _SINGLE_FLIGHT[key] = fut
+    _SINGLE_FLIGHT_WAITERS[key] = 0
+    _SINGLE_FLIGHT_STATS["leaders"] += 1
+    try:
+        result = await _run_blocking(role, fn, *args, timeout=timeout, **kwargs)
+        fut.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        if not fut.done():
+            fut.set_exception(RuntimeError("AI request was cancelled. Please try again."))
+            fut.exception()  # mark retrieved when nobody is waiting
+        raise
+    except Exception as e:
+        if not fut.done():
+            fut.set_exception(e)
+            fut.exception()
+        raise
+    finally:
+        if _SINGLE_FLIGHT.get(key) is fut:
+            _SINGLE_FLIGHT.pop(key, None)
+            _SINGLE_FLIGHT_WAITERS.pop(key, None)
+
+
+async def _solver_mcq_shared(uid: int, model: str, question: str, options: List[str], scope: str = "") -> Tuple[Dict[str, Any], str]:
+    key = _single_flight_key("poll", model, scope, question, options)
+    return await _run_blocking_shared(_role_of(uid), key, _solve_mcq_with_preference, model, question, options)
+
+
+async def _solver_text_shared(uid: int, model: str, problem_text: str, scope: str) -> Tuple[str, str]:
+    key = _single_flight_key("text", model, scope, problem_text)
+    return await _run_blocking_shared(_role_of(uid), key, _solve_text_with_preference, model, problem_text, scope)
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    """Owner dashboard lines for in-process AI runtime counters."""
+    st = _SINGLE_FLIGHT_STATS
+    return [
+        "<b>⚙️ AI Runtime</b>",
+        f"🔁 Solver Calls: <b>{h(st['calls'])}</b>",
+        f"🧩 Backend Jobs: <b>{h(st['leaders'])}</b>",
+        f"🤝 Coalesced: <b>{h(st['coalesced'])}</b> (peak waiters <code>{h(st['peak_waiters'])}</code>)",
+        f"⏳ In-flight: <code>{h(len(_SINGLE_FLIGHT))}</code>",
+    ]
+
+
+_prev_cmd_ownerstats_20261019a = cmd_ownerstats
+
+
+@require_owner
+async def cmd_ownerstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _prev_cmd_ownerstats_20261019a(update, context)
+    with contextlib.suppress(Exception):
+        await safe_reply(update, "\n".join(_ai_runtime_stats_lines()))
+
+
+async def on_solver_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.callback_query:
+        return
+    q = update.callback_query
+    await q.answer("Processing…", show_alert=False)
+    data = (q.data or "").strip()
+    m = re.match(r"^solve:([GPD]):([0-9a-f]{6,16})$", data)
+    if not m:
+        return
+    model = m.group(1)
+    token = m.group(2)
+    store = _pending_store(context)
+    req = store.get(token)
+    if not isinstance(req, dict):
+        with contextlib.suppress(Exception):
+            await q.edit_message_text("⚠️ This request has expired. Please send your question again.")
+        return
+    uid = int(req.get("uid") or 0)
+    if q.from_user and q.from_user.id != uid:
+        with contextlib.suppress(Exception):
+            await q.answer("This is not your request.", show_alert=True)
+        return
+
+    payload = req.get("payload") or {}
+    problem_text = str(payload.get("text") or "").strip()
+    kind = str(req.get("kind") or "text").lower()
+    scope = str(req.get("scope") or ("group_general" if q.message and q.message.chat and q.message.chat.type in ("group", "supergroup") else "private_academic"))
+
+    with contextlib.suppress(Exception):
+        await q.edit_message_text(ui_box_text("Solving", "Please wait… Processing your request.", emoji="⏳"), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    try:
+        if kind == "poll" and payload.get("question"):
+            question = str(payload.get("question", "")).strip()
+            options = payload.get("options", [])
+            result, model_name = await _solver_mcq_shared(uid, model, question, options, scope)
+            raw_expl = str(result.get("explanation", "") or "")
+            clean_expl = clean_latex(raw_expl)
+            raw_why_not = result.get("why_not", {}) or {}
+            clean_why_not = {k: clean_latex(v) for k, v in raw_why_not.items()}
+            msg_html = _format_user_poll_solution(
+                question=question,
+                options=options,
+                model_ans=int(result.get("answer", 0) or 0),
+                official_ans=int(payload.get("official_ans", 0) or 0),
+                model_expl=f"[{model_name}]\n{clean_expl}".strip(),
+                official_expl=str(payload.get("official_expl", "")).strip(),
+                why_not=clean_why_not,
+                conf=int(result.get("confidence", 0) or 0),
+            )
+            kb = _verify_kb(token, model, "poll")
+            answer_for_store = clean_expl or raw_expl
+            used_model_name = model_name
+        else:
+            if _contains_adult_content(problem_text):
+                answer = _adult_refusal_text(problem_text)
+                used_model_name = _model_display_name(model)
+            else:
+                answer, used_model_name = await _solver_text_shared(uid, model, problem_text, scope)
+                if _contains_adult_content(answer) and not _is_academic_safe_override(problem_text):
+                    answer = _adult_refusal_text(problem_text)
+            preserve_code = (is_admin(uid) or is_owner(uid)) and (looks_like_programming_request(problem_text) or looks_like_programming_request(answer))
+            msg_html = _answer_to_tg_html(answer, model_name=used_model_name, preserve_code=preserve_code)
+            kb = _verify_kb(token, model, "text")
+            answer_for_store = answer
+
+        with contextlib.suppress(Exception):
+            await q.edit_message_text(msg_html, reply_markup=kb, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            if q.message and kind == "poll":
+                _remember_quiz_context(context, q.message.message_id, payload)
+            if q.message and kind == "text" and q.message.chat and q.message.chat.type == "private":
+                thread_id = str(payload.get("thread_id") or "").strip()
+                if not thread_id:
+                    thread_id = ai_thread_create(uid, q.message.chat.id, scope if str(scope).startswith("private") else "private_academic", origin="private")
+                    payload["thread_id"] = thread_id
+                    req["payload"] = payload
+                source_user_text = str(payload.get("source_user_text") or problem_text or "").strip()
+                source_message_id = int(payload.get("source_message_id") or (q.message.reply_to_message.message_id if q.message.reply_to_message else 0) or 0)
+                source_reply_message_id = int(payload.get("source_reply_message_id") or 0)
+                ai_thread_append_user_if_missing(thread_id, source_user_text, q.message.chat.id, source_message_id, source_reply_message_id)
+                ai_thread_upsert_bot_answer(thread_id, answer_for_store, q.message.chat.id, q.message.message_id, source_message_id, model_code=model, model_name=used_model_name)
+                with contextlib.suppress(Exception):
+                    upload_db_to_github(force=False)
+            if q.message and q.message.chat and q.message.chat.type in ("group", "supergroup"):
+                asyncio.create_task(_auto_delete_after(context.bot, q.message.chat_id, [q.message.message_id], GROUP_BOT_MESSAGE_TTL_SECONDS))
+    except Exception as e:
+        db_log("ERROR", "solver_callback_failed", {"user_id": uid, "model": model, "error": str(e)})
+        with contextlib.suppress(Exception):
+            await q.edit_message_text(h("AI backend is temporarily unavailable. Please try again."), parse_mode=ParseMode.HTML)
+            if q.message and q.message.chat and q.message.chat.type in ("group", "supergroup"):
+                asyncio.create_task(_auto_delete_after(context.bot, q.message.chat_id, [q.message.message_id], GROUP_BOT_MESSAGE_TTL_SECONDS))
+
+# ===== END AI SINGLE-FLIGHT PATCH =====
+
+
+# ===== MCQ ANSWER CACHE + NEAR-DUPLICATE INDEX PATCH (2026-10-19b) =====
+# Goal:
+# 1) Reuse a previous solution when the same MCQ comes back (exact fingerprint).
+# 2) Also match reposts with a different serial, a [Tag] prefix, Bangla/English digits
+#    or reordered options (MinHash over character 3-grams + LSH buckets in SQLite).
+# 3) No AI call when a prior solution matches above MCQ_CACHE_NEAR_DUP_THRESHOLD and
+#    the two questions agree on numbers, operators and negation words ("...is correct?"
+#    vs "...is not correct?" / "সঠিক?" vs "সঠিক নয়?" share almost every shingle).
+# 4) Entries expire after MCQ_CACHE_TTL_DAYS; beyond MCQ_CACHE_MAX_ROWS the least
+#    recently used ones are evicted.
+import random
+import struct
+import unicodedata
+
+MCQ_CACHE_ENABLED = os.getenv("MCQ_CACHE_ENABLED", "1").strip() != "0"
+MCQ_CACHE_NEAR_DUP_THRESHOLD = float(os.getenv("MCQ_CACHE_NEAR_DUP_THRESHOLD", "0.82") or "0.82")
+MCQ_CACHE_TTL_DAYS = max(0, int(os.getenv("MCQ_CACHE_TTL_DAYS", "90") or "90"))  # 0 = never expire
+MCQ_CACHE_MAX_ROWS = max(100, int(os.getenv("MCQ_CACHE_MAX_ROWS", "50000") or "50000"))
+
+_MINHASH_PERMS = 32
+_LSH_BANDS = 8
+_LSH_ROWS = _MINHASH_PERMS // _LSH_BANDS
+_SHINGLE_SIZE = 3
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_RNG = random.Random(20261019)
+_MINHASH_COEFFS = [
+    (_MINHASH_RNG.randrange(1, _MINHASH_PRIME), _MINHASH_RNG.randrange(0, _MINHASH_PRIME))
+    for _ in range(_MINHASH_PERMS)
+]
+_MINHASH_SIG_FMT = f"<{_MINHASH_PERMS}Q"
+
+_BN_DIGIT_TRANS = str.maketrans("০১২৩৪৫৬৭৮৯", "0123456789")
+_QNORM_BRACKET_RE = re.compile(r"\[[^\]]*\]|【[^】]*】")
+_QNORM_SERIAL_RE = re.compile(r"^\s*(?:q(?:uestion)?|প্রশ্ন)?\s*[\(\[]?\d{1,4}[\)\]]?\s*[\.\)।:\-]\s*", re.IGNORECASE)
+_QNORM_OPT_LABEL_RE = re.compile(r"^\s*[\(\[]?(?:[a-e]|[ক-ঙ])[\)\]\.:]\s+", re.IGNORECASE)
+# Keep Bangla vowel signs / hasanta (Mn/Mc): \w alone would strip them.
+_QNORM_STRIP_RE = re.compile(r"[^\wঀ-৿]+")
+_QNORM_NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+# One serial ("3.", "Q3)", "প্রশ্ন ৩।") followed by real text. "3.5 m/s", "5 - 3 = ?" and
+# "1 : 2 ..." start with an operand, not a serial.
+_QNORM_SAFE_SERIAL_RE = re.compile(
+    r"^\s*(?:q(?:uestion)?|প্রশ্ন)?\s*[\(\[]?\d{1,4}[\)\]]?\s*[\.\)\]।]\s*(?=[^\d\s+\-−–×÷*/=<>^%.,:;])",
+    re.IGNORECASE,
+)
+_QGUARD_OPERATOR_RE = re.compile(r"[+\-−–×÷*/=<>≤≥≠^%√]")
+_QGUARD_NT_RE = re.compile(r"n['’]t\b")
+_QGUARD_NEGATION_WORDS = frozenset(unicodedata.normalize("NFC", w) for w in (
+    "not", "no", "never", "none", "except", "excluding", "incorrect", "false", "wrong", "untrue", "cannot", "least",
+    "নয়", "নয়", "না", "নেই", "নহে", "ব্যতীত", "ছাড়া", "ছাড়া", "বাদে", "ভুল", "অসত্য", "মিথ্যা",
+))
+
+_MCQ_CACHE_STATS: Dict[str, int] = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "guard_rejects": 0, "stores": 0, "evicted": 0}
+
+
+def _mcq_norm_text(s: Any) -> str:
+    t = unicodedata.normalize("NFC", str(s or "")).translate(_BN_DIGIT_TRANS).casefold()
+    t = _QNORM_BRACKET_RE.sub(" ", t)
+    prev = None
+    while prev != t:
+        prev = t
+        t = _QNORM_SERIAL_RE.sub("", t, count=1)
+    t = _QNORM_STRIP_RE.sub(" ", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def _mcq_norm_option(s: Any) -> str:
+    t = unicodedata.normalize("NFC", str(s or "")).translate(_BN_DIGIT_TRANS)
+    t = _QNORM_OPT_LABEL_RE.sub("", t)
+    t = _QNORM_STRIP_RE.sub(" ", t.casefold())
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def _mcq_clean_options(options: List[str]) -> List[str]:
+    return [(o or "").strip() for o in (options or []) if (o or "").strip()][:5]
+
+
+def _mcq_fingerprint(question: str, options: List[str]) -> str:
+    qn = _mcq_norm_text(question)
+    on = sorted(_mcq_norm_option(o) for o in _mcq_clean_options(options))
+    return hashlib.sha1(("\x1e".join([qn] + on)).encode("utf-8")).hexdigest()
+
+
+def _mcq_shingles(question: str, options: List[str]) -> set:
+    qn = _mcq_norm_text(question)
+    on = sorted(_mcq_norm_option(o) for o in _mcq_clean_options(options))
+    text = " | ".join([qn] + on)
+    if len(text) <= _SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)}
+
+
+def _minhash_signature(shingles: set) -> Tuple[int, ...]:
+    if not shingles:
+        return tuple([_MINHASH_PRIME] * _MINHASH_PERMS)
+    hashed = [
+        int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest(), "little")
+        for sh in shingles
+    ]
+    p = _MINHASH_PRIME
+    return tuple(min((a * x + b) % p for x in hashed) for a, b in _MINHASH_COEFFS)
+
+
+def _minhash_similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / float(len(sig_a))
+
+
+def _lsh_buckets(model_code: str, sig: Tuple[int, ...]) -> List[int]:
+    out: List[int] = []
+    prefix = str(model_code or "G").upper().encode("utf-8")
+    for band in range(_LSH_BANDS):
+        chunk = sig[band * _LSH_ROWS:(band + 1) * _LSH_ROWS]
+        digest = hashlib.blake2b(prefix + bytes([band]) + struct.pack(f"<{_LSH_ROWS}Q", *chunk), digest_size=8).digest()
+        out.append(int.from_bytes(digest, "little", signed=True))
+    return out
+
+
+def _mcq_question_guard(question: str) -> Tuple[Tuple[str, ...], str, Tuple[str, ...]]:
+    """(numbers, operators, negation words) of a question; a cached answer is reused only when these agree."""
+    t = unicodedata.normalize("NFC", str(question or "")).translate(_BN_DIGIT_TRANS).casefold()
+    t = _QNORM_SAFE_SERIAL_RE.sub("", _QNORM_BRACKET_RE.sub(" ", t).lstrip(), count=1)
+    words = _QNORM_STRIP_RE.sub(" ", _QGUARD_NT_RE.sub(" not", t)).split()
+    return (
+        tuple(sorted(_QNORM_NUM_RE.findall(t))),
+        "".join(_QGUARD_OPERATOR_RE.findall(t)),
+        tuple(sorted(w for w in words if w in _QGUARD_NEGATION_WORDS)),
+    )
+
+
+def _mcq_cache_cutoff() -> str:
+    """created_at before this is expired; "" when entries never expire."""
+    if not MCQ_CACHE_TTL_DAYS:
+        return ""
+    return (dt.datetime.now(timezone.utc).replace(microsecond=0) - dt.timedelta(days=MCQ_CACHE_TTL_DAYS)).isoformat()
+
+
+def _mcq_cache_delete(cur, ids: List[int]) -> None:
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" for _ in chunk)
+        cur.execute(f"DELETE FROM mcq_answer_lsh WHERE cache_id IN ({marks})", chunk)
+        cur.execute(f"DELETE FROM mcq_answer_cache WHERE id IN ({marks})", chunk)
+    _MCQ_CACHE_STATS["evicted"] += len(ids)
+
+
+def _mcq_cache_prune(cur) -> None:
+    """Drop expired rows, then the least recently used ones beyond MCQ_CACHE_MAX_ROWS (in batches)."""
+    cutoff = _mcq_cache_cutoff()
+    if cutoff:
+        cur.execute("SELECT id FROM mcq_answer_cache WHERE created_at < ?", (cutoff,))
+        _mcq_cache_delete(cur, [int(r["id"]) for r in cur.fetchall()])
+    cur.execute("SELECT COUNT(*) AS c FROM mcq_answer_cache")
+    extra = int(cur.fetchone()["c"]) + 1 - MCQ_CACHE_MAX_ROWS  # + the row being stored
+    if extra > 0:
+        cur.execute(
+            "SELECT id FROM mcq_answer_cache ORDER BY COALESCE(last_hit_at, created_at) ASC, id ASC LIMIT ?",
+            (extra + MCQ_CACHE_MAX_ROWS // 10,),
+        )
+        _mcq_cache_delete(cur, [int(r["id"]) for r in cur.fetchall()])
+
+
+def _mcq_cache_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mcq_answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_code TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            question TEXT NOT NULL,
+            options_json TEXT NOT NULL,
+            result_json TEXT NOT NULL,
+            backend TEXT,
+            signature BLOB NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            last_hit_at TEXT
+        )
+        """
+    )
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_mcq_answer_cache_fp ON mcq_answer_cache(model_code, fingerprint)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mcq_answer_lsh (
+            bucket INTEGER NOT NULL,
+            cache_id INTEGER NOT NULL,
+            PRIMARY KEY (bucket, cache_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_mcq_answer_cache_created ON mcq_answer_cache(created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_mcq_answer_lsh_cache ON mcq_answer_lsh(cache_id)")
+    conn.commit()
+    conn.close()
+
+
+_prev_db_init_20261019b = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019b()
+    _mcq_cache_db_init()
+
+
+def _mcq_cache_remap(result: Dict[str, Any], cached_options: List[str], new_options: List[str]) -> Optional[Dict[str, Any]]:
+    """Map a cached answer onto the new option order. None if the option sets differ."""
+    old_norm = [_mcq_norm_option(o) for o in cached_options]
+    new_norm = [_mcq_norm_option(o) for o in new_options]
+    if len(old_norm) != len(new_norm) or sorted(old_norm) != sorted(new_norm) or len(set(new_norm)) != len(new_norm):
+        return None
+    ans = int(result.get("answer", 0) or 0)
+    if not (1 <= ans <= len(old_norm)):
+        return None
+    pos = {n: i + 1 for i, n in enumerate(new_norm)}
+    out = dict(result)
+    out["answer"] = pos[old_norm[ans - 1]]
+    why_not = result.get("why_not", {}) if isinstance(result.get("why_not", {}), dict) else {}
+    remapped: Dict[str, Any] = {}
+    for letter, reason in why_not.items():
+        idx = ord(str(letter or " ")[:1].upper()) - 64
+        if 1 <= idx <= len(old_norm):
+            remapped[_safe_letter(pos[old_norm[idx - 1]])] = reason
+    out["why_not"] = remapped
+    return out
+
+
+def mcq_cache_lookup(model_code: str, question: str, options: List[str]) -> Optional[Tuple[Dict[str, Any], str]]:
+    if not MCQ_CACHE_ENABLED:
+        return None
+    opts = _mcq_clean_options(options)
+    if len(opts) < 2 or not str(question or "").strip():
+        return None
+    _MCQ_CACHE_STATS["lookups"] += 1
+    model_code = str(model_code or "G").upper()
+    fp = _mcq_fingerprint(question, opts)
+    guard = _mcq_question_guard(question)
+    cutoff = _mcq_cache_cutoff()
+    conn = db_connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT id, question, options_json, result_json, backend FROM mcq_answer_cache WHERE model_code=? AND fingerprint=? AND created_at >= ?",
+            (model_code, fp, cutoff),
+        )
+        row = cur.fetchone()
+        kind = "exact_hits"
+        # The fingerprint drops punctuation, so "2+2" and "2×2" share one.
+        if row is not None and _mcq_question_guard(row["question"]) != guard:
+            _MCQ_CACHE_STATS["guard_rejects"] += 1
+            row = None
+        if row is None:
+            sig = _minhash_signature(_mcq_shingles(question, opts))
+            buckets = _lsh_buckets(model_code, sig)
+            marks = ",".join("?" for _ in buckets)
+            cur.execute(
+                f"SELECT cache_id, COUNT(*) AS c FROM mcq_answer_lsh WHERE bucket IN ({marks}) GROUP BY cache_id ORDER BY c DESC LIMIT 16",
+                buckets,
+            )
+            cand_ids = [int(r["cache_id"]) for r in cur.fetchall()]
+            best = None
+            best_sim = 0.0
+            if cand_ids:
+                marks = ",".join("?" for _ in cand_ids)
+                cur.execute(
+                    f"SELECT id, question, options_json, result_json, backend, signature FROM mcq_answer_cache WHERE id IN ({marks}) AND created_at >= ?",
+                    [*cand_ids, cutoff],
+                )
+                for cand in cur.fetchall():
+                    sim = _minhash_similarity(sig, struct.unpack(_MINHASH_SIG_FMT, cand["signature"]))
+                    if sim < MCQ_CACHE_NEAR_DUP_THRESHOLD or sim <= best_sim:
+                        continue
+                    # Same wording with other numbers, operators or a flipped "not" is a different question.
+                    if _mcq_question_guard(cand["question"]) != guard:
+                        _MCQ_CACHE_STATS["guard_rejects"] += 1
+                        continue
+                    best, best_sim = cand, sim
+            row = best
+            kind = "near_hits"
+        if row is None:
+            return None
+        result = _mcq_cache_remap(json.loads(row["result_json"] or "{}"), json.loads(row["options_json"] or "[]"), opts)
+        if not result:
+            return None
+        cur.execute("UPDATE mcq_answer_cache SET hits=hits+1, last_hit_at=? WHERE id=?", (now_iso(), int(row["id"])))
+        conn.commit()
+        _MCQ_CACHE_STATS[kind] += 1
+        return result, str(row["backend"] or _public_model_name(model_code))
+    finally:
+        conn.close()
+
+
+def mcq_cache_store(model_code: str, question: str, options: List[str], result: Dict[str, Any], backend: str = "") -> None:
+    if not MCQ_CACHE_ENABLED or not isinstance(result, dict):
+        return
+    opts = _mcq_clean_options(options)
+    if len(opts) < 2 or not (1 <= int(result.get("answer", 0) or 0) <= len(opts)):
+        return
+    model_code = str(model_code or "G").upper()
+    sig = _minhash_signature(_mcq_shingles(question, opts))
+    conn = db_connect()
+    cur = conn.cursor()
+    try:
+        _mcq_cache_prune(cur)
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO mcq_answer_cache(model_code, fingerprint, question, options_json, result_json, backend, signature, created_at)
+            VALUES (?,?,?,?,?,?,?,?)
+            """,
+            (
+                model_code,
+                _mcq_fingerprint(question, opts),
+                str(question or "").strip(),
+                json.dumps(opts, ensure_ascii=False),
+                json.dumps(result, ensure_ascii=False),
+                str(backend or ""),
+                struct.pack(_MINHASH_SIG_FMT, *sig),
+                now_iso(),
+            ),
+        )
+        if cur.rowcount:
+            cache_id = int(cur.lastrowid)
+            cur.executemany(
+                "INSERT OR IGNORE INTO mcq_answer_lsh(bucket, cache_id) VALUES (?,?)",
+                [(bk, cache_id) for bk in _lsh_buckets(model_code, sig)],
+            )
+            _MCQ_CACHE_STATS["stores"] += 1
+        conn.commit()
+    finally:
+        conn.close()
+
+
+_prev_solve_mcq_with_preference_20261019b = _solve_mcq_with_preference
+
+
+def _solve_mcq_with_preference(model: str, question: str, options: List[str]) -> Tuple[Dict[str, Any], str]:
+    with contextlib.suppress(Exception):
+        hit = mcq_cache_lookup(model, question, options)
+        if hit:
+            return hit
+    result, backend = _prev_solve_mcq_with_preference_20261019b(model, question, options)
+    try:
+        mcq_cache_store(model, question, options, result, backend)
+    except Exception as e:
+        logging.warning("MCQ cache store failed: %s", e)
+    return result, backend
+
+
+_prev_ai_runtime_stats_lines_20261019b = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _MCQ_CACHE_STATS
+    return _prev_ai_runtime_stats_lines_20261019b() + [
+        f"📚 Answer Cache: lookups <code>{h(st['lookups'])}</code> · exact <b>{h(st['exact_hits'])}</b> · near <b>{h(st['near_hits'])}</b> · guard rejects <code>{h(st['guard_rejects'])}</code> · stored <code>{h(st['stores'])}</code> · evicted <code>{h(st['evicted'])}</code>",
+    ]
+
+# ===== END MCQ ANSWER CACHE + NEAR-DUPLICATE INDEX PATCH =====
+
+
+# ===== GEMINI WEB SESSION POOL PATCH (2026-10-19c) =====
+# Goal:
+# 1) Keep a few pre-scraped Gemini web sessions ready so no user request pays for
+#    scrape_fresh_session (page GET + token extraction) inline.
+# 2) A background thread tops the pool up and replaces sessions before they expire.
+# 3) Each worker thread checks out its own session (no shared requests.Session),
+#    failing sessions are dropped after GEMINI_WEB_POOL_MAX_FAILS errors.
+# 4) Idle + checked-out sessions never exceed GEMINI_WEB_POOL_SIZE. When all are busy a
+#    request waits briefly for a check-in, then falls through to the REST backend
+#    instead of scraping a session on the user path.
+import collections
+
+GEMINI_WEB_POOL_SIZE = max(1, int(os.getenv("GEMINI_WEB_POOL_SIZE", "3") or "3"))
+GEMINI_WEB_POOL_MAX_FAILS = max(1, int(os.getenv("GEMINI_WEB_POOL_MAX_FAILS", "2") or "2"))
+_G3_POOL_REFRESH_MARGIN_SECONDS = 120
+_G3_POOL_CHECKOUT_WAIT_SECONDS = 3.0
+_G3_POOL_IDLE_SLEEP_SECONDS = 30.0
+
+_G3_POOL: "collections.deque[Dict[str, Any]]" = collections.deque()
+# Guards _G3_POOL and _G3_POOL_STATS; notified on every check-in and top-up.
+_G3_POOL_COND = threading.Condition()
+_G3_POOL_WAKE = threading.Event()
+_G3_POOL_STOP = threading.Event()
+_G3_POOL_THREAD: Optional[threading.Thread] = None
+_G3_POOL_STATS: Dict[str, int] = {
+    "scrapes": 0,
+    "scrape_failures": 0,
+    "inline_scrapes": 0,
+    "checkouts": 0,
+    "checkout_waits": 0,
+    "busy": 0,
+    "discarded": 0,
+    "in_use": 0,
+}
+
+
+def _g3_stat(name: str, delta: int = 1) -> None:
+    with _G3_POOL_COND:
+        _G3_POOL_STATS[name] += delta
+
+
+def _g3_new_slot() -> Optional[Dict[str, Any]]:
+    scraped = scrape_fresh_session()
+    if not scraped:
+        _g3_stat("scrape_failures")
+        return None
+    _g3_stat("scrapes")
+    scraped.pop("html", None)  # the page body is only needed for token extraction
+    return {"data": scraped, "created": time.time(), "uses": 0, "fails": 0, "last_ok": 0.0}
+
+
+def _g3_slot_fresh(slot: Dict[str, Any], margin: float = 0.0) -> bool:
+    age = time.time() - float(slot.get("created") or 0.0)
+    return age < (_G3_CACHE_TTL_SECONDS - margin) and int(slot.get("fails") or 0) < GEMINI_WEB_POOL_MAX_FAILS
+
+
+def _g3_discard(slot: Dict[str, Any]) -> None:
+    _g3_stat("discarded")
+    with contextlib.suppress(Exception):
+        slot["data"]["session"].close()
+
+
+def _g3_pool_worker_alive() -> bool:
+    return _G3_POOL_THREAD is not None and _G3_POOL_THREAD.is_alive()
+
+
+def _g3_checkout() -> Optional[Dict[str, Any]]:
+    """Take an idle session. At most GEMINI_WEB_POOL_SIZE sessions exist (idle + in use).
+
+    When all of them are busy, wait up to _G3_POOL_CHECKOUT_WAIT_SECONDS for a check-in and
+    then give up (None), so the caller falls through to the next backend. Scraping on
+    the request path only happens when the pool worker is not running.
+    """
+    deadline = time.time() + _G3_POOL_CHECKOUT_WAIT_SECONDS
+    waited = False
+    stale: List[Dict[str, Any]] = []
+    slot = None
+    with _G3_POOL_COND:
+        while True:
+            while _G3_POOL:
+                cand = _G3_POOL.popleft()
+                if _g3_slot_fresh(cand):
+                    slot = cand
+                    break
+                stale.append(cand)
+            if slot is not None:
+                _G3_POOL_STATS["checkouts"] += 1
+                _G3_POOL_STATS["in_use"] += 1
+                break
+            remaining = deadline - time.time()
+            if not _g3_pool_worker_alive() or remaining <= 0:
+                break
+            if not waited:
+                _G3_POOL_STATS["checkout_waits"] += 1
+                waited = True
+            _G3_POOL_WAKE.set()
+            _G3_POOL_COND.wait(min(remaining, 0.25))
+    for cand in stale:
+        _g3_discard(cand)
+    _G3_POOL_WAKE.set()  # let the refresher keep the idle count up
+    if slot is not None:
+        return slot
+    if _g3_pool_worker_alive():
+        _g3_stat("busy")
+        return None
+    # Last resort: no pool worker (tests, benchmarks, or it died).
+    _g3_stat("inline_scrapes")
+    slot = _g3_new_slot()
+    if slot is not None:
+        with _G3_POOL_COND:
+            _G3_POOL_STATS["checkouts"] += 1
+            _G3_POOL_STATS["in_use"] += 1
+    return slot
+
+
+def _g3_checkin(slot: Optional[Dict[str, Any]], ok: bool) -> None:
+    if slot is None:
+        return
+    slot["uses"] = int(slot.get("uses") or 0) + 1
+    if ok:
+        slot["fails"] = 0
+        slot["last_ok"] = time.time()
+    else:
+        slot["fails"] = int(slot.get("fails") or 0) + 1
+    with _G3_POOL_COND:
+        _G3_POOL_STATS["in_use"] = max(0, _G3_POOL_STATS["in_use"] - 1)
+        keep = _g3_slot_fresh(slot) and len(_G3_POOL) < GEMINI_WEB_POOL_SIZE
+        if keep:
+            _G3_POOL.append(slot)
+            _G3_POOL_COND.notify()
+    if not keep:
+        _g3_discard(slot)
+        _G3_POOL_WAKE.set()
+
+
+def _g3_pool_refresh_once() -> None:
+    # Replace idle sessions that will expire before the next pass.
+    stale: List[Dict[str, Any]] = []
+    with _G3_POOL_COND:
+        for _ in range(len(_G3_POOL)):
+            slot = _G3_POOL.popleft()
+            if _g3_slot_fresh(slot, margin=_G3_POOL_REFRESH_MARGIN_SECONDS):
+                _G3_POOL.append(slot)
+            else:
+                stale.append(slot)
+    for slot in stale:
+        _g3_discard(slot)
+    misses = 0
+    while not _G3_POOL_STOP.is_set():
+        with _G3_POOL_COND:
+            if len(_G3_POOL) + _G3_POOL_STATS["in_use"] >= GEMINI_WEB_POOL_SIZE:
+                break
+        slot = _g3_new_slot()
+        if slot is None:
+            misses += 1
+            if misses >= 2:
+                break
+            continue
+        with _G3_POOL_COND:
+            _G3_POOL.append(slot)
+            _G3_POOL_COND.notify()
+
+
+def _g3_pool_worker() -> None:
+    while not _G3_POOL_STOP.is_set():
+        try:
+            _g3_pool_refresh_once()
+        except Exception as e:
+            logging.warning("Gemini web session pool refresh failed: %s", e)
+        _G3_POOL_WAKE.wait(_G3_POOL_IDLE_SLEEP_SECONDS)
+        _G3_POOL_WAKE.clear()
+
+
+def start_gemini_session_pool() -> None:
+    global _G3_POOL_THREAD
+    if _G3_POOL_THREAD and _G3_POOL_THREAD.is_alive():
+        return
+    _G3_POOL_STOP.clear()
+    _G3_POOL_THREAD = threading.Thread(target=_g3_pool_worker, name="gemini-web-session-pool", daemon=True)
+    _G3_POOL_THREAD.start()
+
+
+def stop_gemini_session_pool() -> None:
+    _G3_POOL_STOP.set()
+    _G3_POOL_WAKE.set()
+
+
+def _g3_stream_headers(cookies: Dict[str, str]) -> Dict[str, str]:
+    return {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
+        'x-same-domain': '1',
+        'origin': 'https://gemini.google.com',
+        'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"Windows"',
+        'sec-fetch-site': 'same-origin',
+        'sec-fetch-mode': 'cors',
+        'sec-fetch-dest': 'empty',
+        'referer': 'https://gemini.google.com/',
+        'Cookie': '; '.join([f"{k}={v}" for k, v in (cookies or {}).items()]),
+    }
+
+
+def chat_with_gemini(prompt):
+    start_time = time.time()
+    slot = _g3_checkout()
+    if not slot:
+        return {'success': False, 'error': 'Failed to establish session with Gemini'}
+
+    scraped = slot["data"]
+    reqid = int(time.time() * 1000) % 1000000
+    base_url = "https://gemini.google.com/_/BardChatUi/data/assistant.lamda.BardFrontendService/StreamGenerate"
+    url = f"{base_url}?bl={scraped['bl']}&f.sid={scraped['fsid']}&hl=en-US&_reqid={reqid}&rt=c"
+    payload = build_payload(prompt, scraped['snlm0e'])
+
+    ok = False
+    try:
+        response = scraped['session'].post(url, data=payload, headers=_g3_stream_headers(scraped['cookies']), timeout=20)
+        if response.status_code != 200:
+            return {'success': False, 'error': f'HTTP {response.status_code}'}
+
+        result = parse_streaming_response(response.text)
+        response_time = round(time.time() - start_time, 2)
+        if result:
+            ok = True
+            return {
+                'success': True,
+                'response': result,
+                'metadata': {
+                    'response_time': f'{response_time}s',
+                    'timestamp': datetime.utcnow().isoformat() + 'Z',
+                    'model': 'gemini',
+                    'character_count': len(result),
+                    'word_count': len(result.split())
+                }
+            }
+        return {'success': False, 'error': 'No response received from Gemini'}
+    except requests.exceptions.RequestException as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        _g3_checkin(slot, ok)
+
+
+_prev_main_20261019c = main
+
+
+def main():
+    start_gemini_session_pool()
+    try:
+        _prev_main_20261019c()
+    finally:
+        stop_gemini_session_pool()
+
+
+_prev_ai_runtime_stats_lines_20261019c = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _G3_POOL_STATS
+    return _prev_ai_runtime_stats_lines_20261019c() + [
+        f"🌐 Gemini Web Pool: idle <b>{h(len(_G3_POOL))}</b>/{h(GEMINI_WEB_POOL_SIZE)} · in use <code>{h(st['in_use'])}</code> · scrapes <code>{h(st['scrapes'])}</code> (inline <b>{h(st['inline_scrapes'])}</b>, failed <code>{h(st['scrape_failures'])}</code>) · busy <code>{h(st['busy'])}</code> · dropped <code>{h(st['discarded'])}</code>",
+    ]
+
+# ===== END GEMINI WEB SESSION POOL PATCH =====
+
+
+# ===== GEMINI WEB STREAMING + PROGRESSIVE EDIT PATCH (2026-10-19d) =====
+# Goal:
+# 1) Read StreamGenerate line by line, decode only wrb.fr frames and stop at the
+#    closing frame instead of buffering the whole body.
+# 2) Optional text sink: the solver thread reports partial text as it arrives.
+# 3) Text solver callbacks edit the "Solving" message with partial text,
+#    throttled to stay inside Telegram edit limits.
+import contextvars
+
+GEMINI_STREAM_EDITS_ENABLED = os.getenv("GEMINI_STREAM_EDITS_ENABLED", "1").strip() != "0"
+GEMINI_STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("GEMINI_STREAM_EDIT_INTERVAL_SECONDS", "1.5") or "1.5")
+GEMINI_STREAM_GROUP_EDIT_INTERVAL_SECONDS = float(os.getenv("GEMINI_STREAM_GROUP_EDIT_INTERVAL_SECONDS", "3.0") or "3.0")
+_STREAM_EDIT_MIN_GROWTH = 40
+_G3_END_FRAMES = ("e", "di", "af.httprm")
+
+_G3_STREAM_SINK = threading.local()
+_STREAM_EDIT_TARGET: "contextvars.ContextVar[Optional[Dict[str, Any]]]" = contextvars.ContextVar("stream_edit_target", default=None)
+
+
+def _g3_frame_text(line: str) -> Tuple[Optional[str], bool]:
+    """Decode one StreamGenerate line -> (answer text or None, is_final_frame)."""
+    line = (line or "").strip()
+    if not line or line.startswith(")]}'") or line.isdigit():
+        return None, False
+    if not line.startswith('[["wrb.fr"'):
+        m = re.match(r'^\[\["([^"]+)"', line)
+        return None, bool(m and m.group(1) in _G3_END_FRAMES)
+    try:
+        data = json.loads(line)
+        inner_json = data[0][2] if len(data[0]) > 2 else None
+        if not inner_json:
+            return None, False
+        parsed = json.loads(inner_json)
+        first_item = parsed[4][0]
+        if isinstance(first_item[0], str) and first_item[0].startswith("rc_") and isinstance(first_item[1], list):
+            text_content = first_item[1][0] if first_item[1] else None
+            if isinstance(text_content, str):
+                return text_content, False
+    except Exception:
+        pass
+    return None, False
+
+
+def _g3_unescape(text: str) -> str:
+    return text.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
+
+
+def iter_gemini_stream(lines: Iterable[str]):
+    """Yield the growing answer text from StreamGenerate lines; stops at the end frame."""
+    best = ""
+    for line in lines:
+        text, final = _g3_frame_text(line)
+        if final:
+            break
+        if text and len(text) > len(best):
+            best = text
+            yield _g3_unescape(best)
+
+
+def parse_streaming_response(response_text):
+    full_text = ""
+    for full_text in iter_gemini_stream((response_text or "").split("\n")):
+        pass
+    return full_text or None
+
+
+def _call_with_stream_sink(sink, fn, *args, **kwargs):
+    """Run fn in the current worker thread with a partial-text sink installed."""
+    _G3_STREAM_SINK.fn = sink
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _G3_STREAM_SINK.fn = None
+
+
+def chat_with_gemini(prompt, on_text=None):
+    start_time = time.time()
+    if on_text is None:
+        on_text = getattr(_G3_STREAM_SINK, "fn", None)
+    slot = _g3_checkout()
+    if not slot:
+        return {'success': False, 'error': 'Failed to establish session with Gemini'}
+
+    scraped = slot["data"]
+    reqid = int(time.time() * 1000) % 1000000
+    base_url = "https://gemini.google.com/_/BardChatUi/data/assistant.lamda.BardFrontendService/StreamGenerate"
+    url = f"{base_url}?bl={scraped['bl']}&f.sid={scraped['fsid']}&hl=en-US&_reqid={reqid}&rt=c"
+    payload = build_payload(prompt, scraped['snlm0e'])
+
+    ok = False
+    try:
+        with scraped['session'].post(url, data=payload, headers=_g3_stream_headers(scraped['cookies']), timeout=20, stream=True) as response:
+            if response.status_code != 200:
+                return {'success': False, 'error': f'HTTP {response.status_code}'}
+            response.encoding = "utf-8"
+            result = ""
+            first_chunk_at = 0.0
+            for result in iter_gemini_stream(response.iter_lines(decode_unicode=True)):
+                if not first_chunk_at:
+                    first_chunk_at = time.time()
+                if on_text is not None:
+                    with contextlib.suppress(Exception):
+                        on_text(result)
+
+        response_time = round(time.time() - start_time, 2)
+        if result:
+            ok = True
+            return {
+                'success': True,
+                'response': result,
+                'metadata': {
+                    'response_time': f'{response_time}s',
+                    'first_text_time': f'{round(first_chunk_at - start_time, 2)}s',
+                    'timestamp': datetime.utcnow().isoformat() + 'Z',
+                    'model': 'gemini',
+                    'character_count': len(result),
+                    'word_count': len(result.split())
+                }
+            }
+        return {'success': False, 'error': 'No response received from Gemini'}
+    except requests.exceptions.RequestException as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        _g3_checkin(slot, ok)
+
+
+class _ProgressiveEditor:
+    """Edits one Telegram message with the latest partial answer, throttled."""
+
+    def __init__(self, bot, chat_id: int, message_id: int, model_name: str, interval: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.model_name = model_name
+        self.interval = max(1.0, float(interval))
+        self._latest = ""
+        self._shown = 0
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def feed(self, text: str) -> None:
+        # Called from the worker thread; a plain attribute swap is enough here.
+        self._latest = text or ""
+
+    async def _flush(self) -> None:
+        text = self._latest
+        if len(text) - self._shown < _STREAM_EDIT_MIN_GROWTH:
+            return
+        if _contains_adult_content(text):
+            self._stop.set()
+            return
+        try:
+            body = _answer_to_tg_html(text + " …", model_name=self.model_name)
+        except Exception:
+            body = h(_trim_for_telegram(text, 3200))
+        self._shown = len(text)
+        with contextlib.suppress(Exception):
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                text=body,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            )
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            if not self._stop.is_set():
+                await self._flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            with contextlib.suppress(Exception):
+                await self._task
+
+
+_prev_solver_text_shared_20261019d = _solver_text_shared
+
+
+async def _solver_text_shared(uid: int, model: str, problem_text: str, scope: str) -> Tuple[str, str]:
+    target = _STREAM_EDIT_TARGET.get()
+    key = _single_flight_key("text", model, scope, problem_text)
+    if not GEMINI_STREAM_EDITS_ENABLED or not target or key in _SINGLE_FLIGHT:
+        return await _prev_solver_text_shared_20261019d(uid, model, problem_text, scope)
+    editor = _ProgressiveEditor(
+        target["bot"],
+        target["chat_id"],
+        target["message_id"],
+        _model_display_name(model),
+        GEMINI_STREAM_GROUP_EDIT_INTERVAL_SECONDS if target.get("is_group") else GEMINI_STREAM_EDIT_INTERVAL_SECONDS,
+    )
+    editor.start()
+    try:
+        return await _run_blocking_shared(
+            _role_of(uid), key, _call_with_stream_sink, editor.feed, _solve_text_with_preference, model, problem_text, scope
+        )
+    finally:
+        await editor.stop()
+
+
+_prev_on_solver_callback_20261019d = on_solver_callback
+
+
+async def on_solver_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    q = update.callback_query
+    msg = q.message if q else None
+    if not msg or not msg.chat:
+        return await _prev_on_solver_callback_20261019d(update, context)
+    token = _STREAM_EDIT_TARGET.set({
+        "bot": context.bot,
+        "chat_id": msg.chat.id,
+        "message_id": msg.message_id,
+        "is_group": msg.chat.type in ("group", "supergroup"),
+    })
+    try:
+        return await _prev_on_solver_callback_20261019d(update, context)
+    finally:
+        _STREAM_EDIT_TARGET.reset(token)
+
+# ===== END GEMINI WEB STREAMING + PROGRESSIVE EDIT PATCH =====
+
+
+# ===== BATCH BUFFER SOLVER PATCH (2026-10-19e) =====
+# Goal:
+# 1) /solvebuffer fills answer=0 rows in the admin buffer with a few batched AI calls
+#    (SOLVEBUFFER_BATCH_SIZE questions per prompt, answers mapped back by serial).
+# 2) Rows that come back missing/invalid/low-confidence are re-asked one by one, each as
+#    its own ADMIN job, so a slow re-ask cannot eat the budget of the ones after it.
+# 3) Work runs in the ADMIN executor; one status message is edited after every batch.
+SOLVEBUFFER_BATCH_SIZE = min(25, max(10, int(os.getenv("SOLVEBUFFER_BATCH_SIZE", "20") or "20")))
+SOLVEBUFFER_MIN_CONFIDENCE = int(os.getenv("SOLVEBUFFER_MIN_CONFIDENCE", "60") or "60")
+_SOLVEBUFFER_RUNNING_KEY = "_solvebuffer_running"
+
+
+def buffer_update_payload(user_id: int, row_id: int, payload: Dict[str, Any]) -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE quiz_buffer SET payload_json=? WHERE user_id=? AND id=?",
+        (json.dumps(payload, ensure_ascii=False), user_id, row_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _payload_options(payload: Dict[str, Any]) -> List[str]:
+    return [str(payload.get(f"option{i}", "") or "").strip() for i in range(1, 6) if str(payload.get(f"option{i}", "") or "").strip()]
+
+
+def _payload_needs_answer(payload: Dict[str, Any]) -> bool:
+    opts = _payload_options(payload)
+    ans = int(payload.get("answer", 0) or 0)
+    return bool(str(payload.get("questions", "") or "").strip()) and len(opts) >= 2 and not (1 <= ans <= len(opts))
+
+
+def _build_batch_mcq_prompt(items: List[Tuple[int, str, List[str]]]) -> str:
+    is_bn = any(_is_bangla_text(q + " " + " ".join(opts)) for _s, q, opts in items)
+    blocks = []
+    for serial, question, opts in items:
+        opt_lines = "\n".join(f"{_safe_letter(i + 1)}. {opt}" for i, opt in enumerate(opts))
+        blocks.append(f"[{serial}]\n{question.strip()}\n{opt_lines}")
+    return (
+        "Return STRICT JSON only. No markdown. No extra text.\n\n"
+        f"Task: Solve ALL {len(items)} MCQs below. Each question starts with its serial in square brackets.\n"
+        "Rules:\n"
+        "- Return exactly one entry per serial, using the same serial number.\n"
+        "- answer must be 1-5 (A=1,B=2,C=3,D=4,E=5).\n"
+        "- confidence: 0-100 integer. Use a low value when unsure; do not guess silently.\n"
+        "- explanation: one or two short exam-style sentences.\n"
+        f"- {_quiz_language_rule_block(is_bn)}\n\n"
+        + "\n\n".join(blocks)
+        + "\n\nJSON format:\n"
+        '{"answers":[{"serial":1,"answer":1,"confidence":0,"explanation":"..."}]}'
+    )
+
+
+def _batch_confidence(value: Any) -> int:
+    """0-100 from 85, "85", "85%" or a 0-1 fraction (0.9, "0.9"); anything else is 0."""
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        num, fraction = float(value), isinstance(value, float)
+    else:
+        m = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+        if not m:
+            return 0
+        num, fraction = float(m.group(0)), "." in m.group(0) and "%" not in str(value)
+    if fraction and num <= 1.0:
+        num *= 100
+    return max(0, min(100, int(round(num))))
+
+
+def _parse_batch_mcq_answers(raw: str, items: List[Tuple[int, str, List[str]]]) -> Dict[int, Dict[str, Any]]:
+    try:
+        # Lenient loader, not _extract_json_strict: a bare answers array is fine here.
+        data: Any = _lenient_json_loads(raw)
+    except Exception:
+        data = _repair_to_json(raw, schema_hint='{"answers":[{"serial":1,"answer":1,"confidence":0,"explanation":"..."}]}')
+    rows = data.get("answers") if isinstance(data, dict) else data
+    if not isinstance(rows, list):
+        return {}
+    sizes = {serial: len(opts) for serial, _q, opts in items}
+    out: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        try:
+            serial = int(str(row.get("serial", "")).strip().strip("[]"))
+            ans = row.get("answer", 0)
+            if isinstance(ans, str) and len(ans.strip()) == 1 and ans.strip().isalpha():
+                ans = ord(ans.strip().upper()) - 64
+            ans = int(ans or 0)
+            conf = _batch_confidence(row.get("confidence", 0))
+        except (TypeError, ValueError):
+            continue
+        if serial in sizes and 1 <= ans <= sizes[serial]:
+            out[serial] = {
+                "answer": ans,
+                "confidence": conf,
+                "explanation": str(row.get("explanation", "") or "").strip(),
+                "why_not": {},
+            }
+    return out
+
+
+def _solvebuffer_batch_job(model: str, rows: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Blocking: solve one batch of buffer rows with a single AI call.
+
+    Returns {row_id: result}, counters, and the rows to re-ask one by one as
+    (row_id, question, options, low-confidence batch answer or None).
+    """
+    results: Dict[int, Dict[str, Any]] = {}
+    reask: List[Tuple[int, str, List[str], Optional[Dict[str, Any]]]] = []
+    stats = {"batch_calls": 0, "single_calls": 0, "cache_hits": 0, "failed": 0}
+    pending: List[Tuple[int, int, str, List[str]]] = []
+    for row_id, payload in rows:
+        question = str(payload.get("questions", "") or "").strip()
+        opts = _payload_options(payload)
+        hit = None
+        with contextlib.suppress(Exception):
+            hit = mcq_cache_lookup(model, question, opts)
+        if hit:
+            results[row_id] = hit[0]
+            stats["cache_hits"] += 1
+            continue
+        pending.append((len(pending) + 1, row_id, question, opts))
+
+    answered: Dict[int, Dict[str, Any]] = {}
+    if pending:
+        items = [(serial, q, opts) for serial, _rid, q, opts in pending]
+        stats["batch_calls"] += 1
+        try:
+            raw, backend = _solve_text_via_prompt(_build_batch_mcq_prompt(items), preferred=model)
+            answered = _parse_batch_mcq_answers(raw, items)
+        except Exception as e:
+            logging.warning("solvebuffer batch call failed: %s", e)
+            backend = ""
+
+    for serial, row_id, question, opts in pending:
+        res = answered.get(serial)
+        if res and res["confidence"] >= SOLVEBUFFER_MIN_CONFIDENCE:
+            results[row_id] = res
+            with contextlib.suppress(Exception):
+                mcq_cache_store(model, question, opts, res, backend)
+            continue
+        reask.append((row_id, question, opts, res))
+    return {"results": results, "stats": stats, "reask": reask}
+
+
+def _solvebuffer_single_job(model: str, question: str, opts: List[str]) -> Optional[Dict[str, Any]]:
+    """Blocking: re-ask one buffer row; None when the answer is unusable."""
+    single, _used = _solve_mcq_with_preference(model, question, opts)
+    return single if 1 <= int(single.get("answer", 0) or 0) <= len(opts) else None
+
+
+def _solvebuffer_progress_html(done: int, total: int, batch_no: int, batches: int, stats: Dict[str, int]) -> str:
+    return ui_box_html(
+        "Solving Buffer",
+        f"Batch <code>{h(batch_no)}/{h(batches)}</code>\n"
+        f"Answered: <b>{h(done)}/{h(total)}</b>\n"
+        f"AI calls: <code>{h(stats['batch_calls'] + stats['single_calls'])}</code> "
+        f"(batch {h(stats['batch_calls'])}, re-asked {h(stats['single_calls'])}) · cache <code>{h(stats['cache_hits'])}</code>",
+        emoji="⏳",
+    )
+
+
+@require_admin
+async def cmd_solvebuffer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id if update.effective_user else 0
+    model = (context.args[0].strip().upper() if context.args else "G")[:1]
+    if model not in ("G", "P", "D"):
+        await warn_html(update, "Solve Buffer", "Usage: <code>/solvebuffer [G|P|D]</code>")
+        return
+    running = context.application.bot_data.setdefault(_SOLVEBUFFER_RUNNING_KEY, set())
+    if uid in running:
+        await warn(update, "Solve Buffer", "A buffer solve is already running for you.")
+        return
+
+    todo = [(rid, payload) for rid, payload in buffer_list(uid) if _payload_needs_answer(payload)]
+    if not todo:
+        await info_html(update, "Solve Buffer", "Every buffered question already has an answer.")
+        return
+
+    running.add(uid)
+    try:
+        batches = [todo[i:i + SOLVEBUFFER_BATCH_SIZE] for i in range(0, len(todo), SOLVEBUFFER_BATCH_SIZE)]
+        totals = {"batch_calls": 0, "single_calls": 0, "cache_hits": 0, "failed": 0}
+        done = 0
+        status = await update.message.reply_text(
+            _solvebuffer_progress_html(0, len(todo), 0, len(batches), totals),
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        )
+        for batch_no, batch in enumerate(batches, start=1):
+            out = await _run_blocking("ADMIN", _solvebuffer_batch_job, model, batch)
+            for k, v in out["stats"].items():
+                totals[k] += v
+            for row_id, question, opts, res in out["reask"]:
+                totals["single_calls"] += 1
+                single = None
+                try:
+                    single = await _run_blocking("ADMIN", _solvebuffer_single_job, model, question, opts)
+                except Exception as e:
+                    logging.warning("solvebuffer single call failed: %s", e)
+                if single or res:
+                    out["results"][row_id] = single or res  # low-confidence batch answer beats nothing
+                else:
+                    totals["failed"] += 1
+            for row_id, payload in batch:
+                res = out["results"].get(row_id)
+                if not res:
+                    continue
+                payload = dict(payload)
+                payload["answer"] = int(res.get("answer", 0) or 0)
+                if not str(payload.get("explanation", "") or "").strip() and res.get("explanation"):
+                    payload["explanation"] = clean_latex(str(res.get("explanation") or ""))
+                buffer_update_payload(uid, row_id, payload)
+                done += 1
+            with contextlib.suppress(Exception):
+                await status.edit_text(
+                    _solvebuffer_progress_html(done, len(todo), batch_no, len(batches), totals),
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True,
+                )
+        db_log("INFO", "solvebuffer_done", {"admin_id": uid, "model": model, "total": len(todo), "answered": done, **totals})
+        body = (
+            f"Answered: <b>{h(done)}/{h(len(todo))}</b>\n"
+            f"AI calls: <code>{h(totals['batch_calls'] + totals['single_calls'])}</code> "
+            f"(batch {h(totals['batch_calls'])}, re-asked {h(totals['single_calls'])}) · cache <code>{h(totals['cache_hits'])}</code>"
+        )
+        if totals["failed"]:
+            body += f"\n\n⚠️ <code>{h(totals['failed'])}</code> question(s) still have <code>answer=0</code>."
+        with contextlib.suppress(Exception):
+            await status.edit_text(ui_box_html("Buffer Solved", body, emoji="✅"), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    except Exception as e:
+        db_log("ERROR", "solvebuffer_failed", {"admin_id": uid, "error": str(e)})
+        await err(update, "Solve Buffer", "AI backend is temporarily unavailable. Answers saved so far are kept.")
+    finally:
+        running.discard(uid)
+
+
+PRIVATE_COMMAND_SECTIONS["admin"].append(("solvebuffer", "Fill missing answers in your buffer with AI"))
+PREFERRED_ALIASES["solvebuffer"] = "sb"
+COMMAND_ALIAS_REGISTRY["solvebuffer"] = ["sb"]
+
+_old_build_app_20261019e = build_app
+
+
+def build_app() -> Application:
+    app = _old_build_app_20261019e()
+    private_filter = filters.ChatType.PRIVATE
+    _register_dual_command(app, "solvebuffer", cmd_solvebuffer, private_filter)
+    _register_dual_command(app, "sb", cmd_solvebuffer, private_filter)
+    return app
+
+# ===== END BATCH BUFFER SOLVER PATCH =====
+
+
+# ===== ALBUM-AWARE VISION EXTRACTION PATCH (2026-10-19f) =====
+# Goal:
+# 1) Photos sent as one album (same media_group_id) are collected and processed together.
+# 2) Album pages are extracted concurrently on a bounded vision worker pool, each with
+#    a VISION_JOB_TIMEOUT_SECONDS limit. Single images stay on the fair AI scheduler.
+# 3) Buffer rows are appended in page order; one progress message is edited in place.
+VISION_WORKERS = max(1, int(os.getenv("VISION_WORKERS", "4") or "4"))
+VISION_JOB_TIMEOUT_SECONDS = max(10.0, float(os.getenv("VISION_JOB_TIMEOUT_SECONDS", "120") or "120"))
+_ALBUM_COLLECT_SECONDS = 1.2
+_ALBUM_PROGRESS_EDIT_SECONDS = 1.5
+_VISION_ALBUMS_KEY = "_vision_albums"
+
+_VISION_EXECUTOR = ThreadPoolExecutor(max_workers=VISION_WORKERS, thread_name_prefix="vision")
+_VISION_SEM = asyncio.Semaphore(VISION_WORKERS)
+
+
+async def _run_vision_blocking(fn, *args, **kwargs):
+    """Like _run_blocking, but on the dedicated vision pool so album pages do not
+    take every slot of the role pools."""
+    loop = asyncio.get_running_loop()
+    async with _VISION_SEM:
+        fut = loop.run_in_executor(_VISION_EXECUTOR, lambda: fn(*args, **kwargs))
+        return await asyncio.wait_for(fut, timeout=VISION_JOB_TIMEOUT_SECONDS)
+
+
+def _message_user_id(msg) -> int:
+    user = getattr(msg, "from_user", None)
+    return int(user.id) if user else 0
+
+
+async def _message_image_file(msg):
+    if msg.photo:
+        return await msg.photo[-1].get_file()
+    if msg.document and str(getattr(msg.document, "mime_type", "") or "").startswith("image/"):
+        return await msg.document.get_file()
+    return None
+
+
+async def _extract_page_items(msg, *, album: bool = False) -> List[Dict[str, Any]]:
+    tg_file = await _message_image_file(msg)
+    if tg_file is None:
+        return []
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        local_path = f.name
+    try:
+        await tg_file.download_to_drive(local_path)
+        if album:
+            return await _run_vision_blocking(gemini_extract_mcq_from_image_rest, local_path)
+        return await _run_blocking(_role_of(_message_user_id(msg)), gemini_extract_mcq_from_image_rest, local_path)
+    finally:
+        with contextlib.suppress(Exception):
+            os.remove(local_path)
+
+
+def _album_progress_html(done: int, total: int, found: int, failed: int) -> str:
+    body = f"Pages: <b>{h(done)}/{h(total)}</b>\nQuestions found: <code>{h(found)}</code>"
+    if failed:
+        body += f"\nFailed pages: <code>{h(failed)}</code>"
+    return ui_box_html("Scanning Album", body, emoji="⏳")
+
+
+async def _process_album(context: ContextTypes.DEFAULT_TYPE, album: Dict[str, Any]) -> None:
+    uid = int(album["uid"])
+    pages = sorted(album["messages"], key=lambda m: int(m.message_id))
+    total = len(pages)
+    state = {"done": 0, "found": 0, "failed": 0, "last_edit": 0.0}
+    status = None
+    with contextlib.suppress(Exception):
+        status = await pages[0].reply_text(_album_progress_html(0, total, 0, 0), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    async def _edit_progress(force: bool = False) -> None:
+        now_ts = time.time()
+        if status is None or (not force and now_ts - state["last_edit"] < _ALBUM_PROGRESS_EDIT_SECONDS):
+            return
+        state["last_edit"] = now_ts
+        with contextlib.suppress(Exception):
+            await status.edit_text(
+                _album_progress_html(state["done"], total, state["found"], state["failed"]),
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            )
+
+    async def _one(page_no: int, msg) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        try:
+            items = await _extract_page_items(msg, album=True)
+            state["found"] += len(items)
+            return items, None
+        except Exception as e:
+            state["failed"] += 1
+            db_log("ERROR", "image_extract_failed", {"user_id": uid, "page": page_no, "error": str(e)})
+            return [], str(e)
+        finally:
+            state["done"] += 1
+            await _edit_progress()
+
+    results = await asyncio.gather(*[_one(i, m) for i, m in enumerate(pages, start=1)])
+
+    added = 0
+    failed_pages: List[int] = []
+    keep_explain = explain_mode_on(uid)
+    room = max(0, MAX_BUFFERED_QUESTIONS - buffer_count(uid))
+    for page_no, (items, error) in enumerate(results, start=1):
+        if error is not None:
+            failed_pages.append(page_no)
+        for payload in items:
+            if added >= room:
+                break
+            if not keep_explain:
+                payload["explanation"] = ""
+            buffer_add(uid, payload)
+            added += 1
+
+    body = (
+        f"Pages: <b>{h(total)}</b> · questions added: <code>{h(added)}</code>\n"
+        f"Total buffered: <code>{h(buffer_count(uid))}</code>"
+    )
+    if failed_pages:
+        body += f"\n\n⚠️ Failed page(s): <code>{h(', '.join(str(p) for p in failed_pages))}</code>"
+    if added < state["found"]:
+        body += f"\n⚠️ Buffer limit reached (<code>{h(MAX_BUFFERED_QUESTIONS)}</code>)."
+    title, emoji = ("Album Processed", "✅") if added else ("No Questions Found", "⚠️")
+    html = ui_box_html(title, body, emoji=emoji, footer_html="Use <code>/done</code> to export")
+    if status is not None:
+        with contextlib.suppress(Exception):
+            await status.edit_text(html, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+    with contextlib.suppress(Exception):
+        await pages[0].reply_text(html, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+async def _flush_album_later(context: ContextTypes.DEFAULT_TYPE, key: str) -> None:
+    await asyncio.sleep(_ALBUM_COLLECT_SECONDS)
+    album = context.application.bot_data.get(_VISION_ALBUMS_KEY, {}).pop(key, None)
+    if album and album["messages"] and not album["blocked"]:
+        await _process_album(context, album)
+
+
+_prev_handle_image_20261019f = handle_image
+
+
+async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
+    if not msg or not msg.media_group_id or not update.effective_user:
+        return await _prev_handle_image_20261019f(update, context)
+
+    ensure_user(update)
+    uid = update.effective_user.id
+    if is_banned(uid) or not is_private_chat(update) or not can_use_vision(uid) or not vision_mode_on(uid):
+        return
+    if not GEMINI_API_KEY:
+        await safe_reply(update, f"❌ {ui_box_html('Gemini API Key Missing', _gemini_env_missing_message(), emoji='❌')}")
+        return
+
+    albums = context.application.bot_data.setdefault(_VISION_ALBUMS_KEY, {})
+    key = f"{uid}:{msg.media_group_id}"
+    album = albums.get(key)
+    if album is None:
+        album = {"uid": uid, "messages": [], "task": None, "blocked": buffer_count(uid) >= MAX_BUFFERED_QUESTIONS}
+        albums[key] = album
+        if album["blocked"]:
+            await warn(update, "Buffer Limit Reached", f"You have {MAX_BUFFERED_QUESTIONS} questions buffered.\n\nUse /done to export or /clear to reset.")
+    if not album["blocked"]:
+        album["messages"].append(msg)
+    if album["task"] is not None:
+        album["task"].cancel()
+    album["task"] = asyncio.create_task(_flush_album_later(context, key))
+
+# ===== END ALBUM-AWARE VISION EXTRACTION PATCH =====
+
+
+# ===== IN-MEMORY VISION UPLOAD PATCH (2026-10-19g) =====
+# Goal:
+# 1) Download photos into memory (no temp .jpg round trip).
+# 2) Preprocess before upload: downscale to VISION_MAX_EDGE, grayscale + autocontrast
+#    for paper scans, JPEG re-encode at VISION_JPEG_QUALITY. A scan with coloured
+#    highlights or tick marks keeps its colour: the extraction prompt reads the marked
+#    answer from them. Needs Pillow (optional); without it the original bytes are sent
+#    unchanged.
+# 3) Base64 + request payloads are built once per image and reused by every
+#    model / JSON-mode attempt and every extraction retry.
+import io
+
+VISION_MAX_EDGE = max(512, int(os.getenv("VISION_MAX_EDGE", "1600") or "1600"))
+VISION_JPEG_QUALITY = min(95, max(50, int(os.getenv("VISION_JPEG_QUALITY", "82") or "82")))
+_SCAN_SATURATION_MAX = 28  # mean HSV saturation (0-255) below this is treated as a paper scan
+_SCAN_MARK_SATURATION = 90  # a pixel this saturated (and not near-black) is ink colour, not paper
+_SCAN_MARK_MIN_PIXELS = 40  # coloured pixels (after removing speckle) that count as a pen / highlighter mark
+
+_VISION_UPLOAD_STATS: Dict[str, int] = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _sniff_image_mime(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _has_colour_marks(img) -> bool:
+    """True when a grey page carries strongly coloured strokes (pen ticks, highlighter).
+
+    Runs on the downscaled page, not a thumbnail: a thin tick averages away at 64 px.
+    The 3x3 median drops isolated chroma noise from phone cameras and JPEG but keeps
+    pen strokes two or more pixels wide.
+    """
+    from PIL import ImageChops, ImageFilter
+    _h, sat, val = img.convert("HSV").split()
+    marks = ImageChops.multiply(
+        sat.point(lambda v: 255 if v >= _SCAN_MARK_SATURATION else 0),
+        val.point(lambda v: 255 if v >= 60 else 0),
+    ).filter(ImageFilter.MedianFilter(3))
+    return marks.histogram()[255] >= _SCAN_MARK_MIN_PIXELS
+
+
+def preprocess_image_bytes(data: bytes) -> Tuple[bytes, str]:
+    """Downscale/normalize an image for vision upload. Returns (bytes, mime_type)."""
+    try:
+        from PIL import Image, ImageOps, ImageStat  # optional dependency
+    except ImportError:
+        return data, _sniff_image_mime(data)
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        resized = max(img.size) > VISION_MAX_EDGE
+        if resized:
+            img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+        if img.mode == "RGB":
+            thumb = img.copy()
+            thumb.thumbnail((64, 64))
+            if ImageStat.Stat(thumb.convert("HSV")).mean[1] < _SCAN_SATURATION_MAX and not _has_colour_marks(img):
+                img = img.convert("L")
+        if img.mode == "L":
+            img = ImageOps.autocontrast(img, cutoff=1)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+        encoded = out.getvalue()
+        if not resized and len(encoded) >= len(data):
+            return data, _sniff_image_mime(data)
+        return encoded, "image/jpeg"
+    except Exception as e:
+        logging.warning("Image preprocessing skipped: %s", e)
+        return data, _sniff_image_mime(data)
+
+
+class PreparedImage:
+    """Image bytes encoded once; vision payloads are cached per (prompt, json mode)."""
+
+    def __init__(self, data: bytes, mime_type: str):
+        self.mime_type = mime_type or "image/jpeg"
+        self.size = len(data)
+        self.b64 = base64.b64encode(data).decode("ascii")
+        self._payloads: Dict[Tuple[str, bool], Dict[str, Any]] = {}
+
+    def payload(self, prompt: str, force_json: bool) -> Dict[str, Any]:
+        key = (prompt, bool(force_json))
+        cached = self._payloads.get(key)
+        if cached is None:
+            cached = {
+                "contents": [{
+                    "role": "user",
+                    "parts": [
+                        {"text": prompt},
+                        {"inline_data": {"mime_type": self.mime_type, "data": self.b64}},
+                    ],
+                }],
+                "generationConfig": {
+                    "temperature": 0.1,
+                    "topP": 0.9,
+                    "maxOutputTokens": 4096,
+                },
+            }
+            if force_json:
+                cached["generationConfig"]["responseMimeType"] = "application/json"
+            self._payloads[key] = cached
+        return cached
+
+
+def prepare_image_for_vision(data: bytes) -> PreparedImage:
+    processed, mime_type = preprocess_image_bytes(bytes(data))
+    _VISION_UPLOAD_STATS["images"] += 1
+    _VISION_UPLOAD_STATS["bytes_in"] += len(data)
+    _VISION_UPLOAD_STATS["bytes_out"] += len(processed)
+    return PreparedImage(processed, mime_type)
+
+
+def _as_prepared_image(image: Any) -> PreparedImage:
+    if isinstance(image, PreparedImage):
+        return image
+    with open(image, "rb") as f:
+        return prepare_image_for_vision(f.read())
+
+
+def _build_gemini_vision_payload(image_path: Any, prompt: str, *, force_json: bool = False) -> Dict[str, Any]:
+    return _as_prepared_image(image_path).payload(prompt, force_json)
+
+
+def call_gemini_vision_rest(image_path: Any, prompt: str, force_json: bool = True) -> str:
+    """image_path may be a file path or a PreparedImage (preferred: no disk I/O)."""
+    if not GEMINI_API_KEYS:
+        raise RuntimeError("Gemini API key missing in Render environment.")
+
+    image = _as_prepared_image(image_path)
+    last_err: Optional[Exception] = None
+    json_modes = [True, False] if force_json else [False]
+    models = _all_vision_model_candidates()
+
+    for use_json_mode in json_modes:
+        payload = image.payload(prompt, use_json_mode)
+        for model in models:
+            try:
+                out = _call_gemini_generate_content_multi(model, payload, timeout_seconds=GEMINI_VISION_TIMEOUT_SECONDS)
+                if out and str(out).strip():
+                    return str(out).strip()
+            except Exception as e:
+                last_err = e
+                continue
+
+    raise RuntimeError(str(last_err or "Gemini vision backend is unavailable."))
+
+
+def _message_has_image(msg) -> bool:
+    return bool(msg.photo) or bool(msg.document and str(getattr(msg.document, "mime_type", "") or "").startswith("image/"))
+
+
+async def _download_message_image(msg) -> Optional[bytes]:
+    tg_file = await _message_image_file(msg)
+    if tg_file is None:
+        return None
+    return bytes(await tg_file.download_as_bytearray())
+
+
+def _extract_mcq_from_image_bytes(data: bytes) -> List[Dict[str, Any]]:
+    return gemini_extract_mcq_from_image_rest(prepare_image_for_vision(data))
+
+
+async def _extract_page_items(msg, *, album: bool = False) -> List[Dict[str, Any]]:
+    data = await _download_message_image(msg)
+    if not data:
+        return []
+    if album:
+        return await _run_vision_blocking(_extract_mcq_from_image_bytes, data)
+    return await _run_blocking(_role_of(_message_user_id(msg)), _extract_mcq_from_image_bytes, data)
+
+
+_prev_handle_image_20261019g = handle_image
+
+
+async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Private image/scan -> extract MCQs into buffer (in memory). Albums go through the album path."""
+    msg = update.message
+    if not msg or not update.effective_user or msg.media_group_id:
+        return await _prev_handle_image_20261019g(update, context)
+    ensure_user(update)
+    uid = update.effective_user.id
+    if is_banned(uid) or not is_private_chat(update) or not can_use_vision(uid) or not vision_mode_on(uid):
+        return
+    if buffer_count(uid) >= MAX_BUFFERED_QUESTIONS:
+        await warn(update, "Buffer Limit Reached", f"You have {MAX_BUFFERED_QUESTIONS} questions buffered.\n\nUse /done to export or /clear to reset.")
+        return
+    if not _message_has_image(msg):
+        return
+    if not GEMINI_API_KEY:
+        await safe_reply(update, f"❌ {ui_box_html('Gemini API Key Missing', _gemini_env_missing_message(), emoji='❌')}")
+        return
+
+    try:
+        items = await _extract_page_items(msg)
+        added = 0
+        for payload in items:
+            if buffer_count(uid) >= MAX_BUFFERED_QUESTIONS:
+                break
+            if not explain_mode_on(uid):
+                payload["explanation"] = ""
+            buffer_add(uid, payload)
+            added += 1
+
+        if added:
+            await ok_html(update, "Image Processed", f"<code>{h(added)}</code> question(s) extracted.\n\nTotal buffered: <code>{h(buffer_count(uid))}</code>", footer_html="Use <code>/done</code> to export")
+        else:
+            await warn(update, "No Questions Found", "No MCQs detected in image. Try a clearer scan or tighter crop.")
+    except Exception as e:
+        db_log("ERROR", "image_extract_failed", {"user_id": uid, "error": str(e)})
+        await err(update, "Image Extraction Failed", f"{h(str(e)[:220])}")
+
+
+_prev_ai_runtime_stats_lines_20261019g = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _VISION_UPLOAD_STATS
+    saved = 0 if not st["bytes_in"] else round(100.0 * (1 - st["bytes_out"] / float(st["bytes_in"])))
+    return _prev_ai_runtime_stats_lines_20261019g() + [
+        f"🖼 Vision Uploads: <code>{h(st['images'])}</code> image(s) · {h(st['bytes_out'] // 1024)} KB sent of {h(st['bytes_in'] // 1024)} KB (<b>{h(saved)}%</b> saved)",
+    ]
+
+# ===== END IN-MEMORY VISION UPLOAD PATCH =====
+
+
+# ===== VISION EXTRACTION CACHE PATCH (2026-10-19h) =====
+# Goal:
+# 1) Resent scans (same Telegram file_unique_id) fill the buffer without a download or vision call.
+# 2) Only exact file ids match. A perceptual hash cannot tell apart different question
+#    pages that share a layout, and a wrong match would stick to the new image.
+# 3) Results live in SQLite; least recently used rows beyond VISION_CACHE_MAX_ROWS are evicted.
+VISION_CACHE_MAX_ROWS = max(50, int(os.getenv("VISION_CACHE_MAX_ROWS", "2000") or "2000"))
+
+_VISION_CACHE_STATS: Dict[str, int] = {"id_hits": 0, "misses": 0, "evicted": 0}
+
+
+def _vision_cache_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    # Migration: the look-alike (phash) fallback could store another page's MCQs under a
+    # new file id. Those rows cannot be told apart, so the cache starts over once.
+    if _table_has_column(conn, "vision_extract_cache", "phash"):
+        cur.execute("DROP TABLE vision_extract_cache")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS vision_extract_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_unique_id TEXT UNIQUE,
+            items_json TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            last_used_at TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vision_extract_cache_used ON vision_extract_cache(last_used_at)")
+    conn.commit()
+    conn.close()
+
+
+_prev_db_init_20261019h = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019h()
+    _vision_cache_db_init()
+
+
+def _message_file_unique_id(msg) -> str:
+    if msg.photo:
+        return str(msg.photo[-1].file_unique_id or "")
+    if msg.document:
+        return str(getattr(msg.document, "file_unique_id", "") or "")
+    return ""
+
+
+def _vision_cache_hit(cur, row_id: int) -> None:
+    cur.execute("UPDATE vision_extract_cache SET hits=hits+1, last_used_at=? WHERE id=?", (now_iso(), row_id))
+
+
+def vision_cache_get_by_file_id(file_unique_id: str) -> Optional[List[Dict[str, Any]]]:
+    if not file_unique_id:
+        return None
+    conn = db_connect()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, items_json FROM vision_extract_cache WHERE file_unique_id=?", (file_unique_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        _vision_cache_hit(cur, int(row["id"]))
+        conn.commit()
+        _VISION_CACHE_STATS["id_hits"] += 1
+        return json.loads(row["items_json"] or "[]")
+    finally:
+        conn.close()
+
+
+def vision_cache_put(file_unique_id: str, items: List[Dict[str, Any]]) -> None:
+    if not items or not file_unique_id:
+        return
+    ts = now_iso()
+    conn = db_connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO vision_extract_cache(file_unique_id, items_json, created_at, last_used_at)
+            VALUES (?,?,?,?)
+            ON CONFLICT(file_unique_id) DO UPDATE SET items_json=excluded.items_json, last_used_at=excluded.last_used_at
+            """,
+            (file_unique_id, json.dumps(items, ensure_ascii=False), ts, ts),
+        )
+        cur.execute("SELECT COUNT(*) AS c FROM vision_extract_cache")
+        extra = int(cur.fetchone()["c"]) - VISION_CACHE_MAX_ROWS
+        if extra > 0:
+            cur.execute(
+                "DELETE FROM vision_extract_cache WHERE id IN (SELECT id FROM vision_extract_cache ORDER BY last_used_at ASC, id ASC LIMIT ?)",
+                (extra,),
+            )
+            _VISION_CACHE_STATS["evicted"] += extra
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _extract_mcq_from_image_bytes_cached(file_unique_id: str, data: bytes) -> List[Dict[str, Any]]:
+    _VISION_CACHE_STATS["misses"] += 1
+    items = _extract_mcq_from_image_bytes(data)
+    with contextlib.suppress(Exception):
+        vision_cache_put(file_unique_id, items)
+    return items
+
+
+async def _extract_page_items(msg, *, album: bool = False) -> List[Dict[str, Any]]:
+    file_unique_id = _message_file_unique_id(msg)
+    items = vision_cache_get_by_file_id(file_unique_id)
+    if items:
+        return items
+    data = await _download_message_image(msg)
+    if not data:
+        return []
+    if album:
+        return await _run_vision_blocking(_extract_mcq_from_image_bytes_cached, file_unique_id, data)
+    return await _run_blocking(_role_of(_message_user_id(msg)), _extract_mcq_from_image_bytes_cached, file_unique_id, data)
+
+
+_prev_ai_runtime_stats_lines_20261019h = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _VISION_CACHE_STATS
+    return _prev_ai_runtime_stats_lines_20261019h() + [
+        f"🗂 Vision Cache: file-id hits <b>{h(st['id_hits'])}</b> · misses <code>{h(st['misses'])}</code> · evicted <code>{h(st['evicted'])}</code>",
+    ]
+
+# ===== END VISION EXTRACTION CACHE PATCH =====
+
+
+# ===== LOCAL LENIENT JSON REPAIR PATCH (2026-10-19i) =====
+# Goal:
+# 1) Parse the malformed JSON models actually return without a second AI call:
+#    code fences, prose around the object, trailing/missing commas, smart or single
+#    quotes, unquoted keys, Python literals, comments, raw newlines and stray
+#    quotes inside strings, and truncated output.
+# 2) _extract_json_strict and _repair_to_json try the local parser first; the AI
+#    repair round trip only runs when nothing JSON-like can be recovered.
+# 3) A top-level array is only taken when the text starts with "["; otherwise the
+#    first "{" that decodes or repairs to an object wins (citations like "[1][2]"
+#    in prose are skipped). _extract_json_strict only ever returns a dict.
+_JSON_FENCE_RE = re.compile(r"```(?:json|JSON|javascript|js)?\s*(.*?)(?:```|$)", re.DOTALL)
+_JSON_NUMBER_RE = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?")
+_JSON_QUOTE_PAIRS = {'"': '"', "'": "'", "“": "”", "”": "”", "‘": "’", "’": "’"}
+_JSON_CLOSE_QUOTES = {'"': ('"',), "'": ("'",), "“": ("”", "“"), "”": ("”", "“"), "‘": ("’", "‘"), "’": ("’", "‘")}
+_JSON_WORDS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_JSON_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_JSON_VALUE_END = set(",}]:\n")
+
+_JSON_REPAIR_STATS: Dict[str, int] = {"strict": 0, "local": 0, "ai": 0, "failed": 0}
+
+
+class _JSONTruncated(Exception):
+    pass
+
+
+class _LenientJSONParser:
+    """Small recursive-descent parser that accepts the usual LLM JSON mistakes."""
+
+    def __init__(self, text: str):
+        self.s = text
+        self.n = len(text)
+        self.i = 0
+        self.truncated = False
+        self.pairs = 0
+
+    def _ws(self) -> None:
+        s, n = self.s, self.n
+        while self.i < n:
+            c = s[self.i]
+            if c in " \t\r\n\ufeff\u00a0":
+                self.i += 1
+            elif s.startswith("//", self.i):
+                j = s.find("\n", self.i)
+                self.i = n if j < 0 else j + 1
+            elif s.startswith("/*", self.i):
+                j = s.find("*/", self.i + 2)
+                self.i = n if j < 0 else j + 2
+            else:
+                break
+
+    def _eof(self) -> bool:
+        self._ws()
+        if self.i >= self.n:
+            self.truncated = True
+            return True
+        return False
+
+    def value(self) -> Any:
+        if self._eof():
+            raise _JSONTruncated()
+        c = self.s[self.i]
+        if c == "{":
+            return self._object()
+        if c == "[":
+            return self._array()
+        if c in _JSON_QUOTE_PAIRS:
+            return self._string()
+        m = _JSON_NUMBER_RE.match(self.s, self.i)
+        if m and m.end() >= self.n:
+            # "confidence": 8 may be the first digit of 85: drop it like a missing value.
+            self.i = self.n
+            self.truncated = True
+            raise _JSONTruncated()
+        if m and (self.s[m.end()] in _JSON_VALUE_END or self.s[m.end()] in " \t\r}]"):
+            self.i = m.end()
+            txt = m.group(0).lstrip("+")
+            try:
+                return int(txt) if re.fullmatch(r"-?\d+", txt) else float(txt)
+            except ValueError:
+                return txt
+        return self._word()
+
+    def _word(self) -> Any:
+        start = self.i
+        s, n = self.s, self.n
+        while self.i < n and s[self.i] not in ",:}]\n":
+            self.i += 1
+        word = s[start:self.i].strip()
+        if self.i >= n:
+            self.truncated = True
+            raise _JSONTruncated()  # "tru" / "Bangl" cut off mid-token
+        return _JSON_WORDS.get(word, word)
+
+    def _string(self) -> str:
+        s, n = self.s, self.n
+        closers = _JSON_CLOSE_QUOTES[s[self.i]]
+        self.i += 1
+        out: List[str] = []
+        while self.i < n:
+            c = s[self.i]
+            if c == "\\" and self.i + 1 < n:
+                nxt = s[self.i + 1]
+                if nxt in _JSON_SIMPLE_ESCAPES:
+                    out.append(_JSON_SIMPLE_ESCAPES[nxt])
+                    self.i += 2
+                elif nxt == "u" and re.fullmatch(r"[0-9a-fA-F]{4}", s[self.i + 2:self.i + 6] or ""):
+                    out.append(chr(int(s[self.i + 2:self.i + 6], 16)))
+                    self.i += 6
+                elif nxt in closers:
+                    out.append(nxt)
+                    self.i += 2
+                else:
+                    out.append(c)  # unknown escape (e.g. LaTeX \( ) -> keep the backslash
+                    self.i += 1
+                continue
+            if c in closers:
+                # A quote only closes the string when JSON structure follows it.
+                j = self.i + 1
+                while j < n and s[j] in " \t\r":
+                    j += 1
+                if j >= n or s[j] in ",:}]\n":
+                    self.i += 1
+                    return "".join(out)
+            out.append(c)
+            self.i += 1
+        self.truncated = True
+        return "".join(out)
+
+    def _object(self) -> Dict[str, Any]:
+        self.i += 1
+        out: Dict[str, Any] = {}
+        while True:
+            if self._eof():
+                return out
+            c = self.s[self.i]
+            if c == "}":
+                self.i += 1
+                return out
+            if c in ",;":
+                self.i += 1
+                continue
+            if c == "]":  # mismatched bracket: treat as the end of this object
+                return out
+            key = self._string() if c in _JSON_QUOTE_PAIRS else str(self._word())
+            if self._eof():
+                return out
+            if self.s[self.i] in ":=":
+                self.i += 1
+                self.pairs += 1
+            try:
+                val = self.value()
+            except _JSONTruncated:
+                return out
+            out[str(key)] = val
+            if self.truncated:
+                return out
+
+    def _array(self) -> List[Any]:
+        self.i += 1
+        out: List[Any] = []
+        while True:
+            if self._eof():
+                return out
+            c = self.s[self.i]
+            if c == "]":
+                self.i += 1
+                return out
+            if c in ",;:":
+                self.i += 1
+                continue
+            if c == "}":
+                return out
+            try:
+                val = self.value()
+            except _JSONTruncated:
+                return out
+            if self.truncated:
+                # Drop a container element that was cut off; keep complete ones.
+                if not isinstance(val, (dict, list)):
+                    out.append(val)
+                return out
+            out.append(val)
+
+
+def _lenient_json_loads(text: str) -> Any:
+    """Parse model output as JSON, repairing common mistakes locally. Raises ValueError.
+
+    A top-level array is only accepted when the text starts with "[" (after any code
+    fence); otherwise each "{" is tried in order, so prose such as "sources [1][2]"
+    before the object is skipped.
+    """
+    raw = str(text or "").strip().lstrip("\ufeff")
+    if not raw:
+        raise ValueError("Empty JSON text.")
+    fence = _JSON_FENCE_RE.search(raw)
+    if fence and fence.group(1).strip():
+        raw = fence.group(1).strip()
+    if raw.startswith("["):
+        with contextlib.suppress(ValueError):
+            return json.JSONDecoder().raw_decode(raw)[0]
+        parser = _LenientJSONParser(raw)
+        data = parser.value()
+        if data == [] and parser.truncated:
+            raise ValueError("JSON was empty after repair.")
+        return data
+    starts = [m.start() for m in re.finditer(r"\{", raw)]
+    if not starts:
+        raise ValueError("No JSON object found.")
+    decoder = json.JSONDecoder()
+    for start in starts:
+        with contextlib.suppress(ValueError):
+            return decoder.raw_decode(raw, start)[0]
+        parser = _LenientJSONParser(raw)
+        parser.i = start
+        with contextlib.suppress(_JSONTruncated):
+            data = parser.value()
+            # "{x}" in prose repairs to {"x": ""}; only take braces that had a key: value pair.
+            if isinstance(data, dict) and parser.pairs and (data or not parser.truncated):
+                return data
+    raise ValueError("No JSON object found.")
+
+
+def _extract_json_strict(text: str) -> Dict[str, Any]:
+    """Strict JSON first, then the local lenient parser. Raises ValueError unless an object is found."""
+    raw = (text or "").strip()
+    with contextlib.suppress(Exception):
+        data = json.loads(raw)
+        if isinstance(data, dict):
+            _JSON_REPAIR_STATS["strict"] += 1
+            return data
+    try:
+        data = _lenient_json_loads(raw)
+    except ValueError:
+        raise ValueError("Model did not return valid JSON.")
+    if not isinstance(data, dict):
+        raise ValueError("Model did not return a JSON object.")
+    _JSON_REPAIR_STATS["local"] += 1
+    return data
+
+
+_prev_repair_to_json_20261019i = _repair_to_json
+
+
+def _repair_to_json(raw_text: str, schema_hint: str = "", timeout_seconds: int = 18) -> Optional[Dict[str, Any]]:
+    with contextlib.suppress(ValueError):
+        data = _lenient_json_loads(raw_text)
+        if isinstance(data, dict):
+            _JSON_REPAIR_STATS["local"] += 1
+            return data
+    _JSON_REPAIR_STATS["ai"] += 1
+    data = _prev_repair_to_json_20261019i(raw_text, schema_hint=schema_hint, timeout_seconds=timeout_seconds)
+    if data is None:
+        _JSON_REPAIR_STATS["failed"] += 1
+    return data
+
+
+_prev_coerce_mcq_result_20261019i = _coerce_mcq_result
+
+
+def _coerce_mcq_result(raw_text: str, option_count: int) -> Optional[Dict[str, Any]]:
+    # The lenient parser keeps unquoted letters ("answer": B); map them to 1-5 first.
+    with contextlib.suppress(Exception):
+        data = _extract_json_strict(str(raw_text or ""))
+        ans = data.get("answer") if isinstance(data, dict) else None
+        if isinstance(ans, str) and not ans.strip().isdigit():
+            m = re.match(r"^\W*([A-Ea-e])\b", ans.strip())
+            data["answer"] = (ord(m.group(1).upper()) - 64) if m else 0
+            raw_text = json.dumps(data, ensure_ascii=False)
+    return _prev_coerce_mcq_result_20261019i(raw_text, option_count)
+
+
+_prev_ai_runtime_stats_lines_20261019i = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _JSON_REPAIR_STATS
+    return _prev_ai_runtime_stats_lines_20261019i() + [
+        f"🧰 JSON Parse: strict <code>{h(st['strict'])}</code> · repaired locally <b>{h(st['local'])}</b> · AI repair <code>{h(st['ai'])}</code> (failed <code>{h(st['failed'])}</code>)",
+    ]
+
+# ===== END LOCAL LENIENT JSON REPAIR PATCH =====
+
+
+# ===== ROLLING THREAD SUMMARY PATCH (2026-10-19j) =====
+# Goal:
+# 1) Once a private AI thread has more than _CHAT_SUMMARY_AFTER_MESSAGES unsummarized
+#    messages, older turns are folded into one stored summary row.
+# 2) Summaries are generated in the background after the answer has been delivered.
+# 3) Continuation prompts send summary + the last few turns, so prompt size stays flat.
+_CHAT_SUMMARY_AFTER_MESSAGES = 8
+_CHAT_RECENT_KEEP_MESSAGES = 4
+_CHAT_SUMMARY_MAX_CHARS = 1200
+
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thread-summary")
+_SUMMARY_PENDING: set = set()
+_SUMMARY_STATS: Dict[str, int] = {"generated": 0, "failed": 0}
+
+
+def _ai_thread_summary_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ai_thread_summaries (
+            thread_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_upto_id INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+_prev_db_init_20261019j = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019j()
+    _ai_thread_summary_db_init()
+
+
+def ai_thread_get_summary(thread_id: str) -> Tuple[str, int]:
+    if not thread_id:
+        return "", 0
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute("SELECT summary, covered_upto_id FROM ai_thread_summaries WHERE thread_id=?", (str(thread_id),))
+    row = cur.fetchone()
+    conn.close()
+    return (str(row["summary"] or ""), int(row["covered_upto_id"] or 0)) if row else ("", 0)
+
+
+def ai_thread_messages_after(thread_id: str, after_id: int, limit: int = _CHAT_HISTORY_MAX_TURNS) -> List[sqlite3.Row]:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT * FROM ai_thread_messages WHERE thread_id=? AND id>? ORDER BY id DESC LIMIT ?",
+        (str(thread_id), int(after_id or 0), max(1, int(limit))),
+    )
+    rows = list(cur.fetchall())[::-1]
+    conn.close()
+    return rows
+
+
+def _history_lines(rows: List[sqlite3.Row]) -> List[str]:
+    parts = []
+    for row in rows:
+        content = _compact_history_text(row["content"] or "")
+        if content:
+            parts.append(f"{'User' if str(row['role'] or '') == 'user' else 'Assistant'}: {content}")
+    return parts
+
+
+def _build_thread_continuation_input(thread_id: str, new_user_text: str) -> str:
+    summary, covered = ai_thread_get_summary(thread_id)
+    # Everything up to `covered` lives in the summary; only newer turns go in verbatim.
+    rows = ai_thread_messages_after(thread_id, covered, _CHAT_HISTORY_MAX_TURNS)
+    history = "\n".join(_history_lines(rows)).strip()
+    if len(history) > _CHAT_HISTORY_MAX_CHARS:
+        history = history[-_CHAT_HISTORY_MAX_CHARS:]
+    new_user_text = str(new_user_text or "").strip()
+    if not history and not summary:
+        return new_user_text
+    blocks = [
+        "Continue the same private chat thread. Use the previous conversation when relevant. "
+        "If the new user message changes the topic, answer the new message directly."
+    ]
+    if summary:
+        blocks.append(f"Summary of Earlier Conversation:\n{summary}")
+    if history:
+        blocks.append(f"Conversation History:\n{history}")
+    blocks.append(f"Current User Message:\n{new_user_text}")
+    return "\n\n".join(blocks).strip()
+
+
+def _build_thread_summary_prompt(old_summary: str, rows: List[sqlite3.Row]) -> str:
+    return (
+        "Summarize this tutoring conversation so it can be continued later.\n"
+        "Rules:\n"
+        "- Write in the same language the user writes in.\n"
+        "- Keep the topics, questions asked, key facts/answers given and any open follow-ups.\n"
+        f"- Plain text, at most {_CHAT_SUMMARY_MAX_CHARS // 2} characters. No greetings, no markdown headings.\n\n"
+        + (f"Existing summary:\n{old_summary}\n\n" if old_summary else "")
+        + "New messages to fold in:\n"
+        + "\n".join(_history_lines(rows))
+    )
+
+
+def ai_thread_refresh_summary(thread_id: str) -> bool:
+    """Blocking: fold older unsummarized turns into the stored summary. True if updated."""
+    old_summary, covered = ai_thread_get_summary(thread_id)
+    rows = ai_thread_messages_after(thread_id, covered, limit=10_000)
+    if len(rows) <= _CHAT_SUMMARY_AFTER_MESSAGES:
+        return False
+    fold = rows[:-_CHAT_RECENT_KEEP_MESSAGES]
+    summary, _model = _solve_text_via_prompt(_build_thread_summary_prompt(old_summary, fold), preferred="G")
+    summary = re.sub(r"\n{3,}", "\n\n", str(summary or "").strip())[:_CHAT_SUMMARY_MAX_CHARS]
+    if not summary:
+        return False
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO ai_thread_summaries(thread_id, summary, covered_upto_id, updated_at) VALUES (?,?,?,?)
+        ON CONFLICT(thread_id) DO UPDATE SET summary=excluded.summary, covered_upto_id=excluded.covered_upto_id, updated_at=excluded.updated_at
+        """,
+        (str(thread_id), summary, int(fold[-1]["id"]), now_iso()),
+    )
+    conn.commit()
+    conn.close()
+    return True
+
+
+def _summary_job(thread_id: str) -> None:
+    try:
+        if ai_thread_refresh_summary(thread_id):
+            _SUMMARY_STATS["generated"] += 1
+    except Exception as e:
+        _SUMMARY_STATS["failed"] += 1
+        logging.warning("Thread summary failed for %s: %s", thread_id, e)
+    finally:
+        _SUMMARY_PENDING.discard(thread_id)
+
+
+def schedule_thread_summary(thread_id: str) -> None:
+    """Queue a background summary refresh (one pending job per thread)."""
+    if not thread_id or thread_id in _SUMMARY_PENDING:
+        return
+    _SUMMARY_PENDING.add(thread_id)
+    _SUMMARY_EXECUTOR.submit(_summary_job, thread_id)
+
+
+_prev_ai_thread_upsert_bot_answer_20261019j = ai_thread_upsert_bot_answer
+
+
+def ai_thread_upsert_bot_answer(thread_id: str, content: str, chat_id: int, message_id: int, reply_to_message_id: int = 0, model_code: str = '', model_name: str = '') -> None:
+    _prev_ai_thread_upsert_bot_answer_20261019j(thread_id, content, chat_id, message_id, reply_to_message_id, model_code, model_name)
+    # Called after the answer message was edited in, so this never delays the reply.
+    with contextlib.suppress(Exception):
+        schedule_thread_summary(thread_id)
+
+
+_prev_ai_runtime_stats_lines_20261019j = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _SUMMARY_STATS
+    return _prev_ai_runtime_stats_lines_20261019j() + [
+        f"🧵 Thread Summaries: generated <b>{h(st['generated'])}</b> · failed <code>{h(st['failed'])}</code> · queued <code>{h(len(_SUMMARY_PENDING))}</code>",
+    ]
+
+# ===== END ROLLING THREAD SUMMARY PATCH =====
+
+
+# ===== FAIR AI JOB SCHEDULER PATCH (2026-10-19k) =====
+# Goal:
+# 1) One shared slot pool for blocking AI work with weighted fair sharing across roles
+#    (OWNER 4 : ADMIN 2 : USER 1) and a reserved slot for OWNER and ADMIN.
+# 2) Per-user queues served round-robin, with a per-user in-flight cap, so one
+#    member cannot occupy every slot.
+# 3) Waiting solver requests see their queue position; jobs that wait longer than
+#    their role's max wait are dropped instead of running for nobody.
+# 4) Queue depth / wait-time metrics in /ownerstats.
+from telegram.ext import TypeHandler
+
+SCHED_SLOTS = max(3, int(os.getenv("SCHED_SLOTS", "11") or "11"))
+SCHED_MAX_WORKERS = max(SCHED_SLOTS, int(os.getenv("SCHED_MAX_WORKERS", "24") or "24"))
+_SCHED_ROLES = (ROLE_OWNER, ROLE_ADMIN, ROLE_USER)  # highest priority first
+_SCHED_WEIGHTS = {ROLE_OWNER: 4.0, ROLE_ADMIN: 2.0, ROLE_USER: 1.0}
+_SCHED_RESERVED = {ROLE_OWNER: 1, ROLE_ADMIN: 1, ROLE_USER: 0}
+_SCHED_PER_USER_CAP = {ROLE_OWNER: 4, ROLE_ADMIN: 3, ROLE_USER: 2}
+_SCHED_MAX_WAIT_SECONDS = {ROLE_OWNER: 300.0, ROLE_ADMIN: 180.0, ROLE_USER: 60.0}
+_SCHED_FEEDBACK_SECONDS = 2.0
+
+_SCHED_EXECUTOR = ThreadPoolExecutor(max_workers=SCHED_MAX_WORKERS, thread_name_prefix="ai-job")
+_CURRENT_UID: "contextvars.ContextVar[int]" = contextvars.ContextVar("current_uid", default=0)
+# Per-task raise of the per-user cap for a known fan-out (e.g. Generate Quiz verification).
+_SCHED_CAP_OVERRIDE: "contextvars.ContextVar[int]" = contextvars.ContextVar("sched_cap_override", default=0)
+
+
+class SchedulerBusyError(RuntimeError):
+    pass
+
+
+class _SchedJob:
+    __slots__ = ("seq", "role", "uid", "cap", "enqueued", "expires_at", "admitted")
+
+    def __init__(self, seq: int, role: str, uid: int, max_wait: float, cap: int = 0):
+        self.seq = seq
+        self.role = role
+        self.uid = uid
+        self.cap = cap
+        self.enqueued = time.monotonic()
+        self.expires_at = self.enqueued + max_wait
+        self.admitted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _FairScheduler:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._seq = 0
+        self.running: Dict[str, int] = {r: 0 for r in _SCHED_ROLES}
+        self.user_running: Dict[Tuple[str, int], int] = {}
+        self.queues: Dict[str, "collections.OrderedDict[int, collections.deque]"] = {r: collections.OrderedDict() for r in _SCHED_ROLES}
+        self.vtime: Dict[str, float] = {r: 0.0 for r in _SCHED_ROLES}
+        self.waits: "collections.deque[float]" = collections.deque(maxlen=500)
+        self.stats: Dict[str, int] = {"admitted": 0, "queued": 0, "dropped": 0, "peak_depth": 0}
+
+    # -- bookkeeping -------------------------------------------------
+    def depth(self, role: Optional[str] = None) -> int:
+        roles = [role] if role else list(_SCHED_ROLES)
+        return sum(len(q) for r in roles for q in self.queues[r].values())
+
+    def in_flight(self) -> int:
+        return sum(self.running.values())
+
+    def position(self, job: _SchedJob) -> int:
+        """1-based position among queued jobs of the same role (FIFO approximation)."""
+        ahead = sum(1 for q in self.queues[job.role].values() for j in q if j.seq < job.seq)
+        return ahead + 1
+
+    def _user_cap(self, role: str, uid: int) -> int:
+        return self.limit if not uid else _SCHED_PER_USER_CAP.get(role, 2)
+
+    def _role_may_start(self, role: str) -> bool:
+        free = self.limit - self.in_flight()
+        if free <= 0:
+            return False
+        higher = _SCHED_ROLES[:_SCHED_ROLES.index(role)]
+        held_back = sum(max(0, _SCHED_RESERVED[r] - self.running[r]) for r in higher)
+        return free > held_back
+
+    def _next_job(self, role: str) -> Optional[_SchedJob]:
+        q = self.queues[role]
+        for uid in list(q.keys()):
+            jobs = q[uid]
+            if self.user_running.get((role, uid), 0) >= max(self._user_cap(role, uid), jobs[0].cap):
+                continue
+            job = jobs.popleft()
+            if jobs:
+                q.move_to_end(uid)  # round-robin: this user goes to the back
+            else:
+                del q[uid]
+            return job
+        return None
+
+    def _pump(self) -> None:
+        while self.in_flight() < self.limit:
+            candidates = [r for r in _SCHED_ROLES if self.queues[r] and self._role_may_start(r)]
+            started = False
+            for role in sorted(candidates, key=lambda r: self.vtime[r]):
+                job = self._next_job(role)
+                if job is None:
+                    continue
+                if job.admitted.done():  # caller already gave up
+                    continue
+                self._start(job)
+                started = True
+                break
+            if not started:
+                return
+
+    def _start(self, job: _SchedJob) -> None:
+        role = job.role
+        active = [self.vtime[r] for r in _SCHED_ROLES if self.running[r] and r != role]
+        if not self.running[role] and active:
+            self.vtime[role] = max(self.vtime[role], min(active))  # no credit for idle time
+        self.vtime[role] += 1.0 / _SCHED_WEIGHTS[role]
+        self.running[role] += 1
+        key = (role, job.uid)
+        self.user_running[key] = self.user_running.get(key, 0) + 1
+        self.stats["admitted"] += 1
+        self.waits.append(time.monotonic() - job.enqueued)
+        job.admitted.set_result(True)
+
+    def _remove(self, job: _SchedJob) -> None:
+        q = self.queues[job.role].get(job.uid)
+        if q is None:
+            return
+        with contextlib.suppress(ValueError):
+            q.remove(job)
+        if not q:
+            self.queues[job.role].pop(job.uid, None)
+
+    # -- public API ---------------------------------------------------
+    async def acquire(self, role: str, uid: int, on_wait=None) -> _SchedJob:
+        role = role if role in _SCHED_ROLES else ROLE_USER
+        self._seq += 1
+        job = _SchedJob(self._seq, role, int(uid or 0), _SCHED_MAX_WAIT_SECONDS[role], _SCHED_CAP_OVERRIDE.get())
+        self.queues[role].setdefault(job.uid, collections.deque()).append(job)
+        self._pump()
+        if not job.admitted.done():
+            self.stats["queued"] += 1
+            self.stats["peak_depth"] = max(self.stats["peak_depth"], self.depth())
+        last_pos = 0
+        try:
+            while not job.admitted.done():
+                remaining = job.expires_at - time.monotonic()
+                if remaining <= 0:
+                    self._remove(job)
+                    self.stats["dropped"] += 1
+                    raise SchedulerBusyError("The bot is busy right now. Please try again in a minute.")
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(asyncio.shield(job.admitted), timeout=min(_SCHED_FEEDBACK_SECONDS, remaining))
+                if not job.admitted.done() and on_wait is not None:
+                    pos = self.position(job)
+                    if pos != last_pos:
+                        last_pos = pos
+                        with contextlib.suppress(Exception):
+                            await on_wait(pos)
+        except BaseException:
+            if job.admitted.done() and not job.admitted.cancelled():
+                self.release(job)  # admitted while we were being cancelled
+            else:
+                job.admitted.cancel()
+                self._remove(job)
+            raise
+        return job
+
+    def release(self, job: _SchedJob) -> None:
+        self.running[job.role] = max(0, self.running[job.role] - 1)
+        key = (job.role, job.uid)
+        left = self.user_running.get(key, 0) - 1
+        if left > 0:
+            self.user_running[key] = left
+        else:
+            self.user_running.pop(key, None)
+        self._pump()
+
+    def wait_percentile(self, p: float) -> float:
+        if not self.waits:
+            return 0.0
+        vals = sorted(self.waits)
+        return vals[min(len(vals) - 1, int(len(vals) * p))]
+
+
+_SCHEDULER = _FairScheduler(SCHED_SLOTS)
+
+
+async def _queue_position_feedback(pos: int) -> None:
+    target = _STREAM_EDIT_TARGET.get()
+    if not target:
+        return
+    await target["bot"].edit_message_text(
+        chat_id=target["chat_id"],
+        message_id=target["message_id"],
+        text=ui_box_text("Queued", f"Many requests are running right now.\nYour position: {pos}", emoji="⏳"),
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
+
+
+async def _run_blocking(role: str, fn, *args, timeout: float | None = None, **kwargs):
+    """Run a blocking function on the shared AI pool after fair-queue admission.
+
+    Admission is per role (weighted) and per user (round-robin, capped); the
+    user comes from the update being handled (see _remember_update_user).
+    """
+    job = await _SCHEDULER.acquire((role or "").upper(), _CURRENT_UID.get(), on_wait=_queue_position_feedback)
+    try:
+        fut = asyncio.get_running_loop().run_in_executor(_SCHED_EXECUTOR, lambda: fn(*args, **kwargs))
+        if timeout is not None:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        return await fut
+    finally:
+        _SCHEDULER.release(job)
+
+
+async def _remember_update_user(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = getattr(update, "effective_user", None)
+    _CURRENT_UID.set(int(user.id) if user else 0)
+
+
+_old_build_app_20261019k = build_app
+
+
+def build_app() -> Application:
+    app = _old_build_app_20261019k()
+    # Runs first for every update; later handlers of the same update share the context.
+    app.add_handler(TypeHandler(Update, _remember_update_user), group=-1000)
+    return app
+
+
+_prev_ai_runtime_stats_lines_20261019k = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    s = _SCHEDULER
+    running = " · ".join(f"{r.lower()} {s.running[r]}" for r in _SCHED_ROLES)
+    queued = " · ".join(f"{r.lower()} {s.depth(r)}" for r in _SCHED_ROLES)
+    return _prev_ai_runtime_stats_lines_20261019k() + [
+        f"🚦 Scheduler: in-flight <b>{h(s.in_flight())}/{h(s.limit)}</b> ({h(running)})",
+        f"📥 Queue: <b>{h(s.depth())}</b> ({h(queued)}) · peak <code>{h(s.stats['peak_depth'])}</code> · dropped <code>{h(s.stats['dropped'])}</code>",
+        f"⏱ Wait p50/p95: <code>{s.wait_percentile(0.5):.2f}s</code> / <code>{s.wait_percentile(0.95):.2f}s</code> · admitted <code>{h(s.stats['admitted'])}</code>",
+    ]
+
+# ===== END FAIR AI JOB SCHEDULER PATCH =====
+
+
+# ===== ADAPTIVE AI CONCURRENCY PATCH (2026-10-19l) =====
+# Goal:
+# 1) The fair scheduler's slot limit follows backend health (AIMD, like TCP):
+#    +1 slot per healthy window while work is queueing, x0.7 on timeouts / 429s
+#    or when p95 latency / error rate go over target.
+# 2) 429s and timeouts swallowed inside backend fallbacks still count as overload.
+# 3) Current limit and the last adjustment are shown in /ownerstats.
+# 4) Only USER-role jobs feed the limiter. Background threads (model catalog refresh,
+#    telemetry flush, session pool) and owner/admin bulk jobs neither record samples
+#    nor count overloads, so they cannot shrink the limit for user requests.
+AI_LIMIT_MIN = max(3, int(os.getenv("AI_LIMIT_MIN", "3") or "3"))
+AI_LIMIT_MAX = max(AI_LIMIT_MIN, min(SCHED_MAX_WORKERS, int(os.getenv("AI_LIMIT_MAX", str(SCHED_MAX_WORKERS)) or SCHED_MAX_WORKERS)))
+AI_TARGET_P95_SECONDS = float(os.getenv("AI_TARGET_P95_SECONDS", "25") or "25")
+AI_TARGET_ERROR_RATE = float(os.getenv("AI_TARGET_ERROR_RATE", "0.15") or "0.15")
+_AIMD_WINDOW = 10  # completed jobs per evaluation
+_AIMD_BACKOFF = 0.7
+_AIMD_COOLDOWN_SECONDS = 5.0
+_AIMD_SAMPLING = threading.local()  # .active is True while a USER job runs on this thread
+
+
+class _AdaptiveLimiter:
+    def __init__(self, scheduler: "_FairScheduler"):
+        self.scheduler = scheduler
+        self.scheduler.limit = max(AI_LIMIT_MIN, min(AI_LIMIT_MAX, scheduler.limit))
+        self._lock = threading.Lock()
+        self._overloads = 0  # bumped from worker threads, consumed on the loop
+        self.window: List[Tuple[float, bool]] = []
+        self.saturated = False
+        self.last_decrease = 0.0
+        self.last_change = "start"
+        self.stats: Dict[str, int] = {"increases": 0, "decreases": 0, "overloads": 0, "timeouts": 0}
+
+    def note_overload(self) -> None:
+        """Thread-safe: a backend answered 429 / timed out even if a fallback then succeeded.
+
+        Ignored unless the calling thread is running a USER job (see _run_blocking below).
+        """
+        if not getattr(_AIMD_SAMPLING, "active", False):
+            return
+        with self._lock:
+            self._overloads += 1
+
+    def _take_overloads(self) -> int:
+        with self._lock:
+            n, self._overloads = self._overloads, 0
+        return n
+
+    def _set_limit(self, limit: int, why: str) -> None:
+        old = self.scheduler.limit
+        limit = max(AI_LIMIT_MIN, min(AI_LIMIT_MAX, int(limit)))
+        if limit == old:
+            return
+        self.scheduler.limit = limit
+        self.stats["increases" if limit > old else "decreases"] += 1
+        self.last_change = f"{old}→{limit} ({why})"
+        if limit > old:
+            self.scheduler._pump()
+
+    def _decrease(self, why: str) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < _AIMD_COOLDOWN_SECONDS:
+            return  # one back-off per burst of failures
+        self.last_decrease = now
+        self.window.clear()
+        self._set_limit(int(self.scheduler.limit * _AIMD_BACKOFF), why)
+
+    def record(self, latency: float, outcome: str) -> None:
+        """Called on the event loop after each job; outcome is ok / error / timeout / ratelimit."""
+        overloads = self._take_overloads()
+        self.stats["overloads"] += overloads
+        if outcome == "timeout":
+            self.stats["timeouts"] += 1
+        elif outcome == "ratelimit":
+            self.stats["overloads"] += 1
+        if overloads or outcome in ("timeout", "ratelimit"):
+            self._decrease("timeout" if outcome == "timeout" else "429")
+            return
+        self.window.append((latency, outcome == "ok"))
+        # Only grow when the limit is what holds work back.
+        self.saturated = self.saturated or self.scheduler.depth() > 0
+        if len(self.window) < _AIMD_WINDOW:
+            return
+        lat = sorted(x[0] for x in self.window)
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        err = sum(1 for x in self.window if not x[1]) / len(self.window)
+        saturated = self.saturated
+        self.window.clear()
+        self.saturated = False
+        if p95 > AI_TARGET_P95_SECONDS:
+            self._decrease(f"p95 {p95:.1f}s")
+        elif err > AI_TARGET_ERROR_RATE:
+            self._decrease(f"errors {err:.0%}")
+        elif saturated:
+            self._set_limit(self.scheduler.limit + 1, f"p95 {p95:.1f}s")
+
+
+_AI_LIMITER = _AdaptiveLimiter(_SCHEDULER)
+_prev_run_blocking_20261019l = _run_blocking
+
+
+async def _run_blocking(role: str, fn, *args, timeout: float | None = None, **kwargs):
+    started: List[float] = []
+    sampled = (role or "").upper() == ROLE_USER
+
+    def _timed():
+        started.append(time.monotonic())
+        _AIMD_SAMPLING.active = sampled
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _AIMD_SAMPLING.active = False
+
+    outcome = "ok"
+    try:
+        return await _prev_run_blocking_20261019l(role, _timed, timeout=timeout)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    except RateLimitError:
+        outcome = "ratelimit"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        if started and sampled:  # jobs dropped or cancelled in the queue say nothing about backends
+            _AI_LIMITER.record(time.monotonic() - started[0], outcome)
+
+
+_prev_requests_with_retries_20261019l = _requests_with_retries
+
+
+def _requests_with_retries(method, url: str, *, json_payload=None, params=None, timeout=25, max_tries=3):
+    try:
+        return _prev_requests_with_retries_20261019l(method, url, json_payload=json_payload, params=params, timeout=timeout, max_tries=max_tries)
+    except (RateLimitError, requests.exceptions.Timeout):
+        _AI_LIMITER.note_overload()
+        raise
+
+
+_prev_chat_with_gemini_20261019l = chat_with_gemini
+
+
+def chat_with_gemini(prompt, on_text=None):
+    result = _prev_chat_with_gemini_20261019l(prompt, on_text=on_text)
+    err = str(result.get("error") or "").lower() if not result.get("success") else ""
+    if err and ("http 429" in err or "timed out" in err or "timeout" in err):
+        _AI_LIMITER.note_overload()
+    return result
+
+
+_prev_ai_runtime_stats_lines_20261019l = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    lim = _AI_LIMITER
+    st = lim.stats
+    return _prev_ai_runtime_stats_lines_20261019l() + [
+        f"📈 Adaptive Limit: <b>{h(lim.scheduler.limit)}</b> (range {h(AI_LIMIT_MIN)}–{h(AI_LIMIT_MAX)}) · last <code>{h(lim.last_change)}</code>",
+        f"↕️ Limit Changes: up <code>{h(st['increases'])}</code> · down <code>{h(st['decreases'])}</code> · 429/overload <code>{h(st['overloads'])}</code> · timeouts <code>{h(st['timeouts'])}</code>",
+    ]
+
+# ===== END ADAPTIVE AI CONCURRENCY PATCH =====
+
+
+# ===== AI REQUEST DEADLINE PATCH (2026-10-19m) =====
+# Goal:
+# 1) Every _run_blocking job carries an AIDeadline (explicit timeout, else a per-role budget)
+#    that the worker thread can see through a thread-local. Album pages on the vision
+#    pool get one too, sized to VISION_JOB_TIMEOUT_SECONDS.
+# 2) _requests_with_retries, chat_with_gemini, query_ai and the text / MCQ backend chains
+#    check the remaining budget: per-try timeouts are clamped, retries/backoffs and
+#    fallback hops that cannot finish in time are skipped, and work stops once the
+#    deadline is cancelled or expired. The budget starts when the job is admitted.
+# 3) A deadline is cancelled when the asyncio side gives up (timeout / task cancelled) or
+#    when a newer request for the same solver message supersedes it.
+AI_REQUEST_BUDGET_SECONDS = {
+    ROLE_OWNER: float(os.getenv("AI_OWNER_BUDGET_SECONDS", "240") or "240"),
+    ROLE_ADMIN: float(os.getenv("AI_ADMIN_BUDGET_SECONDS", "240") or "240"),
+    ROLE_USER: float(os.getenv("AI_USER_BUDGET_SECONDS", "90") or "90"),
+}
+_DEADLINE_MIN_ATTEMPT_SECONDS = 3.0  # not worth starting an HTTP attempt with less than this
+
+_CURRENT_DEADLINE = threading.local()
+_ACTIVE_DEADLINES: Dict[Tuple[int, int], "AIDeadline"] = {}
+_DEADLINE_STATS: Dict[str, int] = {"expired": 0, "superseded": 0, "abandoned": 0, "retries_skipped": 0}
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class AIDeadline:
+    """Monotonic time budget for one user request, shared with its worker thread."""
+
+    def __init__(self, seconds: float):
+        self.seconds = max(0.0, float(seconds))
+        self.expires_at = time.monotonic() + self.seconds
+        self.reason = ""
+        self._cancelled = threading.Event()
+
+    def start(self) -> None:
+        """Restart the budget when the job leaves the queue, in step with wait_for."""
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self) -> float:
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cancel(self, reason: str) -> None:
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def check(self) -> None:
+        if self._cancelled.is_set():
+            raise DeadlineExceeded(f"AI request {self.reason or 'cancelled'}.")
+        if self.expired():
+            raise DeadlineExceeded("AI request timed out. Please try again.")
+
+    def clamp(self, seconds: float) -> float:
+        return min(float(seconds), self.remaining())
+
+    def sleep(self, seconds: float) -> None:
+        """Backoff sleep that wakes up early when the request is cancelled."""
+        self._cancelled.wait(max(0.0, min(seconds, self.remaining())))
+
+
+def _current_deadline() -> Optional[AIDeadline]:
+    return getattr(_CURRENT_DEADLINE, "value", None)
+
+
+def _call_with_deadline(deadline: AIDeadline, fn, *args, **kwargs):
+    _CURRENT_DEADLINE.value = deadline
+    try:
+        # Queue time is the scheduler's business (it drops jobs that wait too long).
+        deadline.start()
+        deadline.check()  # superseded or abandoned while queued
+        return fn(*args, **kwargs)
+    finally:
+        _CURRENT_DEADLINE.value = None
+
+
+_prev_run_blocking_20261019m = _run_blocking
+
+
+async def _run_blocking(role: str, fn, *args, timeout: float | None = None, **kwargs):
+    role_key = (role or "").upper()
+    if timeout is not None:
+        # Both clocks start at admission; the extra second lets wait_for fire first so
+        # callers still see asyncio.TimeoutError.
+        budget = timeout + 1.0
+    else:
+        budget = AI_REQUEST_BUDGET_SECONDS.get(role_key, AI_REQUEST_BUDGET_SECONDS[ROLE_USER])
+    deadline = AIDeadline(budget)
+    target = _STREAM_EDIT_TARGET.get()
+    slot_key = (int(target["chat_id"]), int(target["message_id"])) if target else None
+    if slot_key is not None:
+        older = _ACTIVE_DEADLINES.get(slot_key)
+        if older is not None:
+            older.cancel("superseded by a newer request")
+            _DEADLINE_STATS["superseded"] += 1
+        _ACTIVE_DEADLINES[slot_key] = deadline
+    try:
+        return await _prev_run_blocking_20261019m(role, _call_with_deadline, deadline, fn, *args, timeout=timeout, **kwargs)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # The worker thread keeps running after wait_for gives up; tell it to stop.
+        deadline.cancel("abandoned")
+        _DEADLINE_STATS["abandoned"] += 1
+        raise
+    except DeadlineExceeded:
+        if not deadline.reason:  # superseded ones are already counted
+            _DEADLINE_STATS["expired"] += 1
+        raise
+    finally:
+        if slot_key is not None and _ACTIVE_DEADLINES.get(slot_key) is deadline:
+            _ACTIVE_DEADLINES.pop(slot_key, None)
+
+
+_prev_run_vision_blocking_20261019m = _run_vision_blocking
+
+
+async def _run_vision_blocking(fn, *args, **kwargs):
+    deadline = AIDeadline(VISION_JOB_TIMEOUT_SECONDS + 1.0)  # wait_for fires first
+    try:
+        return await _prev_run_vision_blocking_20261019m(_call_with_deadline, deadline, fn, *args, **kwargs)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        deadline.cancel("abandoned")
+        _DEADLINE_STATS["abandoned"] += 1
+        raise
+
+
+def _requests_with_retries(method, url: str, *, json_payload=None, params=None, timeout=25, max_tries=3):
+    """requests.* wrapper with small retries + backoff, bounded by the current AI deadline."""
+    deadline = _current_deadline()
+    last_err = None
+    for i in range(max_tries):
+        try_timeout = timeout
+        if deadline is not None:
+            deadline.check()
+            try_timeout = deadline.clamp(timeout)
+            if try_timeout < _DEADLINE_MIN_ATTEMPT_SECONDS:
+                _DEADLINE_STATS["retries_skipped"] += 1
+                if last_err:
+                    raise last_err
+                raise DeadlineExceeded("AI request timed out. Please try again.")
+        try:
+            r = method(url, json=json_payload, params=params, timeout=try_timeout)
+            if r.status_code == 200:
+                return r
+            if _is_gemini_quota_error(r.status_code, r.text):
+                _AI_LIMITER.note_overload()
+                raise RateLimitError(f"Gemini rate-limited/quota exhausted (HTTP {r.status_code}).")
+            if r.status_code in (500, 502, 503, 504):
+                last_err = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+            else:
+                r.raise_for_status()
+                return r
+        except RateLimitError:
+            raise
+        except requests.exceptions.Timeout as e:
+            _AI_LIMITER.note_overload()
+            last_err = e
+        except Exception as e:
+            last_err = e
+        if i + 1 >= max_tries:
+            break
+        backoff = 0.8 * (2 ** i)
+        if deadline is not None:
+            if deadline.remaining() < backoff + _DEADLINE_MIN_ATTEMPT_SECONDS:
+                _DEADLINE_STATS["retries_skipped"] += 1
+                break
+            deadline.sleep(backoff)
+        else:
+            time.sleep(backoff)
+    if last_err:
+        raise last_err
+    raise RuntimeError("Request failed.")
+
+
+def chat_with_gemini(prompt, on_text=None):
+    start_time = time.time()
+    deadline = _current_deadline()
+    if deadline is not None:
+        deadline.check()
+    if on_text is None:
+        on_text = getattr(_G3_STREAM_SINK, "fn", None)
+    slot = _g3_checkout()
+    if not slot:
+        return {'success': False, 'error': 'Failed to establish session with Gemini'}
+
+    scraped = slot["data"]
+    reqid = int(time.time() * 1000) % 1000000
+    base_url = f"{GEMINI_WEB_BASE_URL}/_/BardChatUi/data/assistant.lamda.BardFrontendService/StreamGenerate"
+    url = f"{base_url}?bl={scraped['bl']}&f.sid={scraped['fsid']}&hl=en-US&_reqid={reqid}&rt=c"
+    payload = build_payload(prompt, scraped['snlm0e'])
+    read_timeout = 20.0 if deadline is None else max(1.0, deadline.clamp(20.0))
+
+    ok = False
+    stopped = False  # deadline hit mid-stream: not the session's fault
+    try:
+        with scraped['session'].post(url, data=payload, headers=_g3_stream_headers(scraped['cookies']), timeout=(5, read_timeout), stream=True) as response:
+            if response.status_code != 200:
+                if response.status_code == 429:
+                    _AI_LIMITER.note_overload()
+                return {'success': False, 'error': f'HTTP {response.status_code}'}
+            response.encoding = "utf-8"
+            result = ""
+            first_chunk_at = 0.0
+            for result in iter_gemini_stream(response.iter_lines(decode_unicode=True)):
+                if deadline is not None and deadline.expired():
+                    stopped = True
+                    deadline.check()
+                if not first_chunk_at:
+                    first_chunk_at = time.time()
+                if on_text is not None:
+                    with contextlib.suppress(Exception):
+                        on_text(result)
+
+        response_time = round(time.time() - start_time, 2)
+        if result:
+            ok = True
+            return {
+                'success': True,
+                'response': result,
+                'metadata': {
+                    'response_time': f'{response_time}s',
+                    'first_text_time': f'{round(first_chunk_at - start_time, 2)}s',
+                    'timestamp': datetime.utcnow().isoformat() + 'Z',
+                    'model': 'gemini',
+                    'character_count': len(result),
+                    'word_count': len(result.split())
+                }
+            }
+        return {'success': False, 'error': 'No response received from Gemini'}
+    except requests.exceptions.RequestException as e:
+        if isinstance(e, requests.exceptions.Timeout):
+            _AI_LIMITER.note_overload()
+        return {'success': False, 'error': str(e)}
+    finally:
+        _g3_checkin(slot, ok or stopped)
+
+
+def _deadline_allows_attempt(deadline: Optional[AIDeadline]) -> bool:
+    """Raises once the deadline is gone; False when too little is left to start a hop."""
+    if deadline is None:
+        return True
+    deadline.check()
+    if deadline.remaining() >= _DEADLINE_MIN_ATTEMPT_SECONDS:
+        return True
+    _DEADLINE_STATS["retries_skipped"] += 1
+    return False
+
+
+def _clamped_timeout(deadline: Optional[AIDeadline], seconds: float) -> float:
+    return seconds if deadline is None else max(1.0, deadline.clamp(seconds))
+
+
+def query_ai(prompt: str) -> str | None:
+    """Perplexity HTTP client; the request timeout is clamped to the current AI deadline."""
+    if not USE_PERPLEXITY_FALLBACK:
+        return None
+    deadline = _current_deadline()
+    if not _deadline_allows_attempt(deadline):
+        return None
+    try:
+        r = requests.get(PERPLEXITY_API, params={"prompt": prompt}, timeout=_clamped_timeout(deadline, 18))
+        if r.status_code != 200:
+            logging.error("Perplexity HTTP %s: %s", r.status_code, (r.text or "")[:1500])
+            return None
+        data = r.json()
+        if data.get("status") == "success" and "answer" in data:
+            return str(data["answer"]).strip()
+        logging.error("Perplexity bad response: %s", str(data)[:1500])
+        return None
+    except Exception as e:
+        logging.exception("Perplexity error: %s", e)
+        return None
+
+
+def _try_gemini_text_backends(prompt: str, *, timeout_seconds: int = 10) -> Tuple[str, str]:
+    deadline = _current_deadline()
+    last_error: Optional[Exception] = None
+
+    def _budget_left() -> bool:
+        return _deadline_allows_attempt(deadline)
+
+    try:
+        out = gemini3_solve(prompt)
+        if out and str(out).strip():
+            return str(out).strip(), "Gemini"
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        last_error = e
+
+    if USE_OFFICIAL_GEMINI_REST_FALLBACK and GEMINI_API_KEYS and _budget_left():
+        try:
+            rest_timeout = max(1, int(_clamped_timeout(deadline, timeout_seconds)))
+            out = call_gemini_text_rest(prompt, timeout_seconds=rest_timeout)
+            if out and str(out).strip():
+                return str(out).strip(), "Gemini"
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+
+    if USE_PERPLEXITY_FALLBACK and _budget_left():
+        try:
+            alt = query_ai(prompt)
+            if alt and str(alt).strip():
+                return str(alt).strip(), "Perplexity"
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+
+    if deadline is not None:
+        deadline.check()
+    raise RuntimeError(str(last_error or "AI backend is temporarily unavailable. Please try again."))
+
+
+def _try_gemini_mcq_backends(question: str, options: List[str]) -> Tuple[Dict[str, Any], str]:
+    deadline = _current_deadline()
+    prompt, opts = _build_mcq_json_prompt(question, options)
+    last_error: Optional[Exception] = None
+
+    def _answered(data: Any) -> bool:
+        return isinstance(data, dict) and int(data.get("answer", 0) or 0) > 0
+
+    try:
+        data = _coerce_mcq_result(gemini3_solve(prompt), len(opts))
+        if _answered(data):
+            return data, "Gemini"
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        last_error = e
+
+    if USE_OFFICIAL_GEMINI_REST_FALLBACK and GEMINI_API_KEYS and _deadline_allows_attempt(deadline):
+        try:
+            rest_timeout = max(1, int(_clamped_timeout(deadline, 10)))
+            data = _coerce_mcq_result(call_gemini_text_rest(prompt, timeout_seconds=rest_timeout, force_json=True), len(opts))
+            if _answered(data):
+                return data, "Gemini"
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+
+    if USE_PERPLEXITY_FALLBACK and _deadline_allows_attempt(deadline):
+        try:
+            data = _coerce_mcq_result(query_ai(prompt) or "", len(opts))
+            if _answered(data):
+                return data, "Perplexity"
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+
+    if deadline is not None:
+        deadline.check()
+    raise RuntimeError(str(last_error or "AI backend is temporarily unavailable. Please try again."))
+
+
+_prev_ai_runtime_stats_lines_20261019m = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _DEADLINE_STATS
+    return _prev_ai_runtime_stats_lines_20261019m() + [
+        f"⌛ Deadlines: expired <code>{h(st['expired'])}</code> · superseded <code>{h(st['superseded'])}</code> · abandoned <code>{h(st['abandoned'])}</code> · retries skipped <code>{h(st['retries_skipped'])}</code>",
+    ]
+
+# ===== END AI REQUEST DEADLINE PATCH =====
+
+
+# ===== AI BACKEND TELEMETRY PATCH (2026-10-19n) =====
+# Goal:
+# 1) Every AI attempt (backend, model, key index, JSON mode, latency, outcome, bytes)
+#    goes into an in-memory ring buffer; recording never touches SQLite.
+# 2) A background thread folds the ring into 5-minute buckets in SQLite
+#    (counts + a fixed latency histogram per backend/model/key/mode); 8 days are kept.
+# 3) /aistats (owner) reports p50/p95/p99, success rate, quota errors and timeouts per
+#    backend for the last 1h and 24h, plus the busiest model/key rows.
+AI_TELEMETRY_RING_SIZE = max(500, int(os.getenv("AI_TELEMETRY_RING_SIZE", "5000") or "5000"))
+AI_TELEMETRY_FLUSH_SECONDS = max(10, int(os.getenv("AI_TELEMETRY_FLUSH_SECONDS", "60") or "60"))
+_AI_TELEMETRY_BUCKET_SECONDS = 300
+_AI_TELEMETRY_KEEP_DAYS = 8
+# Upper bounds (ms) of the latency histogram bins; the last bin is open-ended.
+_AI_LATENCY_BOUNDS_MS = (100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000, 7500, 10000, 15000, 20000, 30000, 45000, 60000)
+
+# (ts, backend, model, key_idx, json_mode, latency_ms, outcome, bytes)
+_AI_ATTEMPTS: "collections.deque[Tuple[float, str, str, int, int, int, str, int]]" = collections.deque(maxlen=AI_TELEMETRY_RING_SIZE)
+_AI_TELEMETRY_LOCK = threading.Lock()
+_AI_TELEMETRY_STOP = threading.Event()
+_AI_TELEMETRY_THREAD: Optional[threading.Thread] = None
+_AI_TELEMETRY_STATS: Dict[str, int] = {"recorded": 0, "flushed": 0}
+
+
+def _ai_telemetry_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ai_backend_stats (
+            bucket_ts INTEGER NOT NULL,
+            backend TEXT NOT NULL,
+            model TEXT NOT NULL,
+            key_idx INTEGER NOT NULL,
+            json_mode INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            ok INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            quota INTEGER NOT NULL DEFAULT 0,
+            timeouts INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            latency_sum_ms INTEGER NOT NULL DEFAULT 0,
+            hist_json TEXT NOT NULL DEFAULT '[]',
+            PRIMARY KEY (bucket_ts, backend, model, key_idx, json_mode)
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+_prev_db_init_20261019n = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019n()
+    _ai_telemetry_db_init()
+
+
+def _ai_outcome_of_error(e: BaseException) -> str:
+    if isinstance(e, RateLimitError):
+        return "quota"
+    if isinstance(e, (requests.exceptions.Timeout, DeadlineExceeded, TimeoutError)):
+        return "timeout"
+    text = str(e).lower()
+    if "429" in text or "quota" in text or "resource_exhausted" in text:
+        return "quota"
+    if "timed out" in text or "timeout" in text:
+        return "timeout"
+    return "error"
+
+
+def record_ai_attempt(backend: str, model: str, key_idx: int, json_mode: bool, latency_s: float, outcome: str, nbytes: int = 0) -> None:
+    """Thread-safe and allocation-light; called from worker threads on every backend attempt."""
+    _AI_ATTEMPTS.append((time.time(), backend, model or "-", int(key_idx), 1 if json_mode else 0, int(latency_s * 1000), outcome, int(nbytes or 0)))
+    _AI_TELEMETRY_STATS["recorded"] += 1
+
+
+def _latency_bin(ms: int) -> int:
+    for i, bound in enumerate(_AI_LATENCY_BOUNDS_MS):
+        if ms <= bound:
+            return i
+    return len(_AI_LATENCY_BOUNDS_MS)
+
+
+def ai_telemetry_flush() -> int:
+    """Fold buffered attempts into ai_backend_stats. Returns how many attempts were written."""
+    with _AI_TELEMETRY_LOCK:
+        drained = []
+        while _AI_ATTEMPTS:
+            drained.append(_AI_ATTEMPTS.popleft())
+        if not drained:
+            return 0
+        agg: Dict[Tuple[int, str, str, int, int], Dict[str, Any]] = {}
+        nbins = len(_AI_LATENCY_BOUNDS_MS) + 1
+        for ts, backend, model, key_idx, json_mode, ms, outcome, nbytes in drained:
+            bucket = int(ts) - int(ts) % _AI_TELEMETRY_BUCKET_SECONDS
+            a = agg.setdefault((bucket, backend, model, key_idx, json_mode), {
+                "attempts": 0, "ok": 0, "errors": 0, "quota": 0, "timeouts": 0, "bytes": 0, "lat": 0, "hist": [0] * nbins,
+            })
+            a["attempts"] += 1
+            a["ok" if outcome == "ok" else "quota" if outcome == "quota" else "timeouts" if outcome == "timeout" else "errors"] += 1
+            a["bytes"] += nbytes
+            a["lat"] += ms
+            a["hist"][_latency_bin(ms)] += 1
+        conn = db_connect()
+        cur = conn.cursor()
+        try:
+            for key, a in agg.items():
+                cur.execute(
+                    "SELECT hist_json FROM ai_backend_stats WHERE bucket_ts=? AND backend=? AND model=? AND key_idx=? AND json_mode=?",
+                    key,
+                )
+                row = cur.fetchone()
+                hist = a["hist"]
+                if row is not None:
+                    old = json.loads(row["hist_json"] or "[]")
+                    hist = [x + (old[i] if i < len(old) else 0) for i, x in enumerate(hist)]
+                cur.execute(
+                    """
+                    INSERT INTO ai_backend_stats(bucket_ts, backend, model, key_idx, json_mode, attempts, ok, errors, quota, timeouts, bytes, latency_sum_ms, hist_json)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+                    ON CONFLICT(bucket_ts, backend, model, key_idx, json_mode) DO UPDATE SET
+                        attempts=attempts+excluded.attempts, ok=ok+excluded.ok, errors=errors+excluded.errors,
+                        quota=quota+excluded.quota, timeouts=timeouts+excluded.timeouts, bytes=bytes+excluded.bytes,
+                        latency_sum_ms=latency_sum_ms+excluded.latency_sum_ms, hist_json=excluded.hist_json
+                    """,
+                    (*key, a["attempts"], a["ok"], a["errors"], a["quota"], a["timeouts"], a["bytes"], a["lat"], json.dumps(hist)),
+                )
+            cutoff = int(time.time()) - _AI_TELEMETRY_KEEP_DAYS * 86400
+            cur.execute("DELETE FROM ai_backend_stats WHERE bucket_ts < ?", (cutoff,))
+            conn.commit()
+        finally:
+            conn.close()
+        _AI_TELEMETRY_STATS["flushed"] += len(drained)
+        return len(drained)
+
+
+def _ai_telemetry_worker() -> None:
+    while not _AI_TELEMETRY_STOP.wait(AI_TELEMETRY_FLUSH_SECONDS):
+        try:
+            ai_telemetry_flush()
+        except Exception as e:
+            logging.warning("AI telemetry flush failed: %s", e)
+
+
+def start_ai_telemetry() -> None:
+    global _AI_TELEMETRY_THREAD
+    if _AI_TELEMETRY_THREAD and _AI_TELEMETRY_THREAD.is_alive():
+        return
+    _AI_TELEMETRY_STOP.clear()
+    _AI_TELEMETRY_THREAD = threading.Thread(target=_ai_telemetry_worker, name="ai-telemetry", daemon=True)
+    _AI_TELEMETRY_THREAD.start()
+
+
+def stop_ai_telemetry() -> None:
+    _AI_TELEMETRY_STOP.set()
+    with contextlib.suppress(Exception):
+        ai_telemetry_flush()
+
+
+# ---- instrumentation ----
+
+def _call_gemini_generate_content_multi(model: str, payload: Dict[str, Any], *, timeout_seconds: int) -> str:
+    model = _normalize_model_name(model)
+    if not GEMINI_API_KEYS:
+        raise RuntimeError("No Gemini API key configured.")
+
+    json_mode = (payload.get("generationConfig") or {}).get("responseMimeType") == "application/json"
+    short_model = model.split("/", 1)[-1]
+    last_err: Optional[Exception] = None
+    for key_idx, key in enumerate(GEMINI_API_KEYS):
+        url = f"{GEMINI_API_BASE_URL}/v1beta/{model}:generateContent?key={key}"
+        started = time.monotonic()
+        try:
+            r = _requests_with_retries(
+                requests.post,
+                url,
+                json_payload=payload,
+                timeout=max(8, int(timeout_seconds or 10)),
+                max_tries=1,
+            )
+            data = r.json()
+            text = _extract_gemini_text_from_response(data)
+            if text and str(text).strip():
+                record_ai_attempt("gemini_rest", short_model, key_idx, json_mode, time.monotonic() - started, "ok", len(r.content or b""))
+                return str(text).strip()
+            record_ai_attempt("gemini_rest", short_model, key_idx, json_mode, time.monotonic() - started, "error", len(r.content or b""))
+            last_err = RuntimeError("Empty Gemini response")
+        except Exception as e:
+            record_ai_attempt("gemini_rest", short_model, key_idx, json_mode, time.monotonic() - started, _ai_outcome_of_error(e))
+            last_err = e
+            continue
+
+    raise RuntimeError(str(last_err or "Gemini REST backend is unavailable."))
+
+
+_prev_chat_with_gemini_20261019n = chat_with_gemini
+
+
+def chat_with_gemini(prompt, on_text=None):
+    started = time.monotonic()
+    try:
+        res = _prev_chat_with_gemini_20261019n(prompt, on_text=on_text)
+    except Exception as e:
+        record_ai_attempt("gemini_web", "web", -1, False, time.monotonic() - started, _ai_outcome_of_error(e))
+        raise
+    if res.get("success"):
+        record_ai_attempt("gemini_web", "web", -1, False, time.monotonic() - started, "ok", len(str(res.get("response") or "").encode("utf-8")))
+    else:
+        record_ai_attempt("gemini_web", "web", -1, False, time.monotonic() - started, _ai_outcome_of_error(RuntimeError(str(res.get("error") or ""))))
+    return res
+
+
+_prev_query_ai_20261019n = query_ai
+
+
+def query_ai(prompt: str) -> str | None:
+    started = time.monotonic()
+    try:
+        out = _prev_query_ai_20261019n(prompt)
+    except Exception as e:
+        record_ai_attempt("perplexity", "proxy", -1, False, time.monotonic() - started, _ai_outcome_of_error(e))
+        raise
+    if USE_PERPLEXITY_FALLBACK:
+        # query_ai logs and returns None on failure instead of raising.
+        record_ai_attempt("perplexity", "proxy", -1, False, time.monotonic() - started, "ok" if out else "error", len((out or "").encode("utf-8")))
+    return out
+
+
+_prev_deepseek_solve_text_20261019n = deepseek_solve_text
+
+
+def deepseek_solve_text(problem_text: str) -> str:
+    started = time.monotonic()
+    try:
+        out = _prev_deepseek_solve_text_20261019n(problem_text)
+    except Exception as e:
+        record_ai_attempt("deepseek", "chat", -1, False, time.monotonic() - started, _ai_outcome_of_error(e))
+        raise
+    record_ai_attempt("deepseek", "chat", -1, False, time.monotonic() - started, "ok", len((out or "").encode("utf-8")))
+    return out
+
+
+# ---- report ----
+
+def _hist_percentile(hist: List[int], p: float) -> str:
+    total = sum(hist)
+    if not total:
+        return "-"
+    need = total * p
+    seen = 0
+    for i, c in enumerate(hist):
+        seen += c
+        if seen >= need:
+            if i >= len(_AI_LATENCY_BOUNDS_MS):
+                return f">{_AI_LATENCY_BOUNDS_MS[-1] / 1000:g}s"
+            return f"≤{_AI_LATENCY_BOUNDS_MS[i] / 1000:g}s"
+    return "-"
+
+
+def ai_backend_summary(since_ts: int, group_by: str = "backend") -> List[Dict[str, Any]]:
+    """Merge ai_backend_stats rows newer than since_ts, grouped by backend or by backend/model/key/mode."""
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM ai_backend_stats WHERE bucket_ts >= ?", (int(since_ts),))
+    rows = cur.fetchall()
+    conn.close()
+    nbins = len(_AI_LATENCY_BOUNDS_MS) + 1
+    out: Dict[Tuple, Dict[str, Any]] = {}
+    for r in rows:
+        key = (r["backend"],) if group_by == "backend" else (r["backend"], r["model"], int(r["key_idx"]), int(r["json_mode"]))
+        a = out.setdefault(key, {"key": key, "attempts": 0, "ok": 0, "errors": 0, "quota": 0, "timeouts": 0, "bytes": 0, "lat": 0, "hist": [0] * nbins})
+        for col in ("attempts", "ok", "errors", "quota", "timeouts", "bytes"):
+            a[col] += int(r[col] or 0)
+        a["lat"] += int(r["latency_sum_ms"] or 0)
+        for i, c in enumerate(json.loads(r["hist_json"] or "[]")[:nbins]):
+            a["hist"][i] += int(c)
+    return sorted(out.values(), key=lambda a: -a["attempts"])
+
+
+def _aistats_window_html(title: str, hours: int) -> str:
+    rows = ai_backend_summary(int(time.time()) - hours * 3600)
+    if not rows:
+        return f"<b>{h(title)}</b>\n<i>No AI attempts recorded.</i>"
+    lines = [f"<b>{h(title)}</b>"]
+    for a in rows:
+        n = a["attempts"]
+        lines.append(
+            f"• <b>{h(a['key'][0])}</b>: {h(n)} tries · ok <b>{a['ok'] * 100 // max(1, n)}%</b> · quota <code>{h(a['quota'])}</code> · timeout <code>{h(a['timeouts'])}</code>\n"
+            f"   p50 <code>{h(_hist_percentile(a['hist'], 0.5))}</code> · p95 <code>{h(_hist_percentile(a['hist'], 0.95))}</code> · p99 <code>{h(_hist_percentile(a['hist'], 0.99))}</code> · avg <code>{a['lat'] / max(1, n) / 1000:.1f}s</code>"
+        )
+    return "\n".join(lines)
+
+
+def _aistats_detail_html(hours: int, limit: int = 12) -> str:
+    rows = ai_backend_summary(int(time.time()) - hours * 3600, group_by="detail")[:limit]
+    if not rows:
+        return ""
+    lines = [f"<b>By model / key ({hours}h)</b>"]
+    for a in rows:
+        backend, model, key_idx, json_mode = a["key"]
+        n = a["attempts"]
+        key_txt = f" key#{key_idx + 1}" if key_idx >= 0 else ""
+        mode_txt = " json" if json_mode else ""
+        lines.append(
+            f"• <code>{h(backend)} {h(model)}{h(key_txt)}{h(mode_txt)}</code>: {h(n)} · ok {a['ok'] * 100 // max(1, n)}% · quota {h(a['quota'])} · p95 {h(_hist_percentile(a['hist'], 0.95))}"
+        )
+    return "\n".join(lines)
+
+
+@require_owner
+async def cmd_aistats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(ai_telemetry_flush)  # DB write, not AI work: keep it off the scheduler
+    body = "\n\n".join(
+        x for x in (
+            _aistats_window_html("Last 1 hour", 1),
+            _aistats_window_html("Last 24 hours", 24),
+            _aistats_detail_html(24),
+        ) if x
+    )
+    await safe_reply(update, ui_box_html("AI Backend Stats", body, emoji="📡"))
+
+
+PRIVATE_COMMAND_SECTIONS["owner"].append(("aistats", "AI backend latency and error report"))
+PREFERRED_ALIASES["aistats"] = "ais"
+COMMAND_ALIAS_REGISTRY["aistats"] = ["ais"]
+
+_old_build_app_20261019n = build_app
+
+
+def build_app() -> Application:
+    app = _old_build_app_20261019n()
+    private_filter = filters.ChatType.PRIVATE
+    _register_dual_command(app, "aistats", cmd_aistats, private_filter)
+    _register_dual_command(app, "ais", cmd_aistats, private_filter)
+    return app
+
+
+_prev_main_20261019n = main
+
+
+def main():
+    start_ai_telemetry()
+    try:
+        _prev_main_20261019n()
+    finally:
+        stop_ai_telemetry()
+
+
+_prev_ai_runtime_stats_lines_20261019n = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _AI_TELEMETRY_STATS
+    return _prev_ai_runtime_stats_lines_20261019n() + [
+        f"📡 Telemetry: recorded <code>{h(st['recorded'])}</code> · flushed <code>{h(st['flushed'])}</code> · buffered <code>{h(len(_AI_ATTEMPTS))}</code> (see /aistats)",
+    ]
+
+# ===== END AI BACKEND TELEMETRY PATCH =====
+
+
+# ===== PARALLEL GENERATE QUIZ VERIFICATION PATCH (2026-10-19o) =====
+# Goal:
+# 1) Generation and verification are separate jobs: the generated items are verified
+#    concurrently under one shared deadline instead of one after another.
+# 2) Each quiz is posted as soon as its own verification finishes.
+# 3) Verification reuses the MCQ answer cache and stores what Perplexity returns.
+# 4) Only the verify tasks raise the requester's per-user cap (_SCHED_CAP_OVERRIDE);
+#    every other USER job keeps the normal cap.
+GENQUIZ_VERIFY_BUDGET_SECONDS = max(5.0, float(os.getenv("GENQUIZ_VERIFY_BUDGET_SECONDS", "35") or "35"))
+_GENQUIZ_TARGET_ITEMS = 3
+_GENQUIZ_MAX_GENERATIONS = 3
+
+_GENQUIZ_STATS: Dict[str, int] = {"runs": 0, "verified": 0, "cache_hits": 0, "unverified": 0, "changed": 0}
+
+
+def _genquiz_prompt(seed_question: str, seed_options: List[str]) -> Tuple[str, str]:
+    sq = (seed_question or "").strip()
+    so = _normalize_options(seed_options or [], max_n=4)
+
+    is_bn = _is_bangla_text(sq + " " + " ".join(so))
+    lang_rule = _quiz_language_rule_block(is_bn)
+    schema_expl = _quiz_schema_example_explanation(is_bn)
+
+    prompt = (
+        "Return STRICT JSON only (no markdown, no extra text).\n"
+        "Task: You are given a SEED quiz question (MCQ) with options.\n"
+        "1) Infer the *MICRO-TOPIC / chapter concept* strictly from the seed (e.g., 'Kinematics: acceleration from velocity-position relation', 'Myelinated neuron: saltatory conduction', etc.).\n"
+        "2) Generate exactly 3 NEW MCQs ONLY from that same micro-topic (same concept family).\n"
+        "   - Do NOT generate from the whole subject/book.\n"
+        "   - Do NOT repeat the seed question or trivially rephrase it.\n"
+        "   - Keep difficulty similar to admission-style questions.\n"
+        "3) Each MCQ must have 4 options and exactly one correct answer.\n"
+        "4) Keep the question language consistent with the seed question language.\n"
+        f"5) {lang_rule}\n"
+        "6) Keep the explanation SHORT (1-2 lines max).\n\n"
+        "Allowed major topics (for labeling only): Physics, Chemistry, Math, Biology, Bangla, English, General Knowledge, Humanities Skills.\n"
+        "JSON format:\n"
+        "{\n"
+        '  "topic": "<major topic>",\n'
+        '  "microtopic": "<micro-topic inferred from seed>",\n'
+        '  "items": [\n'
+        "    {\n"
+        '      "question": "...",\n'
+        '      "options": ["...","...","...","..."],\n'
+        '      "answer": 1,\n'
+        f'      "explanation": "{schema_expl}"\n'
+        "    }\n"
+        "  ]\n"
+        "}\n\n"
+        f"Seed Question:\n{sq}\n\n"
+        "Seed Options:\n" + "\n".join([f"{_safe_letter(i+1)}. {so[i]}" for i in range(len(so))])
+    )
+    return prompt, schema_expl
+
+
+def generate_quiz_items_unverified(seed_question: str, seed_options: List[str]) -> List[Dict[str, Any]]:
+    """Blocking: one generation call; items carry the generator's own answer."""
+    prompt, schema_expl = _genquiz_prompt(seed_question, seed_options)
+    raw = None
+    last_err = None
+
+    if USE_GEMINI_REST_FOR_GENQUIZ and GEMINI_API_KEY:
+        try:
+            raw = call_gemini_text_rest(prompt, timeout_seconds=18, force_json=True)
+        except Exception as e:
+            last_err = e
+            raw = None
+
+    if not raw and USE_PERPLEXITY_FALLBACK:
+        try:
+            raw = query_ai(prompt)
+        except Exception as e:
+            last_err = e
+            raw = None
+
+    if not raw:
+        try:
+            raw = gemini3_solve(prompt)
+        except Exception as e:
+            last_err = e
+            raw = None
+
+    if not raw:
+        raise RuntimeError(f"Quiz generation failed: {last_err or 'all backends unavailable'}")
+
+    schema_hint = (
+        '{"microtopic":"<micro>","items":[{"question":"...","options":["...","...","...","..."],'
+        + '"answer":1,"explanation":"' + schema_expl + '"}]}'
+    )
+    try:
+        data = _extract_json_strict(raw)
+    except Exception:
+        repaired = _repair_to_json(raw, schema_hint=schema_hint, timeout_seconds=18)
+        if not repaired:
+            raise
+        data = repaired
+
+    if not isinstance(data, dict):
+        raise RuntimeError("Quiz generation failed.")
+
+    out: List[Dict[str, Any]] = []
+    for it in (data.get("items", []) or [])[:_GENQUIZ_TARGET_ITEMS]:
+        if not isinstance(it, dict):
+            continue
+        q = str(it.get("question", "")).strip()
+        opts = _normalize_options([str(x) for x in (it.get("options", []) or [])], max_n=4)
+        try:
+            ans = int(it.get("answer", 0) or 0)
+        except (TypeError, ValueError):
+            ans = 0
+        if q and opts and 1 <= ans <= len(opts):
+            out.append({"question": q, "options": opts, "answer": ans, "explanation": str(it.get("explanation", "")).strip()})
+    return out
+
+
+def verify_quiz_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Blocking: re-solve one generated MCQ (answer cache first, then Perplexity)."""
+    q, opts = item["question"], item["options"]
+    ver: Optional[Dict[str, Any]] = None
+    for code in ("P", "G"):
+        hit = mcq_cache_lookup(code, q, opts)
+        if hit:
+            ver = hit[0]
+            _GENQUIZ_STATS["cache_hits"] += 1
+            break
+    if ver is None:
+        ver = perplexity_solve_mcq_json(q, opts)
+        with contextlib.suppress(Exception):
+            if 1 <= int((ver or {}).get("answer", 0) or 0) <= len(opts):
+                mcq_cache_store("P", q, opts, ver, "Perplexity")
+    out = dict(item)
+    vans = int((ver or {}).get("answer", 0) or 0)
+    vexpl = str((ver or {}).get("explanation", "") or "").strip()
+    if 1 <= vans <= len(opts):
+        if vans != out["answer"]:
+            _GENQUIZ_STATS["changed"] += 1
+        out["answer"] = vans
+    if vexpl:
+        out["explanation"] = vexpl
+    return out
+
+
+async def on_genquiz_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.callback_query:
+        return
+    q = update.callback_query
+    await q.answer("Processing…", show_alert=False)
+
+    data = (q.data or "").strip()
+    m = re.match(r"^genquiz:([0-9a-f]{6,16})$", data)
+    if not m:
+        return
+    token = m.group(1)
+
+    store = _pending_store(context)
+    req = store.get(token)
+    if not isinstance(req, dict):
+        with contextlib.suppress(Exception):
+            await q.edit_message_text("⚠️ This request has expired. Please send the quiz again.")
+        return
+
+    uid = int(req.get("uid") or 0)
+    if q.from_user and q.from_user.id != uid:
+        with contextlib.suppress(Exception):
+            await q.answer("This is not your request.", show_alert=True)
+        return
+
+    if str(req.get("kind") or "") != "poll":
+        with contextlib.suppress(Exception):
+            await q.answer("Generate Quiz is available only for quiz questions.", show_alert=True)
+        return
+
+    payload = req.get("payload") or {}
+    seed_question = str(payload.get("question") or "").strip()
+    seed_options = payload.get("options") or []
+
+    qpfx = (get_setting("quiz_prefix", "প্রবাহ") or "প্রবাহ").strip()
+    qlink = (get_setting("quiz_expl_link", "") or "").strip()
+
+    with contextlib.suppress(Exception):
+        await q.edit_message_text(
+            ui_box_text("Generating Quizzes", "Please wait… Creating quizzes...", emoji="⏳"),
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        )
+
+    role = _role_of(uid)
+    loop = asyncio.get_running_loop()
+    verify_tasks: List[asyncio.Task] = []
+    posted = 0
+    _GENQUIZ_STATS["runs"] += 1
+
+    async def _verify_or_keep(it: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        # Own task, own context: only these verify jobs may run all items at once for
+        # this user; the normal per-user cap still applies to everything else.
+        _SCHED_CAP_OVERRIDE.set(_GENQUIZ_TARGET_ITEMS)
+        try:
+            out = await _run_blocking(role, verify_quiz_item, it, timeout=timeout)
+            _GENQUIZ_STATS["verified"] += 1
+            return out
+        except Exception:
+            # Missed the shared deadline or failed: keep the generator's answer, as before.
+            _GENQUIZ_STATS["unverified"] += 1
+            return it
+
+    async def _post(it: Dict[str, Any]) -> None:
+        qq = str(it["question"]).strip()
+        q_final = f"{qpfx}\n\u200b{qq}".strip() if qpfx else qq
+        if len(q_final) > 300:
+            q_final = q_final[:297] + "..."
+        expl = _trim_expl_for_poll(str(it.get("explanation", "")), qlink)
+        # Per-poll lock so concurrent batches in this chat do not interleave into flood limits.
+        async with _get_chat_lock(context, chat_id):
+            await _send_poll_with_retry(
+                context.bot,
+                chat_id=chat_id,
+                question=q_final,
+                options=[str(x).strip() for x in it["options"]],
+                is_anonymous=True,
+                type=Poll.QUIZ,
+                correct_option_id=int(it["answer"]) - 1,
+                explanation=expl if expl else None,
+            )
+            await asyncio.sleep(0.35)
+
+    try:
+        chat_id = int(req.get("chat_id") or (q.message.chat_id if q.message else uid))
+        seen_q = set()
+        verify_deadline = 0.0
+        for _attempt in range(_GENQUIZ_MAX_GENERATIONS):
+            try:
+                new_items = await _run_blocking(role, generate_quiz_items_unverified, seed_question, seed_options)
+            except Exception:
+                if verify_tasks:
+                    break  # post what we already have
+                raise
+            for it in (new_items or []):
+                key = re.sub(r"\s+", " ", str(it.get("question", "") or "").strip()).lower()
+                if not key or key in seen_q or len(seen_q) >= _GENQUIZ_TARGET_ITEMS:
+                    continue
+                seen_q.add(key)
+                if not verify_deadline:
+                    verify_deadline = loop.time() + GENQUIZ_VERIFY_BUDGET_SECONDS
+                verify_tasks.append(asyncio.create_task(_verify_or_keep(it, max(1.0, verify_deadline - loop.time()))))
+            if len(seen_q) >= _GENQUIZ_TARGET_ITEMS:
+                break
+
+        if not verify_tasks:
+            raise RuntimeError("Quiz generation returned empty items.")
+
+        with contextlib.suppress(Exception):
+            await q.edit_message_text(
+                ui_box_text("Verifying Quizzes", f"{len(verify_tasks)} quizzes generated. Posting each one as soon as it is verified…", emoji="⏳"),
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            )
+
+        for fut in asyncio.as_completed(verify_tasks):
+            await _post(await fut)
+            posted += 1
+
+        done_msg = ui_box_text("Quizzes Generated", "Quizzes have been generated ✅", emoji="📊")
+        with contextlib.suppress(Exception):
+            await q.edit_message_text(done_msg, parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        for t in verify_tasks:
+            t.cancel()
+        db_log("ERROR", "generate_quiz_failed", {"user_id": uid, "error": str(e), "posted": posted})
+        with contextlib.suppress(Exception):
+            await q.edit_message_text(
+                ui_box_text("Generate Quiz Failed", str(e)[:180], emoji="❌"),
+                parse_mode=ParseMode.HTML,
+            )
+
+
+_prev_ai_runtime_stats_lines_20261019o = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _GENQUIZ_STATS
+    return _prev_ai_runtime_stats_lines_20261019o() + [
+        f"📊 Generate Quiz: runs <b>{h(st['runs'])}</b> · verified <code>{h(st['verified'])}</code> (cache <code>{h(st['cache_hits'])}</code>, answer changed <code>{h(st['changed'])}</code>) · posted unverified <code>{h(st['unverified'])}</code>",
+    ]
+
+# ===== END PARALLEL GENERATE QUIZ VERIFICATION PATCH =====
+
+
+# ===== SPECULATIVE POLL PRE-SOLVE PATCH (2026-10-19p) =====
+# Goal:
+# 1) Optional (SPECULATIVE_PRESOLVE=1): when a private poll arrives, the model behind the
+#    verify button (Perplexity) starts solving alongside the primary Gemini answer.
+# 2) Bounded: per-user hourly budget, one speculation per user at a time, and only when
+#    the fair scheduler has idle slots and nothing queued.
+# 3) The finished result is parked; tapping the matching button returns it instantly
+#    (a tap during the run joins it via single-flight). Results that are never tapped
+#    still land in the MCQ answer cache through _solve_mcq_with_preference.
+# 4) Speculation only starts after enforce_required_memberships has passed, so members
+#    who still have to join a channel (or get banned by it) never cost an AI call.
+SPECULATIVE_PRESOLVE_ENABLED = str(os.getenv("SPECULATIVE_PRESOLVE", "0") or "0").strip().lower() in ("1", "true", "yes", "on")
+SPECULATIVE_PER_USER_PER_HOUR = max(0, int(os.getenv("SPECULATIVE_PER_USER_PER_HOUR", "15") or "15"))
+_SPECULATIVE_MODEL = "P"  # send_poll_verify_buttons offers Perplexity after the Gemini answer
+_SPECULATIVE_SCOPE = "academic_poll"
+_SPECULATIVE_TTL_SECONDS = 900
+_SPECULATIVE_MAX_PARKED = 500
+
+_PRESOLVED: "collections.OrderedDict[str, Tuple[float, Dict[str, Any], str]]" = collections.OrderedDict()
+_SPECULATIVE_RUNNING: Dict[int, str] = {}
+_SPECULATIVE_HISTORY: Dict[int, "collections.deque[float]"] = {}
+_SPECULATIVE_STATS: Dict[str, int] = {"started": 0, "parked": 0, "hits": 0, "joined": 0, "skipped_budget": 0, "skipped_busy": 0, "failed": 0}
+_PRESOLVED_TAKE: "contextvars.ContextVar[bool]" = contextvars.ContextVar("presolved_take", default=False)
+
+
+def _speculation_allowed(uid: int) -> bool:
+    if uid in _SPECULATIVE_RUNNING:
+        return False
+    s = _SCHEDULER
+    if s.depth() > 0 or s.in_flight() >= s.limit - 1:
+        _SPECULATIVE_STATS["skipped_busy"] += 1
+        return False
+    hist = _SPECULATIVE_HISTORY.setdefault(uid, collections.deque())
+    now = time.time()
+    while hist and now - hist[0] > 3600:
+        hist.popleft()
+    if len(hist) >= SPECULATIVE_PER_USER_PER_HOUR:
+        _SPECULATIVE_STATS["skipped_budget"] += 1
+        return False
+    hist.append(now)
+    return True
+
+
+def _park_presolved(key: str, result: Dict[str, Any], model_name: str) -> None:
+    now = time.time()
+    _PRESOLVED[key] = (now + _SPECULATIVE_TTL_SECONDS, result, model_name)
+    _PRESOLVED.move_to_end(key)
+    while len(_PRESOLVED) > _SPECULATIVE_MAX_PARKED or (_PRESOLVED and next(iter(_PRESOLVED.values()))[0] < now):
+        _PRESOLVED.popitem(last=False)
+
+
+async def _speculative_presolve(uid: int, question: str, options: List[str]) -> None:
+    key = _single_flight_key("poll", _SPECULATIVE_MODEL, _SPECULATIVE_SCOPE, question, options)
+    _SPECULATIVE_RUNNING[uid] = key
+    _SPECULATIVE_STATS["started"] += 1
+    try:
+        result, model_name = await _solver_mcq_shared(uid, _SPECULATIVE_MODEL, question, options, _SPECULATIVE_SCOPE)
+        if int((result or {}).get("answer", 0) or 0) > 0:
+            _park_presolved(key, result, model_name)
+            _SPECULATIVE_STATS["parked"] += 1
+    except Exception as e:
+        _SPECULATIVE_STATS["failed"] += 1
+        logging.info("Speculative pre-solve failed for %s: %s", uid, e)
+    finally:
+        if _SPECULATIVE_RUNNING.get(uid) == key:
+            _SPECULATIVE_RUNNING.pop(uid, None)
+
+
+_SPECULATION_PENDING: "contextvars.ContextVar[Optional[Any]]" = contextvars.ContextVar("speculation_pending", default=None)
+_prev_enforce_required_memberships_20261019p = enforce_required_memberships
+
+
+async def enforce_required_memberships(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    ok = await _prev_enforce_required_memberships_20261019p(update, context)
+    start = _SPECULATION_PENDING.get()
+    if start is not None:
+        _SPECULATION_PENDING.set(None)
+        if ok:
+            start()
+    return ok
+
+
+_prev_handle_user_poll_solver_20261019p = handle_user_poll_solver
+
+
+async def handle_user_poll_solver(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
+    user = update.effective_user
+    token = None
+    if SPECULATIVE_PRESOLVE_ENABLED and msg and msg.poll and user and is_private_chat(update):
+        uid = user.id
+        options = [str(o.text).strip() for o in (msg.poll.options or []) if str(o.text or "").strip()]
+        question = (msg.poll.question or "").strip()
+        if question and len(options) >= 2 and not is_banned(uid) and solver_mode_on(uid):
+
+            def _start() -> None:
+                if _speculation_allowed(uid):
+                    asyncio.create_task(_speculative_presolve(uid, question, options))
+
+            # Armed here, fired by enforce_required_memberships once the user has passed it.
+            token = _SPECULATION_PENDING.set(_start)
+    try:
+        return await _prev_handle_user_poll_solver_20261019p(update, context)
+    finally:
+        if token is not None:
+            _SPECULATION_PENDING.reset(token)
+
+
+_prev_solver_mcq_shared_20261019p = _solver_mcq_shared
+
+
+async def _solver_mcq_shared(uid: int, model: str, question: str, options: List[str], scope: str = "") -> Tuple[Dict[str, Any], str]:
+    key = _single_flight_key("poll", model, scope, question, options)
+    if _PRESOLVED_TAKE.get():
+        parked = _PRESOLVED.pop(key, None)
+        if parked and parked[0] >= time.time():
+            _SPECULATIVE_STATS["hits"] += 1
+            return parked[1], parked[2]
+        if key in _SINGLE_FLIGHT and key in _SPECULATIVE_RUNNING.values():
+            _SPECULATIVE_STATS["joined"] += 1
+    return await _prev_solver_mcq_shared_20261019p(uid, model, question, options, scope)
+
+
+_prev_on_solver_callback_20261019p = on_solver_callback
+
+
+async def on_solver_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Only a user's tap may consume a parked result; the speculative run itself must not.
+    token = _PRESOLVED_TAKE.set(True)
+    try:
+        return await _prev_on_solver_callback_20261019p(update, context)
+    finally:
+        _PRESOLVED_TAKE.reset(token)
+
+
+_prev_ai_runtime_stats_lines_20261019p = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _SPECULATIVE_STATS
+    state = "on" if SPECULATIVE_PRESOLVE_ENABLED else "off"
+    return _prev_ai_runtime_stats_lines_20261019p() + [
+        f"🔮 Speculative Pre-solve ({h(state)}): started <code>{h(st['started'])}</code> · tapped instantly <b>{h(st['hits'])}</b> · joined running <code>{h(st['joined'])}</code> · parked <code>{h(len(_PRESOLVED))}</code> · skipped busy/budget <code>{h(st['skipped_busy'])}</code>/<code>{h(st['skipped_budget'])}</code>",
+    ]
+
+# ===== END SPECULATIVE POLL PRE-SOLVE PATCH =====
+
+
+# ===== BACKGROUND GEMINI MODEL CATALOG PATCH (2026-10-19q) =====
+# Goal:
+# 1) ListModels runs at startup and every GEMINI_MODEL_REFRESH_SECONDS on a background
+#    thread; the request path never waits for discovery.
+# 2) Text / vision candidate lists are computed once per refresh (env parsing, filtering,
+#    scoring) and published as immutable tuples.
+# 3) The first few candidates per purpose get a one-token probe; models that answer
+#    404/400/403 are moved behind the ones that work, so real requests skip them.
+GEMINI_MODEL_REFRESH_SECONDS = max(300, int(os.getenv("GEMINI_MODEL_REFRESH_SECONDS", "1800") or "1800"))
+GEMINI_MODEL_WARMUP_COUNT = max(0, int(os.getenv("GEMINI_MODEL_WARMUP_COUNT", "2") or "2"))
+_GEMINI_PROBE_PAYLOAD = {
+    "contents": [{"role": "user", "parts": [{"text": "ping"}]}],
+    "generationConfig": {"maxOutputTokens": 1, "temperature": 0},
+}
+
+_MODEL_CATALOG: Dict[str, Tuple[str, ...]] = {}
+_MODEL_CATALOG_STATE: Dict[str, Any] = {"refreshed_at": 0.0, "error": "", "unavailable": (), "probes": 0}
+_MODEL_CATALOG_LOCK = threading.Lock()
+_MODEL_CATALOG_STOP = threading.Event()
+_MODEL_CATALOG_THREAD: Optional[threading.Thread] = None
+
+
+def _list_gemini_models_cached(ttl_seconds: int = 300) -> Dict[str, Any]:
+    """Last ListModels response fetched by the background refresher (never does I/O)."""
+    return _GEMINI_MODELS_CACHE.get("data") or {}
+
+
+_prev_all_text_model_candidates_20261019q = _all_text_model_candidates
+_prev_all_vision_model_candidates_20261019q = _all_vision_model_candidates
+
+
+def _fetch_gemini_model_list() -> Dict[str, Any]:
+    last_err: Optional[Exception] = None
+    for key in GEMINI_API_KEYS:
+        try:
+            r = _requests_with_retries(
+                requests.get, f"{GEMINI_API_BASE_URL}/v1beta/models?key={key}", timeout=GEMINI_TIMEOUT_SECONDS, max_tries=2
+            )
+            return r.json()
+        except Exception as e:
+            last_err = e
+    raise RuntimeError(str(last_err or "No Gemini API key configured."))
+
+
+def _probe_gemini_model(model: str) -> Optional[bool]:
+    """True = answered, False = model unusable (4xx), None = inconclusive (quota / network)."""
+    if not GEMINI_API_KEYS:
+        return None
+    url = f"{GEMINI_API_BASE_URL}/v1beta/{_normalize_model_name(model)}:generateContent?key={GEMINI_API_KEYS[0]}"
+    _MODEL_CATALOG_STATE["probes"] += 1
+    try:
+        r = requests.post(url, json=_GEMINI_PROBE_PAYLOAD, timeout=10)
+    except Exception:
+        return None
+    if r.status_code == 200:
+        return True
+    if r.status_code in (400, 403, 404) and not _is_gemini_quota_error(r.status_code, r.text):
+        return False
+    return None
+
+
+def _warm_candidates(models: Tuple[str, ...], unavailable: set) -> Tuple[str, ...]:
+    for model in models[:GEMINI_MODEL_WARMUP_COUNT]:
+        if model in unavailable:
+            continue
+        verdict = _probe_gemini_model(model)
+        if verdict is False:
+            unavailable.add(model)
+    good = [m for m in models if m not in unavailable]
+    bad = [m for m in models if m in unavailable]
+    return tuple(good + bad) or models
+
+
+def refresh_gemini_model_catalog() -> None:
+    """Blocking: ListModels, rebuild both candidate tuples, warm the first few of each."""
+    try:
+        if GEMINI_API_KEYS:
+            _GEMINI_MODELS_CACHE["data"] = _fetch_gemini_model_list()
+            _GEMINI_MODELS_CACHE["ts"] = time.time()
+        _MODEL_CATALOG_STATE["error"] = ""
+    except Exception as e:
+        # Keep serving the previous catalog; log once per refresh, not once per request.
+        _MODEL_CATALOG_STATE["error"] = str(e)[:200]
+        logging.warning("Gemini model discovery failed: %s", e)
+    text = tuple(_prev_all_text_model_candidates_20261019q())
+    vision = tuple(_prev_all_vision_model_candidates_20261019q())
+    unavailable: set = set()
+    text = _warm_candidates(text, unavailable)
+    vision = _warm_candidates(vision, unavailable)
+    with _MODEL_CATALOG_LOCK:
+        _MODEL_CATALOG["text"] = text
+        _MODEL_CATALOG["vision"] = vision
+        _MODEL_CATALOG_STATE["unavailable"] = tuple(sorted(unavailable))
+        _MODEL_CATALOG_STATE["refreshed_at"] = time.time()
+
+
+def _catalog(purpose: str) -> Tuple[str, ...]:
+    models = _MODEL_CATALOG.get(purpose)
+    if models:
+        return models
+    # Before the first refresh: static fallbacks + env, computed locally once.
+    with _MODEL_CATALOG_LOCK:
+        if not _MODEL_CATALOG.get(purpose):
+            prev = _prev_all_text_model_candidates_20261019q if purpose == "text" else _prev_all_vision_model_candidates_20261019q
+            _MODEL_CATALOG[purpose] = tuple(prev())
+        return _MODEL_CATALOG[purpose]
+
+
+def _all_text_model_candidates() -> Tuple[str, ...]:
+    return _catalog("text")
+
+
+def _all_vision_model_candidates() -> Tuple[str, ...]:
+    return _catalog("vision")
+
+
+def _model_catalog_worker() -> None:
+    while True:
+        try:
+            refresh_gemini_model_catalog()
+        except Exception as e:
+            logging.warning("Gemini model catalog refresh failed: %s", e)
+        if _MODEL_CATALOG_STOP.wait(GEMINI_MODEL_REFRESH_SECONDS):
+            return
+
+
+def start_gemini_model_catalog() -> None:
+    global _MODEL_CATALOG_THREAD
+    if _MODEL_CATALOG_THREAD and _MODEL_CATALOG_THREAD.is_alive():
+        return
+    _MODEL_CATALOG_STOP.clear()
+    _MODEL_CATALOG_THREAD = threading.Thread(target=_model_catalog_worker, name="gemini-model-catalog", daemon=True)
+    _MODEL_CATALOG_THREAD.start()
+
+
+def stop_gemini_model_catalog() -> None:
+    _MODEL_CATALOG_STOP.set()
+
+
+_prev_main_20261019q = main
+
+
+def main():
+    start_gemini_model_catalog()
+    try:
+        _prev_main_20261019q()
+    finally:
+        stop_gemini_model_catalog()
+
+
+_prev_ai_runtime_stats_lines_20261019q = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _MODEL_CATALOG_STATE
+    age = f"{int(time.time() - st['refreshed_at'])}s ago" if st["refreshed_at"] else "pending"
+    text = ", ".join(m.split("/", 1)[-1] for m in _MODEL_CATALOG.get("text", ())[:3]) or "-"
+    line = (
+        f"🧭 Model Catalog: refreshed <code>{h(age)}</code> · text <code>{h(text)}</code> · "
+        f"unavailable <code>{h(len(st['unavailable']))}</code> · probes <code>{h(st['probes'])}</code>"
+    )
+    if st["error"]:
+        line += f" · last error <code>{h(st['error'][:80])}</code>"
+    return _prev_ai_runtime_stats_lines_20261019q() + [line]
+
+# ===== END BACKGROUND GEMINI MODEL CATALOG PATCH =====
+
+
+# ===== FILTER CACHE PATCH (2026-10-19r) =====
+# Goal:
+# 1) An admin's /filter phrases are read from the DB once and kept in memory; /filter
+#    drops the cached entry so the next parse sees the new phrase.
+# 2) The phrase set is also compiled into one alternation regex. clean_common (defined
+#    once, in the compiled quiz text parser patch) uses it as a single-pass check and
+#    only runs the /filter-order str.replace loop on lines that contain a phrase, so
+#    results stay exactly those of the old loop (removing one phrase can join its
+#    neighbours into another: filters ["c", "ab"] turn "acb" into "").
+_FILTER_CACHE: Dict[int, Tuple[Tuple[str, ...], Optional["re.Pattern[str]"]]] = {}
+_FILTER_CACHE_LOCK = threading.Lock()
+_FILTER_CACHE_STATS: Dict[str, int] = {"hits": 0, "loads": 0, "invalidations": 0}
+
+
+def _load_user_filters(user_id: int) -> Tuple[Tuple[str, ...], Optional["re.Pattern[str]"]]:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute("SELECT phrase FROM filters WHERE user_id=?", (user_id,))
+    phrases = tuple(r["phrase"] for r in cur.fetchall() if r["phrase"])
+    conn.close()
+    # Only a "does any phrase occur" check; longest first keeps the alternation cheap.
+    ordered = sorted(set(phrases), key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(p) for p in ordered)) if ordered else None
+    return phrases, pattern
+
+
+def _user_filter_entry(user_id: int) -> Tuple[Tuple[str, ...], Optional["re.Pattern[str]"]]:
+    uid = int(user_id)
+    entry = _FILTER_CACHE.get(uid)
+    if entry is not None:
+        _FILTER_CACHE_STATS["hits"] += 1
+        return entry
+    entry = _load_user_filters(uid)
+    with _FILTER_CACHE_LOCK:
+        _FILTER_CACHE[uid] = entry
+    _FILTER_CACHE_STATS["loads"] += 1
+    return entry
+
+
+def invalidate_user_filters(user_id: int) -> None:
+    with _FILTER_CACHE_LOCK:
+        _FILTER_CACHE.pop(int(user_id), None)
+    _FILTER_CACHE_STATS["invalidations"] += 1
+
+
+def get_user_filters(user_id: int) -> List[str]:
+    return list(_user_filter_entry(user_id)[0])
+
+
+def user_filter_pattern(user_id: int) -> Optional["re.Pattern[str]"]:
+    return _user_filter_entry(user_id)[1]
+
+
+_prev_cmd_filter_20261019r = cmd_filter
+
+
+async def cmd_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        return await _prev_cmd_filter_20261019r(update, context)
+    finally:
+        if update.effective_user:
+            invalidate_user_filters(update.effective_user.id)
+
+
+_prev_ai_runtime_stats_lines_20261019r = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _FILTER_CACHE_STATS
+    return _prev_ai_runtime_stats_lines_20261019r() + [
+        f"🧹 Filter Cache: admins <code>{h(len(_FILTER_CACHE))}</code> · hits <code>{h(st['hits'])}</code> · DB loads <code>{h(st['loads'])}</code> · invalidations <code>{h(st['invalidations'])}</code>",
+    ]
+
+# ===== END FILTER CACHE PATCH =====
+
+
+# ===== SINGLE-PASS CLEAN_LATEX PATCH (2026-10-19s) =====
+# Goal:
+# 1) clean_latex runs one tokenizer regex over the text instead of ~35 separate passes
+#    (unwrap rounds, \frac rounds, 24 str.replace calls, ^/_ passes, backslash strip).
+#    Symbols come from a precompiled table; ^/_ runs use str.translate tables.
+# 2) Output is identical to the previous implementation. The few constructs where stage
+#    order matters (nested braces, a removed \( / $ gluing characters into a new token,
+#    ^/_ runs continuing across a removed delimiter, ...) are matched as "hazard" tokens
+#    and that text is handed to the previous implementation unchanged.
+# 3) Line cleanup (trailing spaces, tab/space runs, 3+ blank lines) is three compiled
+#    regexes over the result instead of a Python loop per line.
+_prev_clean_latex_20261019s = clean_latex
+
+_LATEX_SYMBOLS: Dict[str, str] = {
+    r"\times": "×", r"\cdot": "·", r"\approx": "≈", r"\neq": "≠", r"\leq": "≤", r"\geq": "≥",
+    r"\pm": "±", r"\mp": "∓", r"\rightarrow": "→", r"\leftarrow": "←", r"\infty": "∞",
+    r"\degree": "°", r"\alpha": "α", r"\beta": "β", r"\gamma": "γ", r"\theta": "θ", r"\pi": "π",
+    r"\sigma": "σ", r"\Delta": "Δ", r"\omega": "ω", r"\lambda": "λ", r"\mu": "μ", r"\rho": "ρ",
+}
+_LATEX_SUP_TABLE = str.maketrans({
+    "0": "⁰", "1": "¹", "2": "²", "3": "³", "4": "⁴", "5": "⁵", "6": "⁶", "7": "⁷", "8": "⁸", "9": "⁹",
+    "+": "⁺", "-": "⁻", "(": "⁽", ")": "⁾", "n": "ⁿ", "i": "ⁱ",
+})
+_LATEX_SUB_TABLE = str.maketrans({
+    "0": "₀", "1": "₁", "2": "₂", "3": "₃", "4": "₄", "5": "₅", "6": "₆", "7": "₇", "8": "₈", "9": "₉",
+    "+": "₊", "-": "₋", "(": "₍", ")": "₎", "a": "ₐ", "e": "ₑ", "h": "ₕ", "i": "ᵢ", "j": "ⱼ",
+    "k": "ₖ", "l": "ₗ", "m": "ₘ", "n": "ₙ", "o": "ₒ", "p": "ₚ", "r": "ᵣ", "s": "ₛ", "t": "ₜ",
+    "u": "ᵤ", "v": "ᵥ", "x": "ₓ",
+})
+
+
+_LATEX_WRAP_WORDS = ("text", "mathrm", "mathbf", "mathit", "operatorname", "textrm")
+_LATEX_KW = "|".join(_LATEX_WRAP_WORDS)
+_LATEX_RM = r"(?:\\[()\[\]]|\\left(?!arrow)|\\right(?!arrow)|\$)"
+
+
+def _latex_prefix_regex(words) -> str:
+    """Trie-shaped regex matching any proper prefix of the given command names."""
+    trie: Dict[str, Any] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+
+    def _branch(node: Dict[str, Any]) -> str:
+        # Only children that are themselves proper prefixes (i.e. have children) are emitted.
+        parts = [re.escape(ch) + (f"(?:{_branch(child)})?" if any(child.values()) else "") for ch, child in node.items() if child]
+        return "|".join(parts)
+
+    return f"(?:{_branch(trie)})"
+
+
+def _latex_token_regex() -> "re.Pattern[str]":
+    kw, rm, cls, pre = _LATEX_KW, _LATEX_RM, _LATEX_RUN_CHAR, _LATEX_PREFIX
+    wrap_flat = rf"\\(?:{kw})\{{{cls}+\}}"
+    # The old ^/_ pass ran after \text{} unwrapping and delimiter removal, so a run also
+    # spans removed delimiters and \text{...} blocks whose content is all run characters.
+    run_start = rf"{rm}*(?:{cls}|{wrap_flat})"
+    run = rf"(?:{cls}|{wrap_flat}|{rm})"
+    construct = rf"(?:\\(?:{kw})|\\?frac)\{{"
+    # \frac arguments may hold flat \text{...} blocks: the old code unwrapped those first.
+    frac_arg = rf"(?:\\(?:{kw})\{{[^{{}}]+\}}|[^{{}}])+"
+    frac = (
+        rf"frac\{{(?:(?P<frac>({frac_arg})\}}\{{({frac_arg}))\}}"
+        rf"|(?P<hz_frac>[^{{}}]*(?:\}}\{{[^{{}}]*)?{construct}))"
+    )
+    # "\" + letters that an unwrapped text / "(" / removed delimiter would complete into a command.
+    glue_hazard = rf"(?=[A-Za-z]{{0,11}}\\)(?:{pre}?\\(?:{kw})\{{|\\frac\{{|{_latex_prefix_regex(('left', 'right'))}?\\(?:[()\[\]]|left|right))"
+    # A ^/_ run that reaches a command it cannot absorb would have grown once it was expanded.
+    run_hazard = rf"{rm}*\{{?{run}*(?:\\(?:{kw})\{{(?!{cls}+\}})|\\?frac\{{|{wrap_flat}[A-Za-z]*\{{)"
+    # ^ output that stays ASCII (unmapped letters) joins a preceding _ run.
+    sup_glue_hazard = rf"{rm}*\{{?{run}*\^{rm}*\{{?{rm}*(?:[A-Za-hj-mo-z]|\\)"
+    symbols = "|".join(re.escape(k[1:]) for k in _LATEX_SYMBOLS)
+    # Every top-level branch starts with a literal so the engine can skip plain text quickly.
+    # Nested commands (which the old code unwrapped in rounds) are matched as hazards.
+    return re.compile(
+        rf"\\(?:(?:{kw})\{{(?:(?P<wrap>[^{{}}]+)\}}|(?P<hz_wrap>[^{{}}]*{construct}))"
+        rf"|{frac}"
+        rf"|(?P<hz_glue>{glue_hazard})"
+        rf"|(?P<sym>{symbols})"
+        r"|(?P<rm>[()\[\]]|left(?!arrow)|right(?!arrow)))"
+        rf"|\^(?:(?P<hz_sup>{run_hazard})|(?P<sup>{rm}*\{{?({run_start}{run}*)\}}?))"
+        rf"|_(?:(?P<hz_sub>{run_hazard}|{sup_glue_hazard})|(?P<sub>{rm}*\{{?({run_start}{run}*)\}}?))"
+        rf"|{frac.replace('?P<', '?P<bare_')}"
+    )
+
+
+_LATEX_RUN_CHAR = r"[0-9A-Za-z+\-()]"
+# "\" + a proper prefix of a command name: text glued after it can complete the command.
+_LATEX_PREFIX = _latex_prefix_regex([k[1:] for k in _LATEX_SYMBOLS] + ["left", "right", "frac"] + list(_LATEX_WRAP_WORDS))
+_LATEX_TOKEN_RE = _latex_token_regex()
+_LATEX_SYMBOL_BY_NAME = {k[1:]: v for k, v in _LATEX_SYMBOLS.items()}
+_LATEX_RUN_MARKUP_RE = re.compile(rf"\\(?:{_LATEX_KW})\{{|\}}|{_LATEX_RM}")
+_LATEX_WRAP_FLAT_RE = re.compile(rf"\\(?:{_LATEX_KW})\{{([^{{}}]+)\}}")
+# Unwrapped text ending in "\le" / "x^2" etc. continues into whatever follows the "}".
+_LATEX_OPEN_TAIL_RE = re.compile(rf"(?:\\{_LATEX_PREFIX}?{_LATEX_RM}*|[\^_](?:{_LATEX_RUN_CHAR}|{_LATEX_RM})*)$")
+_LATEX_CONTINUES_RE = re.compile(rf"{_LATEX_RM}*[0-9A-Za-z+\-(){{}}\\^]")
+_LATEX_WRAP_BRACE_RE = re.compile(r"[A-Za-z]*\{")
+_LATEX_SPACE_RUN_RE = re.compile(r" [ \t]+|\t[ \t]*")
+_LATEX_BLANK_RUN_RE = re.compile(r"\n{3,}")
+_CLEAN_LATEX_STATS: Dict[str, int] = {"fast": 0, "fallback": 0}
+
+
+class _LatexNeedsStagedClean(Exception):
+    pass
+
+
+def _latex_run(m: "re.Match[str]", table: Dict[int, str]) -> str:
+    run = m.group(m.lastindex + 1)
+    if "\\" in run or "$" in run:
+        run = _LATEX_RUN_MARKUP_RE.sub("", run)
+    return run.translate(table)
+
+
+def _latex_token(m: "re.Match[str]") -> str:
+    kind = m.lastgroup
+    if kind == "sym":
+        return _LATEX_SYMBOL_BY_NAME[m.group(kind)]
+    if kind == "rm":
+        return ""
+    if kind == "sup":
+        return _latex_run(m, _LATEX_SUP_TABLE)
+    if kind == "sub":
+        return _latex_run(m, _LATEX_SUB_TABLE)
+    if kind == "wrap":
+        body = m.group(kind)
+        end = m.end()
+        if _LATEX_WRAP_BRACE_RE.match(m.string, end) or (_LATEX_OPEN_TAIL_RE.search(body) and _LATEX_CONTINUES_RE.match(m.string, end)):
+            raise _LatexNeedsStagedClean()
+        return _LATEX_TOKEN_RE.sub(_latex_token, body)
+    if kind == "frac" or kind == "bare_frac":
+        i = m.lastindex
+        num, den = m.group(i + 1), m.group(i + 2)
+        if ("^" in den or "_" in den) and _LATEX_CONTINUES_RE.match(m.string, m.end()):
+            raise _LatexNeedsStagedClean()  # the run would continue through ")" into the next word
+        if "{" in num:
+            num = _LATEX_WRAP_FLAT_RE.sub(lambda w: w.group(1), num)
+        if "{" in den:
+            den = _LATEX_WRAP_FLAT_RE.sub(lambda w: w.group(1), den)
+        return _LATEX_TOKEN_RE.sub(_latex_token, f"({num}/{den})")
+    raise _LatexNeedsStagedClean()
+
+
+def clean_latex(text: str) -> str:
+    """Clean LaTeX-ish output while preserving readable Telegram line breaks."""
+    if not text:
+        return ""
+    s = str(text).replace("\r\n", "\n").replace("\r", "\n")
+    try:
+        s = _LATEX_TOKEN_RE.sub(_latex_token, s)
+    except _LatexNeedsStagedClean:
+        _CLEAN_LATEX_STATS["fallback"] += 1
+        return _prev_clean_latex_20261019s(text)
+    _CLEAN_LATEX_STATS["fast"] += 1
+    # "$" and stray backslashes were left in place by the tokenizer; nothing after them cares.
+    s = s.replace("$", "").replace("\\", "")
+    s = "\n".join(line.strip() for line in s.split("\n"))
+    s = _LATEX_SPACE_RUN_RE.sub(" ", s)
+    return _LATEX_BLANK_RUN_RE.sub("\n\n", s).strip()
+
+# ===== END SINGLE-PASS CLEAN_LATEX PATCH =====
+
+
+# ===== COMPILED QUIZ TEXT PARSER PATCH (2026-10-19t) =====
+# Goal:
+# 1) Every pattern on the paste -> buffer payload path is compiled once at import instead of
+#    going through re.sub/re.match/re.split with a pattern string on each line.
+# 2) parse_text_block finds the explanation marker with one MULTILINE search over the block
+#    (not a re.match per line) and matches each option label once, slicing it off instead
+#    of running OPT_LINE_RE and then clean_option_text's copy of the same pattern.
+# 3) clean_common / clean_explanation skip passes that cannot change the text: [ ... ]
+#    removal without a "[", URL removal without "://", and single spaces in the collapse.
+# 4) split_blocks / parse_text_block / clean_* keep their names and signatures; the output
+#    is pinned by the admin pastes in benchmarks/golden/quiz_text.
+_QUIZ_BLOCK_SPLIT_RE = re.compile(r"\n\s*\n+|\n\s*n\s*\n", re.IGNORECASE)
+_QUIZ_EXPL_MARKER_RE = re.compile(r"^[^\S\n]*(?:Explanation|Note|ব্যাখ্যা)[:\-]", re.IGNORECASE | re.MULTILINE)
+_QUIZ_EXPL_PREFIX_RE = re.compile(r"^(?:Explanation|Note|ব্যাখ্যা)[:\-]\s*", re.IGNORECASE)
+_QUIZ_EXPL_HEADING_RE = re.compile(r"^\s*(?:Explanation\s*(?:for\s*question\s*\d+)?|Explain)\s*[:\-]*\s*", re.IGNORECASE)
+_QUIZ_TRAILING_SEP_RE = re.compile(r"\s*[:;\-–—]+\s*$")
+# Same result as [ \t]+ -> " ", but single spaces are not matched (and rewritten) one by one.
+_QUIZ_SPACE_RUN_RE = re.compile(r"[ \t]{2,}|\t")
+_QUIZ_BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+def _nonblank_lines(text: str) -> List[str]:
+    return [s for s in map(str.strip, text.split("\n")) if s]
+
+
+def clean_common(text: str, user_id: int) -> str:
+    if not text:
+        return ""
+    pattern = user_filter_pattern(user_id)
+    if pattern is not None and pattern.search(text):
+        # /filter order, like the old loop: a removal can create another phrase.
+        for phrase in get_user_filters(user_id):
+            text = text.replace(phrase, "")
+    if "[" in text:
+        text = BRACKET_ANY_RE.sub("", text)
+    text = _strip_leading_serials(text)
+    return _QUIZ_SPACE_RUN_RE.sub(" ", text).strip()
+
+
+def clean_explanation(text: str, user_id: int) -> str:
+    if not text:
+        return ""
+    text = clean_common(text, user_id)
+    text = _QUIZ_EXPL_HEADING_RE.sub("", text, count=1)
+    if "[" in text:
+        text = MD_LINK_RE.sub("", text)
+        text = BRACKET_ANY_RE.sub("", text)
+    if "://" in text:
+        text = URL_RE.sub("", text)
+    text = _QUIZ_SPACE_RUN_RE.sub(" ", text)
+    return _QUIZ_BLANK_RUN_RE.sub("\n\n", text).strip()
+
+
+def split_inline_explain(text: str) -> Tuple[str, str]:
+    """
+    If the question line contains something like:
+      '... explain ; ...'  OR  '... Explanation: ...'  OR  '... ব্যাখ্যা: ...'
+    then split it into (question, explanation).
+    """
+    t = (text or "").strip()
+    if not t:
+        return "", ""
+    m = INLINE_EXPL_RE.match(t)
+    if not m:
+        return t, ""
+    q = (m.group(1) or "").strip()
+    e = (m.group(2) or "").strip()
+    return _QUIZ_TRAILING_SEP_RE.sub("", q).strip(), e
+
+
+def clean_option_text(line: str) -> str:
+    return OPT_LINE_RE.sub("", line, count=1).strip()
+
+
+def split_blocks(text: str) -> List[str]:
+    if not text:
+        return []
+    parts = _QUIZ_BLOCK_SPLIT_RE.split(text.replace("\r\n", "\n"))
+    return [s for s in map(str.strip, parts) if s]
+
+
+def parse_text_block(block: str, user_id: int) -> Optional[Dict[str, Any]]:
+    explanation = ""
+    m = _QUIZ_EXPL_MARKER_RE.search(block)
+    if m:
+        raw_expl = "\n".join(_nonblank_lines(block[m.start():]))
+        raw_expl = _QUIZ_EXPL_PREFIX_RE.sub("", raw_expl, count=1).strip()
+        explanation = clean_explanation(raw_expl, user_id)
+        block = block[:m.start()]
+    lines = _nonblank_lines(block)
+    if not lines:
+        return None
+
+    question_parts: List[str] = []
+    options: List[str] = []
+    correct_answer = 0
+
+    q0 = clean_common(lines[0], user_id)
+    if q0:
+        question_parts.append(q0)
+
+    for ln in lines[1:]:
+        ln = clean_common(ln, user_id)
+        if not ln:
+            continue
+        label = OPT_LINE_RE.match(ln)
+        if label is None:
+            question_parts.append(ln)
+            continue
+        is_correct = ln.endswith("*")
+        if is_correct:
+            ln = ln[:-1].strip()
+        # Reuse the label match unless dropping the "*" cut into it (e.g. "a) *").
+        end = label.end()
+        options.append(ln[end:].strip() if end < len(ln) else clean_option_text(ln))
+        if is_correct:
+            correct_answer = len(options)
+
+    final_question = " ".join(question_parts).strip()
+    final_question = clean_common(final_question, user_id)  # ensure serial/brackets removed fully
+
+    q2, expl2 = split_inline_explain(final_question)
+    if expl2:
+        final_question = q2.strip()
+        cleaned = clean_explanation(expl2, user_id)
+        if cleaned:
+            explanation = (explanation + "\n" + cleaned).strip() if explanation else cleaned
+
+    if not final_question:
+        return None
+
+    opts = options + [""] * (5 - len(options))
+    return {
+        "questions": final_question,
+        "option1": opts[0], "option2": opts[1], "option3": opts[2],
+        "option4": opts[3], "option5": opts[4],
+        "answer": int(correct_answer) if correct_answer else 0,
+        "explanation": explanation,
+        "type": 1, "section": 1,
+    }
+
+# ===== END COMPILED QUIZ TEXT PARSER PATCH =====
+
+
+# ===== CONFIGURABLE BOT API ENDPOINT PATCH (2026-10-19u) =====
+# Goal:
+# 1) TELEGRAM_API_BASE_URL points every Bot API call at another server (a self-hosted
+#    telegram-bot-api, or benchmarks/fake_bot_api.py for load tests) instead of
+#    https://api.telegram.org. Empty = Telegram, as before.
+# 2) BOT_CONCURRENT_UPDATES sizes PTB's concurrent update processing (was a fixed 64),
+#    so the value can be chosen from replayer measurements.
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").strip().rstrip("/")
+BOT_CONCURRENT_UPDATES = max(1, int(os.getenv("BOT_CONCURRENT_UPDATES", "64") or "64"))
+_PTB_APPLICATION_BUILDER = ApplicationBuilder
+
+
+def telegram_api_method_url(method: str) -> str:
+    return f"{TELEGRAM_API_BASE_URL or 'https://api.telegram.org'}/bot{BOT_TOKEN}/{method}"
+
+
+class _ConfiguredApplicationBuilder(_PTB_APPLICATION_BUILDER):
+    """ApplicationBuilder that applies the endpoint / concurrency settings above.
+
+    Every build_app() layer calls ApplicationBuilder() by name, so rebinding the name is
+    enough; the layers keep calling .concurrent_updates(64) and get the configured size.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        if TELEGRAM_API_BASE_URL:
+            self.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+            self.base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+
+    def concurrent_updates(self, concurrent_updates):
+        if isinstance(concurrent_updates, int):
+            concurrent_updates = BOT_CONCURRENT_UPDATES
+        return super().concurrent_updates(concurrent_updates)
+
+
+ApplicationBuilder = _ConfiguredApplicationBuilder
+
+
+def _send_pending_restart_notice_via_http() -> None:
+    notice = _get_restart_notice()
+    chat_id = int(notice.get("chat_id") or 0)
+    if not chat_id:
+        return
+    text = ui_box_html("Restart Successful", "The bot has restarted successfully and is operational again.", emoji="✅")
+    try:
+        requests.post(
+            telegram_api_method_url("sendMessage"),
+            data={
+                "chat_id": str(chat_id),
+                "text": text,
+                "parse_mode": "HTML",
+                "disable_web_page_preview": "true",
+            },
+            timeout=20,
+        )
+    except Exception as e:
+        logger.exception("restart success notification failed: %s", e)
+
+# ===== END CONFIGURABLE BOT API ENDPOINT PATCH =====
+
+
+# ===== BUFFER FINGERPRINT DEDUP PATCH (2026-10-19w) =====
+# Goal:
+# 1) quiz_buffer rows carry a fingerprint of the normalized question + options (one
+#    leading serial, bracket tags, case and whitespace stripped, Bangla digits unified),
+#    computed once at insert. Unlike the answer cache normalizer, operators and other
+#    punctuation are kept: "2+2" and "2-2" with the same options are different questions.
+#    Serials use the answer cache's _QNORM_SAFE_SERIAL_RE, so "5 - 3 = ?" and
+#    "1 : 2 ..." keep their leading operand.
+# 2) A unique (user_id, fingerprint) index makes the insert itself the duplicate check:
+#    INSERT OR IGNORE costs one indexed probe per question, no buffer scan.
+# 3) Pasted text, forwarded polls, images and albums report duplicates in their
+#    "Added to Buffer" feedback instead of storing them again.
+_BUFFER_DEDUP_STATS: Dict[str, int] = {"added": 0, "duplicates": 0}
+_BUFFER_FP_VERSION = "2"  # bump when _buffer_fp_text changes; db init recomputes stored fingerprints
+_BUFFER_FP_TAIL_RE = re.compile(r"[\s?？।.:;!]+$")
+_BUFFER_FP_SPACE_RE = re.compile(r"\s+")
+
+
+def _buffer_fp_text(s: Any, *, option: bool = False) -> str:
+    t = unicodedata.normalize("NFC", str(s or "")).translate(_BN_DIGIT_TRANS).casefold()
+    if option:
+        t = _QNORM_OPT_LABEL_RE.sub("", t)
+    else:
+        t = _QNORM_SAFE_SERIAL_RE.sub("", _QNORM_BRACKET_RE.sub(" ", t).lstrip(), count=1)
+    return _BUFFER_FP_SPACE_RE.sub("", _BUFFER_FP_TAIL_RE.sub("", t))
+
+
+def buffer_fingerprint(payload: Dict[str, Any]) -> Optional[str]:
+    """Fingerprint of a buffer payload; None when there is no question text to compare."""
+    question = _buffer_fp_text(payload.get("questions", ""))
+    options = sorted(o for o in (_buffer_fp_text(payload.get(f"option{i}", ""), option=True) for i in range(1, 6)) if o)
+    if not question and not options:
+        return None
+    return hashlib.sha1("\x1e".join([question] + options).encode("utf-8")).hexdigest()
+
+
+def _buffer_fingerprint_backfill(cur) -> None:
+    """(Re)compute every row's fingerprint. Duplicates already in a buffer keep a NULL
+    fingerprint so the unique index holds over them."""
+    cur.execute("UPDATE quiz_buffer SET fingerprint=NULL")
+    cur.execute("SELECT id, user_id, payload_json FROM quiz_buffer ORDER BY id ASC")
+    seen = set()
+    updates = []
+    for r in cur.fetchall():
+        try:
+            fp = buffer_fingerprint(json.loads(r["payload_json"]))
+        except Exception:
+            fp = None
+        if fp is None or (r["user_id"], fp) in seen:
+            continue
+        seen.add((r["user_id"], fp))
+        updates.append((fp, r["id"]))
+    cur.executemany("UPDATE quiz_buffer SET fingerprint=? WHERE id=?", updates)
+
+
+def _buffer_fingerprint_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    # Migration: fingerprint column, backfilled once and again whenever the
+    # normalization (_BUFFER_FP_VERSION) changes.
+    stale = get_setting("quiz_buffer_fp_version", "") != _BUFFER_FP_VERSION
+    if not _table_has_column(conn, "quiz_buffer", "fingerprint"):
+        cur.execute("ALTER TABLE quiz_buffer ADD COLUMN fingerprint TEXT")
+        stale = True
+    if stale:
+        _buffer_fingerprint_backfill(cur)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_quiz_buffer_user_fp ON quiz_buffer(user_id, fingerprint)")
+    conn.commit()
+    conn.close()
+    if stale:
+        set_setting("quiz_buffer_fp_version", _BUFFER_FP_VERSION)
+
+
+_prev_db_init_20261019w = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019w()
+    _buffer_fingerprint_db_init()
+
+
+def buffer_add_many(user_id: int, payloads: List[Dict[str, Any]], limit: Optional[int] = None) -> Tuple[int, int]:
+    """Insert payloads in one transaction, skipping ones already buffered. Returns (added, duplicates).
+
+    At most `limit` rows are added; payloads after that are neither stored nor counted.
+    """
+    added = dups = 0
+    if not payloads or (limit is not None and limit <= 0):
+        return 0, 0
+    created = now_iso()
+    conn = db_connect()
+    cur = conn.cursor()
+    for payload in payloads:
+        if limit is not None and added >= limit:
+            break
+        cur.execute(
+            "INSERT OR IGNORE INTO quiz_buffer(user_id, payload_json, created_at, fingerprint) VALUES (?,?,?,?)",
+            (user_id, json.dumps(payload, ensure_ascii=False), created, buffer_fingerprint(payload)),
+        )
+        if cur.rowcount == 1:
+            added += 1
+        else:
+            dups += 1
+    conn.commit()
+    conn.close()
+    _BUFFER_DEDUP_STATS["added"] += added
+    _BUFFER_DEDUP_STATS["duplicates"] += dups
+    return added, dups
+
+
+def buffer_add(user_id: int, payload: Dict[str, Any]) -> bool:
+    """False when the same question is already in this admin's buffer."""
+    return buffer_add_many(user_id, [payload])[0] == 1
+
+
+def _buffer_dup_note(dups: int) -> str:
+    if not dups:
+        return ""
+    return f"\n⚠️ <code>{h(dups)}</code> duplicate(s) skipped (already in your buffer)."
+
+
+@require_admin_silent
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ensure_user(update)
+    uid = update.effective_user.id if update.effective_user else 0
+    if not uid or is_banned(uid):
+        return
+    role = get_role(uid)
+    if role not in (ROLE_ADMIN, ROLE_OWNER):
+        return
+    if is_private_chat(update) and (solver_mode_on(uid) or himusai_mode_on(uid)):
+        return
+    text = update.message.text or ""
+    if not text.strip():
+        return
+    room = MAX_BUFFERED_QUESTIONS - buffer_count(uid)
+    if room <= 0:
+        await warn(update, "Buffer Limit Reached", f"You have {MAX_BUFFERED_QUESTIONS} questions buffered.\n\nUse /done to export or /clear to reset.")
+        return
+    payloads = []
+    for b in split_blocks(text):
+        try:
+            payload = parse_text_block(b, uid)
+            if payload:
+                payloads.append(payload)
+        except Exception as e:
+            db_log("ERROR", "parse_text_failed", {"admin_id": uid, "error": str(e)})
+    added, dups = buffer_add_many(uid, payloads, limit=room)
+    if added:
+        await _show_buffer_feedback(
+            update,
+            context,
+            "Added to Buffer",
+            f"<code>{h(added)}</code> question(s) added.{_buffer_dup_note(dups)}\n\nTotal buffered: <code>{h(buffer_count(uid))}</code>",
+        )
+    elif dups:
+        await _show_buffer_feedback(
+            update,
+            context,
+            "Already Buffered",
+            f"All <code>{h(dups)}</code> question(s) are already in your buffer.\n\nTotal buffered: <code>{h(buffer_count(uid))}</code>",
+            emoji="⚠️",
+        )
+    else:
+        await warn(update, "No Questions Found", "No valid quiz blocks detected. Check formatting.")
+
+
+@require_admin_silent
+async def handle_poll(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ensure_user(update)
+    uid = update.effective_user.id if update.effective_user else 0
+    if not uid or is_banned(uid):
+        return
+    role = get_role(uid)
+    if role not in (ROLE_ADMIN, ROLE_OWNER):
+        return
+    if is_private_chat(update) and (solver_mode_on(uid) or himusai_mode_on(uid)):
+        return
+    poll = update.message.poll
+    question = clean_common(poll.question or "", uid)
+    options = [o.text for o in poll.options]
+    opts = options + [""] * (5 - len(options))
+    explanation = ""
+    if hasattr(poll, "explanation") and poll.explanation:
+        explanation = clean_explanation(poll.explanation, uid)
+    correct_answer_id = 0
+    if poll.type == "quiz" and poll.correct_option_id is not None:
+        correct_answer_id = int(poll.correct_option_id) + 1
+    payload = {
+        "questions": question,
+        "option1": (opts[0] or "").strip(),
+        "option2": (opts[1] or "").strip(),
+        "option3": (opts[2] or "").strip(),
+        "option4": (opts[3] or "").strip(),
+        "option5": (opts[4] or "").strip(),
+        "answer": correct_answer_id,
+        "explanation": explanation,
+        "type": 1,
+        "section": 1,
+    }
+    if buffer_count(uid) >= MAX_BUFFERED_QUESTIONS:
+        await warn_html(update, "Buffer Limit Reached", f"You have <code>{h(MAX_BUFFERED_QUESTIONS)}</code> questions buffered.\n\nUse <code>/done</code> to export or <code>/clear</code> to reset.")
+        return
+    if not buffer_add(uid, payload):
+        await _show_buffer_feedback(
+            update,
+            context,
+            "Already Buffered",
+            f"This poll is already in your buffer.\n\nTotal buffered: <code>{buffer_count(uid)}</code>",
+            emoji="⚠️",
+        )
+        return
+    note = ""
+    if correct_answer_id == 0 and poll.type == "quiz":
+        note = "<br><br>⚠️ Telegram may hide the correct answer in forwarded quizzes. Export will store <code>answer=0</code>."
+    await _show_buffer_feedback(
+        update,
+        context,
+        "Poll Saved",
+        f"Total buffered: <code>{buffer_count(uid)}</code>{note}",
+    )
+
+
+async def _process_album(context: ContextTypes.DEFAULT_TYPE, album: Dict[str, Any]) -> None:
+    uid = int(album["uid"])
+    pages = sorted(album["messages"], key=lambda m: int(m.message_id))
+    total = len(pages)
+    state = {"done": 0, "found": 0, "failed": 0, "last_edit": 0.0}
+    status = None
+    with contextlib.suppress(Exception):
+        status = await pages[0].reply_text(_album_progress_html(0, total, 0, 0), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    async def _edit_progress(force: bool = False) -> None:
+        now_ts = time.time()
+        if status is None or (not force and now_ts - state["last_edit"] < _ALBUM_PROGRESS_EDIT_SECONDS):
+            return
+        state["last_edit"] = now_ts
+        with contextlib.suppress(Exception):
+            await status.edit_text(
+                _album_progress_html(state["done"], total, state["found"], state["failed"]),
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            )
+
+    async def _one(page_no: int, msg) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        try:
+            items = await _extract_page_items(msg, album=True)
+            state["found"] += len(items)
+            return items, None
+        except Exception as e:
+            state["failed"] += 1
+            db_log("ERROR", "image_extract_failed", {"user_id": uid, "page": page_no, "error": str(e)})
+            return [], str(e)
+        finally:
+            state["done"] += 1
+            await _edit_progress()
+
+    results = await asyncio.gather(*[_one(i, m) for i, m in enumerate(pages, start=1)])
+
+    failed_pages: List[int] = []
+    keep_explain = explain_mode_on(uid)
+    payloads: List[Dict[str, Any]] = []
+    for page_no, (items, error) in enumerate(results, start=1):
+        if error is not None:
+            failed_pages.append(page_no)
+        for payload in items:
+            if not keep_explain:
+                payload["explanation"] = ""
+            payloads.append(payload)
+    added, dups = buffer_add_many(uid, payloads, limit=MAX_BUFFERED_QUESTIONS - buffer_count(uid))
+
+    body = (
+        f"Pages: <b>{h(total)}</b> · questions added: <code>{h(added)}</code>"
+        f"{_buffer_dup_note(dups)}\n"
+        f"Total buffered: <code>{h(buffer_count(uid))}</code>"
+    )
+    if failed_pages:
+        body += f"\n\n⚠️ Failed page(s): <code>{h(', '.join(str(p) for p in failed_pages))}</code>"
+    if added + dups < state["found"]:
+        body += f"\n⚠️ Buffer limit reached (<code>{h(MAX_BUFFERED_QUESTIONS)}</code>)."
+    title, emoji = ("Album Processed", "✅") if added else ("Already Buffered", "⚠️") if dups else ("No Questions Found", "⚠️")
+    html = ui_box_html(title, body, emoji=emoji, footer_html="Use <code>/done</code> to export")
+    if status is not None:
+        with contextlib.suppress(Exception):
+            await status.edit_text(html, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+    with contextlib.suppress(Exception):
+        await pages[0].reply_text(html, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+_prev_handle_image_20261019w = handle_image
+
+
+async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Private image/scan -> extract MCQs into buffer, skipping ones already buffered."""
+    msg = update.message
+    if not msg or not update.effective_user or msg.media_group_id:
+        return await _prev_handle_image_20261019w(update, context)
+    ensure_user(update)
+    uid = update.effective_user.id
+    if is_banned(uid) or not is_private_chat(update) or not can_use_vision(uid) or not vision_mode_on(uid):
+        return
+    room = MAX_BUFFERED_QUESTIONS - buffer_count(uid)
+    if room <= 0:
+        await warn(update, "Buffer Limit Reached", f"You have {MAX_BUFFERED_QUESTIONS} questions buffered.\n\nUse /done to export or /clear to reset.")
+        return
+    if not _message_has_image(msg):
+        return
+    if not GEMINI_API_KEY:
+        await safe_reply(update, f"❌ {ui_box_html('Gemini API Key Missing', _gemini_env_missing_message(), emoji='❌')}")
+        return
+
+    try:
+        items = await _extract_page_items(msg)
+        if not explain_mode_on(uid):
+            for payload in items:
+                payload["explanation"] = ""
+        added, dups = buffer_add_many(uid, items, limit=room)
+
+        if added:
+            await ok_html(update, "Image Processed", f"<code>{h(added)}</code> question(s) extracted.{_buffer_dup_note(dups)}\n\nTotal buffered: <code>{h(buffer_count(uid))}</code>", footer_html="Use <code>/done</code> to export")
+        elif dups:
+            await warn_html(update, "Already Buffered", f"All <code>{h(dups)}</code> question(s) from this image are already in your buffer.")
+        else:
+            await warn(update, "No Questions Found", "No MCQs detected in image. Try a clearer scan or tighter crop.")
+    except Exception as e:
+        db_log("ERROR", "image_extract_failed", {"user_id": uid, "error": str(e)})
+        await err(update, "Image Extraction Failed", f"{h(str(e)[:220])}")
+
+
+_prev_ai_runtime_stats_lines_20261019w = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _BUFFER_DEDUP_STATS
+    return _prev_ai_runtime_stats_lines_20261019w() + [
+        f"🧬 Buffer Dedup: added <code>{h(st['added'])}</code> · duplicates skipped <b>{h(st['duplicates'])}</b>",
+    ]
+
+# ===== END BUFFER FINGERPRINT DEDUP PATCH =====
+
+
+# ===== POSTED QUESTION HISTORY PATCH (2026-10-19x) =====
+# Goal:
+# 1) posted_questions remembers every question published to a channel: one row per
+#    (channel_chat_id, question key) with the message id, who posted it and when. The key
+#    is the first 64 bits of the buffer fingerprint (patch w), so the same question posted
+#    as a poll or as an emoji quiz is one entry. Image reaction quizzes use the photo's
+#    file_unique_id. Rows are keyed on the Telegram chat id, not the channel DB-ID, so
+#    every admin posting to a channel shares its history, even after /removechannel and
+#    /addchannel.
+# 2) /post and /postemoji look up the whole buffer in one indexed pass before sending.
+#    /imgreact checks its single photo. WITHOUT ROWID + an integer primary key keeps a
+#    check to one B-tree probe per question, so millions of rows do not slow posting.
+# 3) POSTED_HISTORY_MODE: skip (default) leaves already-posted questions in the buffer
+#    and reports how many were skipped; warn posts them and reports the count; off
+#    disables lookups and recording. "force" after the DB-ID posts them once anyway
+#    (/imgreact takes "--force", or a lone "force", so explanations can start with it).
+POSTED_HISTORY_MODE = os.getenv("POSTED_HISTORY_MODE", "skip").strip().lower()
+if POSTED_HISTORY_MODE not in ("skip", "warn", "off"):
+    POSTED_HISTORY_MODE = "skip"
+_POSTED_LOOKUP_CHUNK = 500  # keeps IN (...) under SQLite's bound-parameter limit
+_POSTED_HISTORY_STATS: Dict[str, int] = {"checked": 0, "already_posted": 0, "skipped": 0, "recorded": 0}
+
+
+def posted_key(fingerprint: Optional[str]) -> Optional[int]:
+    """Signed 64-bit history key from a hex fingerprint; None when there is nothing to key."""
+    if not fingerprint:
+        return None
+    return int.from_bytes(bytes.fromhex(fingerprint[:16]), "big", signed=True)
+
+
+def posted_key_for_payload(payload: Dict[str, Any]) -> Optional[int]:
+    return posted_key(buffer_fingerprint(payload))
+
+
+def posted_key_for_image(file_unique_id: Optional[str]) -> Optional[int]:
+    if not file_unique_id:
+        return None
+    return posted_key(hashlib.sha1(f"img:{file_unique_id}".encode("utf-8")).hexdigest())
+
+
+def _posted_history_db_init() -> None:
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS posted_questions (
+            channel_chat_id INTEGER NOT NULL,
+            fingerprint INTEGER NOT NULL,
+            message_id INTEGER,
+            posted_by INTEGER,
+            posted_at TEXT NOT NULL,
+            PRIMARY KEY (channel_chat_id, fingerprint)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+_prev_db_init_20261019x = db_init
+
+
+def db_init() -> None:
+    _prev_db_init_20261019x()
+    _posted_history_db_init()
+
+
+def posted_lookup(channel_chat_id: int, keys: List[int]) -> Dict[int, Tuple[Optional[int], str]]:
+    """Which keys were already posted to this channel: {key: (message_id, posted_at)}."""
+    wanted = sorted(set(k for k in keys if k is not None))
+    found: Dict[int, Tuple[Optional[int], str]] = {}
+    if not wanted:
+        return found
+    conn = db_connect()
+    cur = conn.cursor()
+    for i in range(0, len(wanted), _POSTED_LOOKUP_CHUNK):
+        chunk = wanted[i:i + _POSTED_LOOKUP_CHUNK]
+        marks = ",".join("?" for _ in chunk)
+        cur.execute(
+            f"SELECT fingerprint, message_id, posted_at FROM posted_questions WHERE channel_chat_id=? AND fingerprint IN ({marks})",
+            [int(channel_chat_id), *chunk],
+        )
+        for r in cur.fetchall():
+            found[int(r["fingerprint"])] = (r["message_id"], str(r["posted_at"] or ""))
+    conn.close()
+    return found
+
+
+def posted_record(channel_chat_id: int, posts: List[Tuple[Optional[int], Optional[int]]], posted_by: int) -> None:
+    """Store (key, message_id) pairs in one transaction; a repost updates the existing row."""
+    rows = [(int(channel_chat_id), k, mid, int(posted_by or 0), now_iso()) for k, mid in posts if k is not None]
+    if POSTED_HISTORY_MODE == "off" or not rows:
+        return
+    conn = db_connect()
+    conn.executemany(
+        "INSERT INTO posted_questions(channel_chat_id, fingerprint, message_id, posted_by, posted_at) VALUES (?,?,?,?,?) "
+        "ON CONFLICT(channel_chat_id, fingerprint) DO UPDATE SET "
+        "message_id=excluded.message_id, posted_by=excluded.posted_by, posted_at=excluded.posted_at",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+    _POSTED_HISTORY_STATS["recorded"] += len(rows)
+
+
+def posted_preflight(
+    channel_chat_id: int,
+    items: List[Tuple[int, Dict[str, Any]]],
+    *,
+    force: bool = False,
+) -> Tuple[List[Tuple[int, Dict[str, Any]]], Dict[int, Optional[int]], int, int]:
+    """Split buffer items before posting. Returns (to_post, {buffer id: key}, already posted, skipped).
+
+    A question that appears twice in the same buffer counts as already posted the second time.
+    """
+    keys = {bid: posted_key_for_payload(payload) for bid, payload in items}
+    if POSTED_HISTORY_MODE == "off":
+        return list(items), keys, 0, 0
+    known = posted_lookup(channel_chat_id, list(keys.values()))
+    skip = POSTED_HISTORY_MODE == "skip" and not force
+    to_post: List[Tuple[int, Dict[str, Any]]] = []
+    seen = set()
+    already = 0
+    for bid, payload in items:
+        key = keys[bid]
+        if key is not None and (key in known or key in seen):
+            already += 1
+            if skip:
+                continue
+        seen.add(key)
+        to_post.append((bid, payload))
+    skipped = len(items) - len(to_post)
+    _POSTED_HISTORY_STATS["checked"] += len(items)
+    _POSTED_HISTORY_STATS["already_posted"] += already
+    _POSTED_HISTORY_STATS["skipped"] += skipped
+    return to_post, keys, already, skipped
+
+
+def _posted_history_note(already: int, skipped: int, cmd: str, cid: int) -> str:
+    if skipped:
+        return (f"Skipped (already posted): {skipped} — still in your buffer.\n"
+                f"Use /{cmd} {cid} force to post them anyway, or /clear.")
+    if already:
+        return f"Already posted before (sent again): {already}"
+    return ""
+
+
+def _post_flags(args: List[str]) -> set:
+    return {str(a).strip().lower() for a in args}
+
+
+@require_admin
+async def cmd_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if not context.args or not context.args[0].isdigit():
+        await safe_reply(update, usage_box("post", "<DB-ID> [keep] [force]", "Post buffered quizzes to a channel. Use 'keep' to keep buffer, 'force' to repost questions already in the channel."))
+        return
+
+    cid = int(context.args[0])
+    flags = _post_flags(context.args[1:])
+    keep = "keep" in flags
+    ch = channel_get_by_id_for_user(admin_id, cid)
+    if not ch:
+        await warn_html(update, "Channel Not Found", f"No access to that channel. Use <code>/listchannels</code> to view yours.")
+        return
+
+    items = buffer_list(admin_id, limit=MAX_BUFFERED_QUESTIONS)
+    if not items:
+        await warn(update, "Buffer Empty", "No quizzes to post. Send text or forward polls first.")
+        return
+
+    items, keys, already, skipped = posted_preflight(ch.channel_chat_id, items, force="force" in flags)
+    history_note = _posted_history_note(already, skipped, "post", cid)
+    if not items:
+        await warn(update, "Already Posted", f"All {skipped} buffered question(s) were already posted to this channel.\n\n{history_note}")
+        return
+
+    skip_html = f"\nSkipping <code>{h(skipped)}</code> already posted." if skipped else ""
+    await info_html(update, "Posting to Channel", f"<code>{h(ch.title)}</code> — <code>{h(str(ch.channel_chat_id))}</code>\n\nPosting <code>{h(len(items))}</code> question(s)...{skip_html}")
+
+    posted_ids: List[int] = []
+    history: List[Tuple[Optional[int], Optional[int]]] = []
+    ok_count, fail_count = 0, 0
+    first_post_message_id = None
+
+    for (row_id, payload) in items:
+        try:
+            q, opts, correct_option_id, expl = quiz_to_poll_parts(payload)
+            if len(opts) < 2:
+                continue
+            prefix = (ch.prefix or "").strip(" ")
+            expl_tail = (ch.expl_link or "").strip()
+            SEP = "\n\u200b"
+            q_final = f"{prefix}{SEP}{q}".strip() if prefix else q
+            if len(q_final) > 300:
+                q_final = q_final[:297] + "..."
+
+            expl_final = expl.strip()
+            if not explain_mode_on(admin_id):
+                expl_final = ""
+            if expl_tail:
+                expl_final = (expl_final + "\n\n" if expl_final else "") + expl_tail
+            expl_final = expl_final.strip()
+            if len(expl_final) > 200:
+                expl_final = expl_final[:197] + "..."
+
+            if correct_option_id >= 0:
+                m = await context.bot.send_poll(
+                    chat_id=ch.channel_chat_id,
+                    question=q_final,
+                    options=opts,
+                    is_anonymous=True,
+                    type=Poll.QUIZ,
+                    correct_option_id=correct_option_id,
+                    explanation=expl_final if expl_final else None,
+                )
+            else:
+                m = await context.bot.send_poll(
+                    chat_id=ch.channel_chat_id,
+                    question=q_final,
+                    options=opts,
+                    is_anonymous=True,
+                    type=Poll.REGULAR,
+                )
+                if expl_final:
+                    await context.bot.send_message(chat_id=ch.channel_chat_id, text=expl_final, disable_web_page_preview=True)
+
+            if first_post_message_id is None and getattr(m, 'message_id', None):
+                first_post_message_id = m.message_id
+            ok_count += 1
+            posted_ids.append(row_id)
+            history.append((keys.get(row_id), getattr(m, 'message_id', None)))
+            await asyncio.sleep(POST_DELAY_SECONDS)
+        except RetryAfter as e:
+            await asyncio.sleep(float(e.retry_after) + 0.5)
+            fail_count += 1
+        except TelegramError as e:
+            fail_count += 1
+            db_log("ERROR", "post_failed", {"admin_id": admin_id, "channel": ch.channel_chat_id, "error": str(e)})
+        except Exception as e:
+            fail_count += 1
+            db_log("ERROR", "post_failed_unknown", {"admin_id": admin_id, "error": str(e)})
+
+    with contextlib.suppress(Exception):
+        posted_record(ch.channel_chat_id, history, admin_id)
+
+    if ok_count > 0 and first_post_message_id:
+        with contextlib.suppress(Exception):
+            await context.bot.send_message(
+                chat_id=ch.channel_chat_id,
+                text=_score_reply_text(ok_count),
+                reply_to_message_id=first_post_message_id,
+                allow_sending_without_reply=True,
+            )
+
+    inc_admin_post(admin_id, ok_count)
+    if posted_ids and not keep:
+        buffer_remove_ids(admin_id, posted_ids)
+    body = f"Posted: {ok_count}\nFailed: {fail_count}\nRemaining in Buffer: {buffer_count(admin_id)}"
+    if history_note:
+        body += f"\n\n{history_note}"
+    await ok(update, "Posting Complete", body)
+
+
+@require_admin
+async def cmd_postemoji(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if not context.args or not context.args[0].isdigit():
+        await safe_reply(update, usage_box("postemoji", "<DB-ID> [keep] [force]", "Post buffered questions as emoji quiz to a channel"))
+        return
+    cid = int(context.args[0])
+    flags = _post_flags(context.args[1:])
+    keep = "keep" in flags
+    ch = channel_get_by_id_for_user(admin_id, cid)
+    if not ch:
+        await warn(update, "Not Found", "Channel not found or no access.")
+        return
+    items = buffer_list(admin_id, limit=MAX_BUFFERED_QUESTIONS)
+    if not items:
+        await warn(update, "Buffer Empty", "No buffered questions found.")
+        return
+    items, keys, already, skipped = posted_preflight(ch.channel_chat_id, items, force="force" in flags)
+    history_note = _posted_history_note(already, skipped, "postemoji", cid)
+    if not items:
+        await warn(update, "Already Posted", f"All {skipped} buffered question(s) were already posted to this channel.\n\n{history_note}")
+        return
+    prefix = str(getattr(ch, "prefix", "") or "").strip()
+    title = prefix if prefix else BOT_BRAND
+    sent = 0
+    sent_ids: List[int] = []
+    history: List[Tuple[Optional[int], Optional[int]]] = []
+    first_post_message_id = None
+    fail_count = 0
+    for bid, payload in items:
+        qtext, opts, corr_idx0, explanation = _normalize_emoji_quiz_parts(payload)
+        if len(opts) < 2:
+            fail_count += 1
+            continue
+        msg_text = _emoji_quiz_text(qtext, opts, title)
+        quiz_id = uuid.uuid4().hex[:10]
+        for attempt in (1, 2):
+            try:
+                m = await context.bot.send_message(
+                    chat_id=ch.channel_chat_id,
+                    text=msg_text,
+                    reply_markup=emoji_quiz_keyboard(len(opts), quiz_id),
+                    disable_web_page_preview=True,
+                )
+                if first_post_message_id is None:
+                    first_post_message_id = m.message_id
+                sent += 1
+                sent_ids.append(bid)
+                history.append((keys.get(bid), m.message_id))
+                emoji_quiz_save(
+                    quiz_id,
+                    ch.channel_chat_id,
+                    m.message_id,
+                    {
+                        "question": qtext,
+                        "options": opts,
+                        "correct_answer": corr_idx0 + 1 if corr_idx0 >= 0 else 0,
+                        "explanation": explanation,
+                        "prefix": title,
+                    },
+                    admin_id,
+                )
+                await asyncio.sleep(0.30)
+                break
+            except RetryAfter as e:
+                if attempt == 1:
+                    await asyncio.sleep(float(getattr(e, 'retry_after', 1.0)) + 0.5)
+                    continue
+                fail_count += 1
+                db_log("ERROR", "postemoji_failed_retry", {"admin_id": admin_id, "channel": getattr(ch, 'channel_chat_id', 0), "error": str(e), "buffer_id": bid})
+            except Exception as e:
+                fail_count += 1
+                event = "postemoji_failed" if attempt == 1 else "postemoji_failed_retry"
+                db_log("ERROR", event, {"admin_id": admin_id, "channel": getattr(ch, 'channel_chat_id', 0), "error": str(e), "buffer_id": bid})
+                break
+
+    with contextlib.suppress(Exception):
+        posted_record(ch.channel_chat_id, history, admin_id)
+
+    if sent > 0 and first_post_message_id:
+        with contextlib.suppress(Exception):
+            await context.bot.send_message(
+                chat_id=ch.channel_chat_id,
+                text=_score_reply_text(sent),
+                reply_to_message_id=first_post_message_id,
+                allow_sending_without_reply=True,
+            )
+    if sent_ids and not keep:
+        buffer_remove_ids(admin_id, sent_ids)
+    body = f"Sent: <code>{h(sent)}</code>\nFailed: <code>{h(fail_count)}</code>\nChannel: <code>{h(getattr(ch, 'title', cid))}</code>"
+    if history_note:
+        body += f"\n\n{h(history_note)}"
+    await ok_html(update, "Emoji Quiz Posted", body)
+
+
+@require_admin
+async def cmd_imgreact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id if update.effective_user else 0
+    if not context.args or len(context.args) < 2 or not str(context.args[0]).isdigit() or not str(context.args[1]).isdigit():
+        await safe_reply(update, usage_box("imgreact", "<DB-ID> <correct_emoji_no 1-4> [--force] [explanation]", "Reply to a photo/image and post it as an image reaction quiz"))
+        return
+    cid = int(context.args[0])
+    corr = int(context.args[1])
+    rest = list(context.args[2:])
+    # The explanation is free text ("Force = mass x acceleration"), so only "--force"
+    # or a lone "force" is the flag.
+    first = str(rest[0]).strip().lower() if rest else ""
+    force = first == "--force" or (first == "force" and len(rest) == 1)
+    if force:
+        rest = rest[1:]
+    if corr < 1 or corr > 4:
+        await warn(update, "Invalid Answer", "correct_emoji_no must be between 1 and 4.")
+        return
+    ch = channel_get_by_id_for_user(admin_id, cid)
+    if not ch:
+        await warn(update, "Not Found", "Channel not found or no access.")
+        return
+    if not update.message or not update.message.reply_to_message:
+        await warn(update, "Reply Required", "Reply to a photo/image message with /imgreact <DB-ID> <correct_emoji_no> [explanation]")
+        return
+    src = update.message.reply_to_message
+    photo_file_id = None
+    photo_unique_id = None
+    if getattr(src, 'photo', None):
+        photo_file_id = src.photo[-1].file_id
+        photo_unique_id = getattr(src.photo[-1], 'file_unique_id', None)
+    elif getattr(src, 'document', None) and str(getattr(src.document, 'mime_type', '')).startswith('image/'):
+        photo_file_id = src.document.file_id
+        photo_unique_id = getattr(src.document, 'file_unique_id', None)
+    if not photo_file_id:
+        await warn(update, "Image Required", "Reply to a photo or image document.")
+        return
+    history_key = posted_key_for_image(photo_unique_id)
+    already = 0
+    if POSTED_HISTORY_MODE != "off" and history_key is not None:
+        prior = posted_lookup(ch.channel_chat_id, [history_key]).get(history_key)
+        _POSTED_HISTORY_STATS["checked"] += 1
+        if prior:
+            already = 1
+            _POSTED_HISTORY_STATS["already_posted"] += 1
+            if POSTED_HISTORY_MODE == "skip" and not force:
+                _POSTED_HISTORY_STATS["skipped"] += 1
+                await warn_html(
+                    update,
+                    "Already Posted",
+                    f"This image was already posted to <code>{h(getattr(ch, 'title', cid))}</code> "
+                    f"(message <code>{h(prior[0])}</code>, {h(prior[1][:16].replace('T', ' '))}).\n\n"
+                    f"Use <code>/imgreact {h(cid)} {h(corr)} --force</code> to post it anyway.",
+                )
+                return
+    explanation = " ".join(rest).strip()
+    prefix = str(getattr(ch, 'prefix', '') or '').strip() or BOT_BRAND
+    caption_parts = [prefix]
+    src_caption = str(getattr(src, 'caption', '') or '').strip()
+    if src_caption:
+        caption_parts.append(src_caption)
+    caption = "\n".join([p for p in caption_parts if p]).strip()
+    quiz_id = uuid.uuid4().hex[:10]
+    try:
+        m = await context.bot.send_photo(
+            chat_id=ch.channel_chat_id,
+            photo=photo_file_id,
+            caption=caption[:1024] if caption else None,
+            reply_markup=emoji_quiz_keyboard(4, quiz_id),
+        )
+        emoji_quiz_save(
+            quiz_id,
+            ch.channel_chat_id,
+            m.message_id,
+            {
+                "question": src_caption,
+                "options": EMOJI_BUTTONS[:4],
+                "correct_answer": corr,
+                "explanation": explanation,
+                "prefix": prefix,
+                "image_file_id": photo_file_id,
+                "image_mode": 1,
+            },
+            admin_id,
+        )
+        with contextlib.suppress(Exception):
+            posted_record(ch.channel_chat_id, [(history_key, m.message_id)], admin_id)
+        note = "\n\nAlready posted before (sent again)." if already else ""
+        await ok_html(update, "Image Reaction Quiz Posted", f"Channel: <code>{h(getattr(ch, 'title', cid))}</code>{note}")
+    except Exception as e:
+        db_log("ERROR", "imgreact_failed", {"admin_id": admin_id, "channel": getattr(ch, 'channel_chat_id', 0), "error": str(e)})
+        await err(update, "Post Failed", str(e)[:180])
+
+
+_prev_ai_runtime_stats_lines_20261019x = _ai_runtime_stats_lines
+
+
+def _ai_runtime_stats_lines() -> List[str]:
+    st = _POSTED_HISTORY_STATS
+    return _prev_ai_runtime_stats_lines_20261019x() + [
+        f"📚 Post History ({h(POSTED_HISTORY_MODE)}): checked <code>{h(st['checked'])}</code> · "
+        f"already posted <code>{h(st['already_posted'])}</code> · skipped <b>{h(st['skipped'])}</b> · "
+        f"recorded <code>{h(st['recorded'])}</code>",
+    ]
+
+# ===== END POSTED QUESTION HISTORY PATCH =====
+
 _ensure_runtime_log_file_handler()
 # ===== END FINAL COMMAND / LOG / PERSISTENCE PATCH =====
 
@@ -0,0 +1,209 @@
+"""Measure the AI fallback chain and key rotation against the stub AI backend.
+
+Usage:
+    python benchmarks/bench_ai_fallback.py
+    python benchmarks/bench_ai_fallback.py --scenario key_exhausted,brownout --requests 200 --report ai.json
+    python benchmarks/bench_ai_fallback.py --script outage.json --kind mcq
+
+Starts benchmarks/fake_ai_backend.py in-process and points the bot at it with
+GEMINI_API_BASE_URL / GEMINI_WEB_BASE_URL / PERPLEXITY_API_URL. Bench API keys go in
+GEMINI_API_KEYS unless the environment already sets them. Each scenario loads a
+profile script into the stub. Then --requests questions go through
+_try_gemini_text_backends (text) and/or _try_gemini_mcq_backends (mcq): Gemini web
+first, then REST with key rotation, then Perplexity.
+
+The report gives, per scenario and kind:
+- latency p50/p90/p99/max and the error count
+- which backend answered
+- stub calls per endpoint, outcome and key
+
+Outcomes come from the stub's seeded RNG, so a scenario fails the same way on every run
+(at --concurrency 1). A --script file replaces the built-in scenarios with one named
+after the file.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from fake_ai_backend import FakeAiBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+BENCH_KEYS = "bench-key-000001,bench-key-000002,bench-key-000003"
+
+# Latencies are milliseconds. They are production shapes scaled down about 10x, so all scenarios run in a few minutes.
+_BASE = {
+    "seed": 11,
+    "web_stream": {"latency": "lognormal:120:0.35", "chunks": 4, "chunk_ms": 10},
+    "generate": {"latency": "lognormal:80:0.3"},
+    "perplexity": {"latency": "lognormal:150:0.4"},
+}
+
+
+def _scenario(**layers: Any) -> Dict[str, Any]:
+    out = json.loads(json.dumps(_BASE))
+    for name, layer in layers.items():
+        if isinstance(layer, dict) and isinstance(out.get(name), dict):
+            out[name].update(layer)
+        else:
+            out[name] = layer
+    return out
+
+
+def builtin_scenarios(keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    first = keys[0] if keys else ""
+    return {
+        "healthy": _scenario(),
+        "web_down": _scenario(web_stream={"server_error": 1.0}),
+        "web_truncated": _scenario(web_stream={"truncate": 1.0}),
+        "web_malformed": _scenario(web_stream={"malformed": 1.0}),
+        "key_exhausted": _scenario(web_stream={"server_error": 1.0}, keys={first: {"quota": 1.0}}),
+        "all_keys_exhausted": _scenario(web_stream={"server_error": 1.0}, keys={k: {"quota": 1.0} for k in keys}),
+        "brownout": _scenario(web_stream={"quota": 0.3, "truncate": 0.1},
+                              generate={"quota": 0.3, "forbidden": 0.1, "malformed": 0.05}),
+        "total_outage": _scenario(web_stream={"server_error": 1.0}, generate={"server_error": 1.0},
+                                  perplexity={"malformed": 1.0}),
+    }
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _pct(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, int(round(p / 100.0 * (len(sorted_ms) - 1))))]
+
+
+def _calls(bot, kind: str) -> Callable[[int], Tuple[str, str]]:
+    """Returns f(i) -> (backend that answered, short answer) for one request of this kind."""
+    if kind == "text":
+        def text(i: int) -> Tuple[str, str]:
+            out, backend = bot._try_gemini_text_backends(f"Explain Newton's second law, case {i}.")
+            return backend, out[:40]
+        return text
+
+    def mcq(i: int) -> Tuple[str, str]:
+        data, backend = bot._try_gemini_mcq_backends(f"What is the SI unit of charge? ({i})", ["Ampere", "Coulomb", "Volt", "Ohm"])
+        return backend, str(data.get("answer"))
+    return mcq
+
+
+def run_scenario(bot, api: FakeAiBackend, name: str, script: Dict[str, Any], *, kind: str,
+                 requests: int, concurrency: int) -> Dict[str, Any]:
+    api.load(script)
+    bot._G3_POOL.clear()  # sessions scraped under the previous scenario
+    bot._AI_ATTEMPTS.clear()
+    call = _calls(bot, kind)
+
+    def one(i: int) -> Tuple[float, str]:
+        t = time.perf_counter()
+        try:
+            backend, _ = call(i)
+        except Exception as e:
+            backend = f"error: {type(e).__name__}"
+        return (time.perf_counter() - t) * 1000.0, backend
+
+    t0 = time.perf_counter()
+    if concurrency <= 1:
+        results = [one(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    ms = sorted(r[0] for r in results)
+    served: Dict[str, int] = {}
+    for _, backend in results:
+        served[backend] = served.get(backend, 0) + 1
+    attempts: Dict[str, int] = {}
+    for _ts, backend, _model, key_idx, _json, _lat, outcome, _bytes in list(bot._AI_ATTEMPTS):
+        label = f"{backend}[{key_idx}] {outcome}" if key_idx >= 0 else f"{backend} {outcome}"
+        attempts[label] = attempts.get(label, 0) + 1
+    return {
+        "scenario": name,
+        "kind": kind,
+        "requests": requests,
+        "errors": sum(v for k, v in served.items() if k.startswith("error")),
+        "throughput": round(requests / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(_pct(ms, 50), 2), "p90": round(_pct(ms, 90), 2),
+            "p99": round(_pct(ms, 99), 2), "max": round(ms[-1], 2) if ms else 0.0,
+        },
+        "served_by": dict(sorted(served.items())),
+        "attempts": dict(sorted(attempts.items())),
+        "stub": api.stats(),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--scenario", default="", help="comma-separated built-in scenarios (default: all)")
+    ap.add_argument("--script", default="", help="JSON profile script to run instead of the built-ins")
+    ap.add_argument("--kind", default="text,mcq", help="text, mcq or both")
+    ap.add_argument("--requests", type=int, default=30, help="requests per scenario and kind")
+    ap.add_argument("--concurrency", type=int, default=1, help="worker threads (1 keeps outcomes deterministic)")
+    ap.add_argument("--record", default="", help="JSONL file for every stub call")
+    ap.add_argument("--report", default="", help="write the report JSON here")
+    args = ap.parse_args()
+    kinds = [k for k in args.kind.split(",") if k.strip()]
+    report_path = os.path.abspath(args.report) if args.report else ""
+    script_path = os.path.abspath(args.script) if args.script else ""
+
+    api = FakeAiBackend(record=os.path.abspath(args.record) if args.record else "")
+    api.start()
+    os.environ.update(api.env())
+    os.environ.setdefault("GEMINI_API_KEYS", BENCH_KEYS)
+    os.environ.setdefault("GEMINI_MODEL_WARMUP_COUNT", "0")
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            bot = _load_bot(tmp)
+            logging.getLogger().setLevel(logging.CRITICAL)  # the chain logs every failed attempt
+            bot.db_init()
+            api.load(_BASE)
+            bot.refresh_gemini_model_catalog()
+            if script_path:
+                with open(script_path, "r", encoding="utf-8") as f:
+                    scenarios = {os.path.splitext(os.path.basename(script_path))[0]: json.load(f)}
+            else:
+                scenarios = builtin_scenarios(list(bot.GEMINI_API_KEYS))
+                wanted = [s for s in args.scenario.split(",") if s.strip()]
+                unknown = [s for s in wanted if s not in scenarios]
+                if unknown:
+                    ap.error(f"unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(scenarios)}")
+                if wanted:
+                    scenarios = {s: scenarios[s] for s in wanted}
+            print(f"stub AI backend at {api.base_url}; {len(bot.GEMINI_API_KEYS)} keys; text models {list(bot._all_text_model_candidates())[:3]}")
+            for name, script in scenarios.items():
+                for kind in kinds:
+                    r = run_scenario(bot, api, name, script, kind=kind, requests=args.requests, concurrency=args.concurrency)
+                    results.append(r)
+                    lat = r["latency_ms"]
+                    served = ", ".join(f"{k} {v}" for k, v in r["served_by"].items())
+                    print(f"{name:18s} {kind:4s}  p50 {lat['p50']:8.1f} ms  p90 {lat['p90']:8.1f}  p99 {lat['p99']:8.1f}  "
+                          f"max {lat['max']:8.1f}  stub calls {r['stub']['total_calls']:5d}  served: {served}")
+    finally:
+        api.stop()
+
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "scenarios": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"wrote {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Lookup latency of the MCQ answer cache (exact + near-duplicate).
+
+Usage:
+    python benchmarks/bench_answer_cache.py --rows 1000000 --lookups 2000
+
+Runs against a throwaway database in a temp directory. Filler rows get random
+MinHash signatures so they land in LSH buckets the way real questions do.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+
+REAL_QUESTIONS = [
+    ("বাংলাদেশের রাজধানী কোনটি?", ["চট্টগ্রাম", "ঢাকা", "খুলনা", "সিলেট"]),
+    ("What is the SI unit of force?", ["Joule", "Newton", "Watt", "Pascal"]),
+    ("২৫ এর বর্গমূল কত?", ["৩", "৪", "৫", "৬"]),
+    ("Which organelle is called the powerhouse of the cell?", ["Nucleus", "Ribosome", "Mitochondria", "Golgi body"]),
+    ("H2O অণুতে কয়টি হাইড্রোজেন পরমাণু আছে?", ["১", "২", "৩", "৪"]),
+]
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _fill(bot, rows: int, batch: int = 20000) -> None:
+    rng = random.Random(7)
+    conn = bot.db_connect()
+    cur = conn.cursor()
+    now = bot.now_iso()
+    done = 0
+    while done < rows:
+        n = min(batch, rows - done)
+        cache_rows = []
+        lsh_rows = []
+        for i in range(n):
+            rid = done + i + 1
+            sig = tuple(rng.getrandbits(61) for _ in range(bot._MINHASH_PERMS))
+            cache_rows.append((
+                rid, "G", "%040x" % rng.getrandbits(160), f"filler question {rid}", '["a","b","c","d"]',
+                '{"answer":1}', "bench", struct.pack(bot._MINHASH_SIG_FMT, *sig), now,
+            ))
+            lsh_rows.extend((bk, rid) for bk in bot._lsh_buckets("G", sig))
+        cur.executemany(
+            "INSERT INTO mcq_answer_cache(id, model_code, fingerprint, question, options_json, result_json, backend, signature, created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+            cache_rows,
+        )
+        cur.executemany("INSERT OR IGNORE INTO mcq_answer_lsh(bucket, cache_id) VALUES (?,?)", lsh_rows)
+        conn.commit()
+        done += n
+    conn.close()
+
+
+def _variants(question, options, rng):
+    serial = rng.randint(1, 200)
+    opts = list(options)
+    rng.shuffle(opts)
+    pos = rng.randrange(1, len(question) - 1)
+    question = question[:pos] + question[pos] + question[pos:]  # one-character typo
+    digits = str(serial).translate(str.maketrans("0123456789", "০১২৩৪৫৬৭৮৯")) if rng.random() < 0.5 else str(serial)
+    return f"{digits}. [White Apron] {question}", opts
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--lookups", type=int, default=2000)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_cache_")
+    bot = _load_bot(workdir)
+    bot.db_init()
+
+    t0 = time.perf_counter()
+    _fill(bot, args.rows)
+    print(f"filled {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+    for q, opts in REAL_QUESTIONS:
+        bot.mcq_cache_store("G", q, opts, {"answer": 2, "confidence": 90, "explanation": "", "why_not": {}}, "bench")
+
+    rng = random.Random(11)
+    timings = {"exact": [], "near": [], "miss": []}
+    hits = {"exact": 0, "near": 0, "miss": 0}
+    for i in range(args.lookups):
+        q, opts = REAL_QUESTIONS[i % len(REAL_QUESTIONS)]
+        kind = ("exact", "near", "miss")[i % 3]
+        if kind == "near":
+            q, opts = _variants(q, opts, rng)
+        elif kind == "miss":
+            q = f"unseen question number {i} about {q}"
+        t = time.perf_counter()
+        res = bot.mcq_cache_lookup("G", q, opts)
+        timings[kind].append((time.perf_counter() - t) * 1000.0)
+        hits[kind] += 1 if res else 0
+
+    for kind, vals in timings.items():
+        if not vals:
+            continue
+        print(
+            f"{kind:5s} n={len(vals):5d} hit={hits[kind]:5d} "
+            f"p50={statistics.median(vals):.3f}ms p95={_pct(vals, 0.95):.3f}ms p99={_pct(vals, 0.99):.3f}ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
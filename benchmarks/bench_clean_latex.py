@@ -0,0 +1,130 @@
+"""clean_latex: single-pass tokenizer vs. the staged implementation it replaced.
+
+Usage:
+    python benchmarks/bench_clean_latex.py --rounds 200 --fuzz 200000
+
+First a differential check: every corpus entry plus --fuzz random strings built from
+LaTeX fragments (nested braces, stray delimiters, half commands, ^/_ runs, CR/LF and
+odd whitespace) must give byte-identical output from both implementations. Then the
+long physics / chemistry explanations are timed with each (best of --rounds calls).
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+
+PHYSICS = r"""
+সঠিক উত্তর: (গ) 25 \text{m/s}
+
+ব্যাখ্যা:
+গতির সমীকরণ অনুযায়ী, $v^2 = u^2 + 2as$ যেখানে $u = 0$, $a = 9.8\,\text{m/s}^2$ এবং $s = 32\,\text{m}$।
+সুতরাং $v = \sqrt{2 \times 9.8 \times 32} \approx 25\,\mathrm{m\,s^{-1}}$।
+
+গতিশক্তি $E_k = \frac{1}{2}mv^2 = \frac{1}{2} \times 2 \times 25^2 = 625\,\text{J}$।
+বিভব শক্তির পরিবর্তন $\Delta U = mgh$, এবং শক্তির সংরক্ষণ থেকে $\Delta E_k + \Delta U = 0$।
+
+Why the others are wrong:
+(ক) 9.8 m/s — this is $g$, the acceleration, not the final speed; units are $\mathrm{m\,s^{-2}}$.
+(খ) 50 m/s — doubles the answer by forgetting the $\frac{1}{2}$ in $E_k = \frac{1}{2}mv^2$.
+(ঘ) 625 m/s — confuses energy in joules with speed.
+
+Extra: angular frequency $\omega = 2\pi f$, wavelength $\lambda = \frac{v}{f}$, and for a spring
+$T = 2\pi\sqrt{\frac{m}{k}}$ with $k = 200\,\text{N/m}$. Resistivity $\rho = R\frac{A}{L}$,
+$\sigma = \frac{1}{\rho}$, and $\mu_0 = 4\pi \times 10^{-7}\,\text{H/m}$; $\theta \leq 90^\circ$, $\alpha \neq \beta$.
+"""
+
+CHEMISTRY = r"""
+Correct answer: (b) 0.1 M
+
+Explanation:
+The reaction is $\text{H}_2\text{SO}_4 + 2\text{NaOH} \rightarrow \text{Na}_2\text{SO}_4 + 2\text{H}_2\text{O}$.
+Moles of NaOH $= 0.2 \times \frac{25}{1000} = 5 \times 10^{-3}$, so moles of acid $= 2.5 \times 10^{-3}$.
+Molarity $= \frac{2.5 \times 10^{-3}}{0.025} = 0.1\,\text{M}$.
+
+For the equilibrium $\text{N}_2 + 3\text{H}_2 \rightleftharpoons 2\text{NH}_3$, $K_c = \frac{[\text{NH}_3]^2}{[\text{N}_2][\text{H}_2]^3}$
+and $\Delta G = \Delta H - T\Delta S$; at equilibrium $\Delta G^\circ = -RT\ln K$.
+pH $= -\log[\text{H}^+]$; for $[\text{H}^+] = 10^{-3}$ the pH is 3. Ions: $\text{Fe}^{3+}$, $\text{SO}_4^{2-}$,
+$\text{Cu}^{2+} + 2e^- \rightarrow \text{Cu}$, $E^\circ = +0.34\,\text{V}$.
+
+কেন অন্যগুলো ভুল:
+(a) 0.2 M — NaOH এর ঘনমাত্রা, অ্যাসিডের নয়।
+(c) 0.05 M — $1:2$ অনুপাত দুবার ধরা হয়েছে।
+(d) 0.4 M — $\frac{1}{2}$ এর বদলে $\times 2$ করা হয়েছে।
+"""
+
+CORPUS = [
+    PHYSICS,
+    CHEMISTRY,
+    r"\(F = ma\) এবং \[W = Fs\cos\theta\]",
+    r"Speed $= \frac{d}{t}$, $\frac{\Delta v}{\Delta t}$, \left( \frac{a}{b} \right)",
+    r"x_{max} = A, v_\text{max} = A\omega, x^\frac{1}{2}",
+    r"\text{\mathrm{nested}} and \frac{\frac{1}{2}}{3} and \frac{1}{\text{s}}",
+    r"\left(x^2\right) and \(\mu\) and \\(escaped\\)",
+    "plain Bangla text: বাংলাদেশের রাজধানী ঢাকা।\r\n\r\n\r\n\r\nNo LaTeX here.   \t ",
+    "  leading and trailing  \n\n\n\n  blank lines  \n",
+    "",
+]
+
+FRAGMENTS = [
+    "\\", "\\text", "\\text{", "\\mathrm{", "\\operatorname{", "\\frac", "\\frac{", "frac", "frac{",
+    "{", "}", "}{", "}}", "{{", "^", "^{", "_", "_{", "$", "\\(", "\\)", "\\[", "\\]", "\\left", "\\right",
+    "\\alpha", "\\al", "pha", "\\le", "ft", "ri", "ght", "te", "xt", "ac", "\\pi", "\\times", "\\c", "dot",
+    "\\rightarrow", "\\leq", "\\Delta", "\\mu", "2", "x", "n", "i", "(", ")", "+", "-", "/", " ", "  ", "\t",
+    "\n", "\n\n\n", "\r\n", "\r", " ", "ব", "a", "e", "m", "q", "0", "1",
+]
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--fuzz", type=int, default=200000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = _load_bot(tmp)
+        new = bot.clean_latex
+        old = bot._prev_clean_latex_20261019s
+
+        failures = 0
+        rng = random.Random(args.seed)
+        fuzz = ("".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 30))) for _ in range(args.fuzz))
+        for i, text in enumerate(list(CORPUS) + list(fuzz)):
+            if new(text) != old(text):
+                failures += 1
+                if failures <= 10:
+                    print(f"MISMATCH #{i} {text[:60]!r}\n  old={old(text)[:80]!r}\n  new={new(text)[:80]!r}")
+        st = bot._CLEAN_LATEX_STATS
+        print(f"differential: {len(CORPUS) + args.fuzz - failures}/{len(CORPUS) + args.fuzz} identical "
+              f"({st['fast']} single-pass, {st['fallback']} handed to the staged path)")
+
+        for name, text in (("physics explanation", PHYSICS), ("chemistry explanation", CHEMISTRY), ("both x10", (PHYSICS + CHEMISTRY) * 10)):
+            timings = {}
+            for label, fn in (("staged", old), ("single-pass", new)):
+                best = float("inf")
+                for _ in range(args.rounds):
+                    t = time.perf_counter()
+                    fn(text)
+                    best = min(best, time.perf_counter() - t)
+                timings[label] = best * 1e6
+            speedup = timings["staged"] / max(timings["single-pass"], 1e-9)
+            print(f"{name:24s} {len(text):6d} chars  staged {timings['staged']:9.1f} us  single-pass {timings['single-pass']:9.1f} us  ({speedup:.1f}x)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""clean_common / parse_text_block cost with a large per-admin /filter set.
+
+Usage:
+    python benchmarks/bench_filter_clean.py --filters 60 --questions 100 --rounds 20
+
+Runs against a throwaway database in a temp directory. The paste mixes Bangla and
+English questions with the channel tags, watermarks and promo lines admins usually
+filter out. The cached engine is checked against the old per-phrase
+str.replace loop (one DB query per call) on every line before timing.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+ADMIN_ID = 4242
+ORDER_ID = 4343
+
+BASE_FILTERS = [
+    "@WhiteApronBD", "@MedicalAdmissionHub", "@DhakaVarsityPrep", "@Udvash_Official", "@RetinaMedical",
+    "Join our channel", "Join Telegram", "টেলিগ্রাম চ্যানেলে যুক্ত হও", "আমাদের চ্যানেলে জয়েন করুন",
+    "Source: Google", "সূত্র: বিগত সালের প্রশ্ন", "(DU 2019-20)", "(DU 2018-19)", "(RU 2017-18)",
+    "(CU 2021-22)", "(JU 2016-17)", "(Medical 2020-21)", "(Dental 2019-20)", "(BUET 2018-19)",
+    "(ঢাবি ১৯-২০)", "(রাবি ১৮-১৯)", "(চবি ২১-২২)", "(জাবি ১৭-১৮)", "(মেডিকেল ২০-২১)",
+    "Copyright ©", "All rights reserved", "কপিরাইট সংরক্ষিত", "Collected", "সংগৃহীত",
+    "Share with friends", "বন্ধুদের সাথে শেয়ার করো", "Follow for more", "আরো পেতে ফলো করো",
+    "www.udvash.com", "www.retinabd.org", "t.me/medprep", "fb.com/groups/admission",
+    "Daily Quiz", "ডেইলি কুইজ", "Model Test", "মডেল টেস্ট", "Mock Exam", "মক টেস্ট",
+    "Important!", "গুরুত্বপূর্ণ!", "Must read", "অবশ্যই পড়বে", "Repeated Question", "বারবার আসা প্রশ্ন",
+    "#admission", "#medical", "#varsity", "#ভর্তি", "#মেডিকেল", "★★★", "✅✅", "🔥🔥",
+]
+
+QUESTIONS = [
+    ("বাংলাদেশের রাজধানী কোনটি?", ["চট্টগ্রাম", "ঢাকা", "খুলনা", "সিলেট"]),
+    ("What is the SI unit of force?", ["Joule", "Newton", "Watt", "Pascal"]),
+    ("২৫ এর বর্গমূল কত?", ["৩", "৪", "৫", "৬"]),
+    ("Which organelle is called the powerhouse of the cell?", ["Nucleus", "Ribosome", "Mitochondria", "Golgi body"]),
+    ("H2O অণুতে কয়টি হাইড্রোজেন পরমাণু আছে?", ["১", "২", "৩", "৪"]),
+    ("কোন ভিটামিনের অভাবে রাতকানা রোগ হয়?", ["ভিটামিন A", "ভিটামিন B", "ভিটামিন C", "ভিটামিন D"]),
+    ("The chemical symbol of sodium is", ["S", "So", "Na", "Sd"]),
+    ("মানবদেহের দীর্ঘতম অস্থি কোনটি?", ["হিউমেরাস", "ফিমার", "টিবিয়া", "রেডিয়াস"]),
+]
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _filters(n: int):
+    out = list(BASE_FILTERS)
+    i = 0
+    while len(out) < n:
+        i += 1
+        out.append(f"@prep_channel_{i}")
+    return out[:n]
+
+
+def _paste(filters, questions: int, rng: random.Random) -> str:
+    blocks = []
+    for i in range(1, questions + 1):
+        q, opts = QUESTIONS[i % len(QUESTIONS)]
+        serial = str(i) if rng.random() < 0.5 else str(i).translate(str.maketrans("0123456789", "০১২৩৪৫৬৭৮৯"))
+        tag = rng.choice(filters)
+        lines = [f"{serial}. [{rng.choice(['White Apron', 'Udvash', 'Retina'])}] {q} {tag}"]
+        answer = rng.randrange(len(opts))
+        for j, opt in enumerate(opts):
+            mark = "*" if j == answer else ""
+            noise = f" {rng.choice(filters)}" if rng.random() < 0.2 else ""
+            lines.append(f"{'abcd'[j]}) {opt}{noise}{mark}")
+        if rng.random() < 0.5:
+            lines.append(f"Explanation: {rng.choice(filters)} {q} এর উত্তর {opts[answer]}।")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def _legacy_clean_common(bot, text: str, user_id: int) -> str:
+    """clean_common before the filter cache: DB query + one str.replace per phrase."""
+    if not text:
+        return ""
+    conn = bot.db_connect()
+    cur = conn.cursor()
+    cur.execute("SELECT phrase FROM filters WHERE user_id=?", (user_id,))
+    phrases = [r["phrase"] for r in cur.fetchall()]
+    conn.close()
+    for phrase in phrases:
+        if phrase:
+            text = text.replace(phrase, "")
+    text = bot.BRACKET_ANY_RE.sub("", text)
+    text = bot._strip_leading_serials(text)
+    text = re.sub(r"[ \t]+", " ", text).strip()
+    return text
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--filters", type=int, default=60)
+    ap.add_argument("--questions", type=int, default=100)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = _load_bot(tmp)
+        bot.db_init()
+        filters = _filters(args.filters)
+        conn = bot.db_connect()
+        conn.executemany(
+            "INSERT OR IGNORE INTO filters(user_id, phrase, created_at) VALUES (?,?,?)",
+            [(ADMIN_ID, p, bot.now_iso()) for p in filters],
+        )
+        conn.commit()
+        conn.close()
+        bot.invalidate_user_filters(ADMIN_ID)
+
+        paste = _paste(filters, args.questions, random.Random(11))
+        lines = [ln for ln in paste.splitlines() if ln.strip()]
+        blocks = [b for b in paste.split("\n\n") if b.strip()]
+        print(f"{len(filters)} filters, {len(blocks)} questions, {len(lines)} lines")
+
+        mismatches = 0
+        for ln in lines:
+            old = _legacy_clean_common(bot, ln, ADMIN_ID)
+            new = bot.clean_common(ln, ADMIN_ID)
+            if old != new:
+                mismatches += 1
+                print(f"MISMATCH {ln[:50]!r}\n  old={old!r}\n  new={new!r}")
+        print(f"lines: {len(lines) - mismatches}/{len(lines)} identical to the str.replace loop")
+
+        # Removing one phrase can join its neighbours into another; order matters.
+        for uid, phrases, text in ((ORDER_ID, ["c", "ab"], "acb"), (ORDER_ID + 1, ["ab", "c"], "acb")):
+            conn = bot.db_connect()
+            conn.executemany(
+                "INSERT OR IGNORE INTO filters(user_id, phrase, created_at) VALUES (?,?,?)",
+                [(uid, p, bot.now_iso()) for p in phrases],
+            )
+            conn.commit()
+            conn.close()
+            bot.invalidate_user_filters(uid)
+            old, new = _legacy_clean_common(bot, text, uid), bot.clean_common(text, uid)
+            if old != new:
+                mismatches += 1
+                print(f"MISMATCH filters {phrases} on {text!r}: old={old!r} new={new!r}")
+
+        def _time(fn):
+            t = time.perf_counter()
+            for _ in range(args.rounds):
+                fn()
+            return (time.perf_counter() - t) / args.rounds * 1e3
+
+        legacy_ms = _time(lambda: [_legacy_clean_common(bot, ln, ADMIN_ID) for ln in lines])
+        cached_ms = _time(lambda: [bot.clean_common(ln, ADMIN_ID) for ln in lines])
+        parse_ms = _time(lambda: [bot.parse_text_block(b, ADMIN_ID) for b in blocks])
+        print(f"{'clean_common, DB + replace loop':34s} {legacy_ms:8.2f} ms/paste")
+        print(f"{'clean_common, cached check + loop':34s} {cached_ms:8.2f} ms/paste  ({legacy_ms / max(cached_ms, 1e-9):.1f}x)")
+        print(f"{'parse_text_block, whole paste':34s} {parse_ms:8.2f} ms/paste")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Correctness + speed of the local lenient JSON repair on model-output samples.
+
+Usage:
+    python benchmarks/bench_json_repair.py [--rounds 2000]
+
+Every corpus entry is a malformation we have seen from Gemini/Perplexity replies.
+Exits non-zero if any entry no longer parses to the expected value, so it
+doubles as a regression check after parser changes.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+
+MCQ = {"answer": 2, "confidence": 90, "explanation": "ঢাকা রাজধানী।", "why_not": {"A": "না"}}
+
+CORPUS = [
+    ("valid", '{"answer":2,"confidence":90,"explanation":"ঢাকা রাজধানী।","why_not":{"A":"না"}}', MCQ),
+    ("code fence", '```json\n{"answer":2,"confidence":90,"explanation":"ঢাকা রাজধানী।","why_not":{"A":"না"}}\n```', MCQ),
+    ("prose around", 'Sure! Here is the JSON:\n{"answer":2,"confidence":90,"explanation":"ঢাকা রাজধানী।","why_not":{"A":"না"}}\nHope this helps.', MCQ),
+    ("trailing commas", '{"answer":2,"confidence":90,"explanation":"ঢাকা রাজধানী।","why_not":{"A":"না",},}', MCQ),
+    ("smart quotes", '{“answer”: 2, “confidence”: 90, “explanation”: “ঢাকা রাজধানী।”, “why_not”: {“A”: “না”}}', MCQ),
+    ("single quotes", "{'answer': 2, 'confidence': 90, 'explanation': 'ঢাকা রাজধানী।', 'why_not': {'A': 'না'}}", MCQ),
+    ("unquoted keys", '{answer: 2, confidence: 90, explanation: "ঢাকা রাজধানী।", why_not: {A: "না"}}', MCQ),
+    ("python literals", "{'ok': True, 'items': None, 'flag': False}", {"ok": True, "items": None, "flag": False}),
+    ("missing commas", '{"answer": 2\n"confidence": 90\n"explanation": "ঢাকা রাজধানী।"\n"why_not": {"A": "না"}}', MCQ),
+    ("comments", '{\n  // chosen option\n  "answer": 2, /* sure */ "confidence": 90,\n  "explanation": "ঢাকা রাজধানী।", "why_not": {"A": "না"}\n}', MCQ),
+    ("raw newline in string", '{"answer": 1, "explanation": "line one\nline two"}', {"answer": 1, "explanation": "line one\nline two"}),
+    ("inner quotes", '{"answer": 3, "explanation": "The word "photosynthesis" means light"}', {"answer": 3, "explanation": 'The word "photosynthesis" means light'}),
+    ("latex escapes", r'{"answer": 1, "explanation": "Use \(x^2\) here"}', {"answer": 1, "explanation": r"Use \(x^2\) here"}),
+    ("apostrophe in single quotes", "{'explanation': 'it's the answer', 'answer': 4}", {"explanation": "it's the answer", "answer": 4}),
+    ("letter answer", '{"answer": B, "confidence": 70}', {"answer": "B", "confidence": 70}),
+    (
+        "truncated items array",
+        '{"items": [{"questions": "Q1", "option1": "a", "answer": 1}, {"questions": "Q2", "option1": "b", "ans',
+        {"items": [{"questions": "Q1", "option1": "a", "answer": 1}]},
+    ),
+    ("truncated string", '{"answer": 2, "confidence": 80, "explanation": "ঢাকা হলো বাংলাদেশ', {"answer": 2, "confidence": 80, "explanation": "ঢাকা হলো বাংলাদেশ"}),
+    ("truncated after key", '{"answer": 2, "confidence": 80, "explanation":', {"answer": 2, "confidence": 80}),
+    ("truncated number", '{"answer": 2, "confidence": 8', {"answer": 2}),
+    ("truncated bare word", '{"answer": 2, "ok": tru', {"answer": 2}),
+    ("truncated number in array", '[{"serial":1,"answer":2},{"serial":2,"answer":4', [{"serial": 1, "answer": 2}]),
+    ("truncated array of numbers", '{"answer": 2, "scores": [90, 8', {"answer": 2, "scores": [90]}),
+    ("top-level array", '[{"serial":1,"answer":2},{"serial":2,"answer":4},]', [{"serial": 1, "answer": 2}, {"serial": 2, "answer": 4}]),
+    ("fenced array", '```json\n[{"serial":1,"answer":2}]\n```', [{"serial": 1, "answer": 2}]),
+    (
+        "citations before object",
+        'According to sources [1][2], here is the result:\n{"answer":2,"confidence":90,"explanation":"ঢাকা রাজধানী।","why_not":{"A":"না"}}',
+        MCQ,
+    ),
+    ("brace in prose", 'Using {x} as the unknown:\n{"answer": 2, "confidence": 90}', {"answer": 2, "confidence": 90}),
+    ("unclosed fence", '```json\n{"answer": 2, "confidence": 90}', {"answer": 2, "confidence": 90}),
+]
+
+NOT_JSON = [
+    "The correct answer is B because Dhaka is the capital.",
+    "",
+]
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+
+    bot = _load_bot(tempfile.mkdtemp(prefix="bench_json_"))
+    failures = 0
+    for name, raw, expected in CORPUS:
+        try:
+            got = bot._lenient_json_loads(raw)
+        except Exception as e:
+            got = f"<error {e}>"
+        if got != expected:
+            failures += 1
+            print(f"FAIL {name}: {got!r}")
+    for raw in NOT_JSON:
+        try:
+            got = bot._lenient_json_loads(raw)
+            failures += 1
+            print(f"FAIL not-json accepted: {raw[:40]!r} -> {got!r}")
+        except ValueError:
+            pass
+    print(f"corpus: {len(CORPUS) - failures}/{len(CORPUS)} repaired as expected")
+
+    for name, raw, _expected in CORPUS:
+        t = time.perf_counter()
+        for _ in range(args.rounds):
+            bot._lenient_json_loads(raw)
+        us = (time.perf_counter() - t) / args.rounds * 1e6
+        print(f"{name:28s} {us:8.1f} us/parse")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Quiz text paste → buffer payloads: golden corpus check and questions/sec.
+
+Usage:
+    python benchmarks/bench_parse_text.py --copies 50 --rounds 5
+    python benchmarks/bench_parse_text.py --update   # rewrite the golden .json files
+
+benchmarks/golden/quiz_text/ holds admin pastes (NN_name.txt) and the payloads the
+parser must produce for each (NN_name.json), parsed as an admin whose /filter list is
+filters.txt. Every paste is also run through the pre-compilation parser kept below,
+then the whole corpus is repeated --copies times and timed with both.
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+GOLDEN_DIR = os.path.join(ROOT, "benchmarks", "golden", "quiz_text")
+ADMIN_ID = 4242
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class LegacyParser:
+    """split_blocks / parse_text_block as they were before the compiled parser."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def clean_common(self, text, user_id):
+        bot = self.bot
+        if not text:
+            return ""
+        pattern = bot.user_filter_pattern(user_id)
+        if pattern is not None:
+            text = pattern.sub("", text)
+        text = bot.BRACKET_ANY_RE.sub("", text)
+        text = bot._strip_leading_serials(text)
+        text = re.sub(r"[ \t]+", " ", text).strip()
+        return text
+
+    def clean_explanation(self, text, user_id):
+        bot = self.bot
+        if not text:
+            return ""
+        text = self.clean_common(text, user_id)
+        text = re.sub(r"^\s*(Explanation\s*(for\s*question\s*\d+)?|Explain)\s*[:\-]*\s*", "", text, flags=re.IGNORECASE)
+        text = bot.MD_LINK_RE.sub("", text)
+        text = bot.BRACKET_ANY_RE.sub("", text)
+        text = bot.URL_RE.sub("", text)
+        text = re.sub(r"[ \t]+", " ", text)
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip()
+
+    def split_inline_explain(self, text):
+        t = (text or "").strip()
+        if not t:
+            return "", ""
+        m = self.bot.INLINE_EXPL_RE.match(t)
+        if not m:
+            return t, ""
+        q = (m.group(1) or "").strip()
+        e = (m.group(2) or "").strip()
+        q = re.sub(r"\s*[:;\-–—]+\s*$", "", q).strip()
+        return q, e
+
+    def clean_option_text(self, line):
+        line = re.sub(r"^\s*[\(\[]?[a-zA-Z0-9ঀ-৿]+[\)\]\.]+\s+", "", line)
+        return line.strip()
+
+    def split_blocks(self, text):
+        if not text:
+            return []
+        text = text.replace("\r\n", "\n")
+        parts = re.split(r"\n\s*\n+|\n\s*n\s*\n", text, flags=re.IGNORECASE)
+        return [p.strip() for p in parts if p and p.strip()]
+
+    def parse_text_block(self, block, user_id):
+        clean_common = self.clean_common
+        lines = [ln.strip() for ln in block.split("\n") if ln.strip()]
+        if not lines:
+            return None
+        expl_idx = -1
+        for i, ln in enumerate(lines):
+            if re.match(r"^(Explanation|Note|ব্যাখ্যা)[:\-]", ln, re.IGNORECASE):
+                expl_idx = i
+                break
+        explanation = ""
+        if expl_idx != -1:
+            raw_expl = "\n".join(lines[expl_idx:])
+            raw_expl = re.sub(r"^(Explanation|Note|ব্যাখ্যা)[:\-]\s*", "", raw_expl, flags=re.IGNORECASE).strip()
+            explanation = self.clean_explanation(raw_expl, user_id)
+            lines = lines[:expl_idx]
+        if not lines:
+            return None
+        question_parts = []
+        options = []
+        correct_answer = 0
+        q0 = clean_common(lines[0], user_id)
+        if q0:
+            question_parts.append(q0)
+        for ln in lines[1:]:
+            ln = clean_common(ln, user_id)
+            if not ln:
+                continue
+            if self.bot.OPT_LINE_RE.match(ln):
+                is_correct = False
+                if ln.endswith("*"):
+                    is_correct = True
+                    ln = ln[:-1].strip()
+                opt = self.clean_option_text(ln)
+                options.append(opt)
+                if is_correct:
+                    correct_answer = len(options)
+            else:
+                question_parts.append(ln)
+        final_question = " ".join([p for p in question_parts if p]).strip()
+        final_question = clean_common(final_question, user_id)
+        q2, expl2 = self.split_inline_explain(final_question)
+        if expl2:
+            final_question = q2.strip()
+            cleaned = self.clean_explanation(expl2, user_id)
+            if cleaned:
+                explanation = (explanation + "\n" + cleaned).strip() if explanation else cleaned
+        if not final_question:
+            return None
+        opts = options + [""] * (5 - len(options))
+        return {
+            "questions": final_question,
+            "option1": opts[0], "option2": opts[1], "option3": opts[2],
+            "option4": opts[3], "option5": opts[4],
+            "answer": int(correct_answer) if correct_answer else 0,
+            "explanation": explanation,
+            "type": 1, "section": 1,
+        }
+
+
+def _parse_all(parser, text: str):
+    return [p for p in (parser.parse_text_block(b, ADMIN_ID) for b in parser.split_blocks(text)) if p]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--copies", type=int, default=50, help="times the corpus is repeated for timing")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--update", action="store_true", help="rewrite the golden .json files from the current parser")
+    args = ap.parse_args()
+
+    pastes = {}
+    for path in sorted(glob.glob(os.path.join(GOLDEN_DIR, "*.txt"))):
+        if os.path.basename(path) != "filters.txt":
+            with open(path, encoding="utf-8", newline="") as f:
+                pastes[path[:-4]] = f.read()
+    with open(os.path.join(GOLDEN_DIR, "filters.txt"), encoding="utf-8") as f:
+        filters = [ln.strip() for ln in f if ln.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = _load_bot(tmp)
+        bot.db_init()
+        conn = bot.db_connect()
+        conn.executemany(
+            "INSERT OR IGNORE INTO filters(user_id, phrase, created_at) VALUES (?,?,?)",
+            [(ADMIN_ID, p, bot.now_iso()) for p in filters],
+        )
+        conn.commit()
+        conn.close()
+        bot.invalidate_user_filters(ADMIN_ID)
+        legacy = LegacyParser(bot)
+
+        failures = 0
+        for base, text in pastes.items():
+            got = _parse_all(bot, text)
+            name = os.path.basename(base)
+            if args.update:
+                with open(base + ".json", "w", encoding="utf-8") as f:
+                    json.dump(got, f, ensure_ascii=False, indent=2)
+                    f.write("\n")
+                print(f"wrote {name}.json ({len(got)} payloads)")
+                continue
+            with open(base + ".json", encoding="utf-8") as f:
+                want = json.load(f)
+            old = _parse_all(legacy, text)
+            status = "ok"
+            if got != want:
+                status = "GOLDEN MISMATCH"
+            elif got != old:
+                status = "LEGACY MISMATCH"
+            if status != "ok":
+                failures += 1
+                for i, (g, w) in enumerate(zip(got, want if got != want else old)):
+                    if g != w:
+                        print(f"  first difference in payload {i}:\n    expected={w!r}\n    got     ={g!r}")
+                        break
+            print(f"{name:28s} {len(got):3d} payloads  {status}")
+        if args.update:
+            return 0
+
+        big = "\n\n".join(list(pastes.values()) * args.copies)
+        questions = len(_parse_all(bot, big))
+        rates = {}
+        for label, parser in (("legacy", legacy), ("compiled", bot)):
+            best = float("inf")
+            for _ in range(args.rounds):
+                t = time.perf_counter()
+                _parse_all(parser, big)
+                best = min(best, time.perf_counter() - t)
+            rates[label] = questions / max(best, 1e-9)
+            print(f"{label:10s} {questions} questions in {best * 1e3:8.2f} ms  ({rates[label]:10.0f} questions/s)")
+        print(f"speedup: {rates['compiled'] / max(rates['legacy'], 1e-9):.2f}x")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""Local stand-in for the AI backends the solvers call, for offline benchmarks.
+
+Usage:
+    python benchmarks/fake_ai_backend.py --port 8090 --latency lognormal:900:0.5 --quota 0.1
+    python benchmarks/fake_ai_backend.py --port 8090 --script outage.json --record ai_calls.jsonl
+    GEMINI_API_BASE_URL=http://127.0.0.1:8090 GEMINI_WEB_BASE_URL=http://127.0.0.1:8090 \\
+        PERPLEXITY_API_URL=http://127.0.0.1:8090/api/ask python Probaho_replytext_memory_on.py
+
+Endpoints (names in brackets are the profile names):
+- GET  /v1beta/models?key=K                          ListModels [models]
+- POST /v1beta/models/<model>:generateContent?key=K  generateContent, text or JSON mode [generate]
+- GET  /api/ask?prompt=...                            Perplexity proxy [perplexity]
+- GET  /app                                           Gemini web page with session tokens [web_page]
+- POST /_/BardChatUi/.../StreamGenerate               Gemini web answer as wrb.fr frames [web_stream]
+
+Every request is served according to a profile. A profile is a dict:
+- latency: "fixed:MS", "uniform:LO:HI", "normal:MEAN:SD" or "lognormal:MEDIAN_MS:SIGMA".
+- quota / forbidden / server_error / malformed / truncate / hang: the probability of
+  answering with a 429 RESOURCE_EXHAUSTED body, a 403 quota/billing body, a 503,
+  a 200 with broken JSON, a body cut off mid-transfer, or no answer for hang_s seconds.
+- status: always answer with this HTTP status (404 = model not found).
+- chunks / chunk_ms: how many frames StreamGenerate sends, and the delay between them.
+
+A --script JSON file layers profiles: "default", then one per endpoint name, then
+"keys" (per API key), then "models" (per model name). "phases" is a list of
+{"start": s, "end": s, ...same keys} that apply only during that window. The window
+is measured from start() or reset_stats(). Example, where key 1 is exhausted and all
+of generateContent goes down between 10 s and 40 s:
+
+    {"seed": 3, "generate": {"latency": "lognormal:700:0.4"},
+     "keys": {"KEY1": {"quota": 1}}, "models": {"gemini-2.5-pro": {"status": 404}},
+     "phases": [{"start": 10, "end": 40, "generate": {"server_error": 1}}]}
+
+Outcomes are drawn from one seeded RNG, so a run with the same script and request
+order fails the same way. stats() returns counts per endpoint, outcome and key.
+"""
+import argparse
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+ENDPOINTS = ("generate", "models", "perplexity", "web_page", "web_stream")
+FAILURES = ("quota", "forbidden", "server_error", "malformed", "truncate", "hang")
+PROFILE_DEFAULTS: Dict[str, Any] = {
+    "latency": "", "quota": 0.0, "forbidden": 0.0, "server_error": 0.0, "malformed": 0.0,
+    "truncate": 0.0, "hang": 0.0, "hang_s": 30.0, "status": 0, "chunks": 4, "chunk_ms": 0.0,
+}
+DEFAULT_MODEL_NAMES = [
+    "gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-pro", "gemini-1.5-flash", "gemini-2.0-flash-lite",
+]
+STREAM_PATH = "/_/BardChatUi/data/assistant.lamda.BardFrontendService/StreamGenerate"
+
+QUOTA_BODY = {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}}
+FORBIDDEN_BODY = {"error": {
+    "code": 403, "status": "PERMISSION_DENIED",
+    "message": "Quota exceeded for quota metric 'Generate Content API requests per minute'; billing is not enabled for this project.",
+}}
+UNAVAILABLE_BODY = {"error": {"code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE"}}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Latency spec -> sampler returning milliseconds."""
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, rest = spec.partition(":")
+    args = [float(x) for x in rest.split(":") if x]
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: args[0]
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "normal" and len(args) == 2:
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal" and len(args) == 2:
+        mu = math.log(max(args[0], 1e-3))
+        return lambda rng: rng.lognormvariate(mu, args[1])
+    raise ValueError(f"bad latency spec {spec!r} (fixed:MS, uniform:LO:HI, normal:MEAN:SD, lognormal:MEDIAN_MS:SIGMA)")
+
+
+def _prompt_answer(prompt: str, json_mode: bool) -> str:
+    """Deterministic answer: the same prompt always gets the same option."""
+    answer = 1 + zlib.crc32(prompt.encode("utf-8")) % 4
+    if json_mode:
+        return json.dumps({
+            "answer": answer, "confidence": 80,
+            "explanation": f"Stub explanation for option {answer}.\nStep 1.\nStep 2.",
+            "why_not": {},
+        })
+    return f"Stub answer ({answer}).\nStep 1: read the question.\nStep 2: the result follows."
+
+
+def _key_label(key: str) -> str:
+    return f"…{key[-6:]}" if key else "-"
+
+
+def _web_prompt(form: Dict[str, str]) -> Tuple[str, str]:
+    """(prompt, token) from a StreamGenerate f.req body; ("", "") when it does not parse."""
+    try:
+        inner = json.loads(json.loads(form.get("f.req", ""))[1])
+        prompt = inner[0][0].replace("\\n", "\n").replace('\\"', '"').replace("\\\\", "\\")
+        return prompt, str(inner[3] or "")
+    except (TypeError, ValueError, IndexError):
+        return "", ""
+
+
+def _wrb_frame(text: str) -> str:
+    inner = [None, ["c_stub", "r_stub"], None, None, [["rc_stub", [text]]]]
+    return json.dumps([["wrb.fr", None, json.dumps(inner)]])
+
+
+class FakeAiBackend:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, script: Optional[Dict[str, Any]] = None,
+                 record: str = "", seed: Optional[int] = None):
+        self.script: Dict[str, Any] = dict(script or {})
+        self.model_names: List[str] = list(self.script.get("model_names") or DEFAULT_MODEL_NAMES)
+        self._rng = random.Random(self.script.get("seed", 1) if seed is None else seed)
+        self._lock = threading.Lock()
+        self._samplers: Dict[str, Callable[[random.Random], float]] = {}
+        self._record_file = open(record, "a", encoding="utf-8") if record else None
+        self._t0 = time.monotonic()
+        self._tokens = 0
+        self.calls: Dict[str, int] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self.keys: Dict[str, Dict[str, int]] = {}
+        self.server_ms: Dict[str, List[float]] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment that points the bot at this server."""
+        return {
+            "GEMINI_API_BASE_URL": self.base_url,
+            "GEMINI_WEB_BASE_URL": self.base_url,
+            "PERPLEXITY_API_URL": f"{self.base_url}/api/ask",
+        }
+
+    def start(self) -> str:
+        self._t0 = time.monotonic()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ai-backend", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._record_file:
+            self._record_file.close()
+
+    def reset_stats(self) -> None:
+        """Clear counters and restart the phase clock."""
+        with self._lock:
+            self.calls.clear()
+            self.outcomes.clear()
+            self.keys.clear()
+            self.server_ms.clear()
+            self._t0 = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            mean_ms = {ep: round(sum(v) / len(v), 3) for ep, v in sorted(self.server_ms.items()) if v}
+            return {
+                "calls": dict(sorted(self.calls.items())),
+                "outcomes": {ep: dict(sorted(v.items())) for ep, v in sorted(self.outcomes.items())},
+                "keys": {k: dict(sorted(v.items())) for k, v in sorted(self.keys.items())},
+                "total_calls": sum(self.calls.values()),
+                "mean_server_ms": mean_ms,
+            }
+
+    # ---- profiles --------------------------------------------------------
+
+    def configure(self, **layers: Any) -> None:
+        """Replace top-level script entries while running, e.g. configure(generate={"quota": 1})."""
+        with self._lock:
+            self.script.update(layers)
+            if "model_names" in layers:
+                self.model_names = list(layers["model_names"] or DEFAULT_MODEL_NAMES)
+
+    def load(self, script: Dict[str, Any]) -> None:
+        """Swap in a whole new script, reseed from its "seed" and clear the stats."""
+        with self._lock:
+            self.script = dict(script)
+            self.model_names = list(self.script.get("model_names") or DEFAULT_MODEL_NAMES)
+            self._rng.seed(self.script.get("seed", 1))
+        self.reset_stats()
+
+    def profile(self, endpoint: str, key: str = "", model: str = "") -> Dict[str, Any]:
+        """Merged profile for one request (defaults < default < endpoint < key < model, phases on top)."""
+        layers = [self.script]
+        now = time.monotonic() - self._t0
+        layers += [ph for ph in self.script.get("phases") or [] if float(ph.get("start", 0)) <= now < float(ph.get("end", math.inf))]
+        prof = dict(PROFILE_DEFAULTS)
+        for layer in layers:
+            prof.update(layer.get("default") or {})
+            prof.update(layer.get(endpoint) or {})
+        for layer in layers:
+            if key:
+                prof.update((layer.get("keys") or {}).get(key) or {})
+            if model:
+                prof.update((layer.get("models") or {}).get(model) or {})
+        return prof
+
+    def _draw(self, prof: Dict[str, Any]) -> Tuple[str, float]:
+        """(outcome, latency_ms) for one request."""
+        spec = str(prof.get("latency") or "")
+        with self._lock:
+            sampler = self._samplers.get(spec)
+            if sampler is None:
+                sampler = self._samplers[spec] = parse_latency(spec)
+            latency = sampler(self._rng)
+            if prof.get("status"):
+                return "status", latency
+            r = self._rng.random()
+        acc = 0.0
+        for outcome in FAILURES:
+            acc += float(prof.get(outcome) or 0.0)
+            if r < acc:
+                return outcome, latency
+        return "ok", latency
+
+    def _note(self, endpoint: str, outcome: str, key: str, model: str, started: float, status: int) -> None:
+        elapsed = (time.perf_counter() - started) * 1000.0
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            per = self.outcomes.setdefault(endpoint, {})
+            per[outcome] = per.get(outcome, 0) + 1
+            if key:
+                per_key = self.keys.setdefault(_key_label(key), {})
+                per_key[outcome] = per_key.get(outcome, 0) + 1
+            self.server_ms.setdefault(endpoint, []).append(elapsed)
+            if self._record_file:
+                self._record_file.write(json.dumps({
+                    "ts": round(time.time(), 6), "endpoint": endpoint, "model": model, "key": _key_label(key) if key else "",
+                    "outcome": outcome, "status": status, "server_ms": round(elapsed, 3),
+                }, ensure_ascii=False) + "\n")
+                self._record_file.flush()
+
+    def _new_token(self) -> str:
+        with self._lock:
+            self._tokens += 1
+            return f"stub-at-{self._tokens:08d}-{'x' * 24}"
+
+    # ---- request handling ------------------------------------------------
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):  # keep benchmark output readable
+                pass
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _send(self, status: int, raw: bytes, ctype: str = "application/json; charset=UTF-8",
+                      headers: Optional[Dict[str, str]] = None) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _json(self, status: int, body: Any) -> None:
+                self._send(status, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+            def _cut(self, status: int, raw: bytes, ctype: str = "application/json; charset=UTF-8") -> None:
+                """Announce the full body, send half of it, then drop the connection."""
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw[: len(raw) // 2])
+                self._drop()
+
+            def _drop(self) -> None:
+                self.close_connection = True
+                try:
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+            def _failure(self, outcome: str, prof: Dict[str, Any]) -> bool:
+                """Answer with the drawn failure; False when the request should be served normally."""
+                if outcome == "hang":
+                    time.sleep(float(prof.get("hang_s") or 30.0))
+                    self._drop()
+                elif outcome == "status":
+                    code = int(prof["status"])
+                    self._json(code, {"error": {"code": code, "message": "models/stub is not found for API version v1beta.", "status": "NOT_FOUND" if code == 404 else "FAILED_PRECONDITION"}})
+                elif outcome == "quota":
+                    self._json(429, QUOTA_BODY)
+                elif outcome == "forbidden":
+                    self._json(403, FORBIDDEN_BODY)
+                elif outcome == "server_error":
+                    self._json(503, UNAVAILABLE_BODY)
+                else:
+                    return False
+                return True
+
+            def _serve(self, endpoint: str, key: str = "", model: str = "") -> Tuple[str, Dict[str, Any]]:
+                prof = api.profile(endpoint, key, model)
+                outcome, latency = api._draw(prof)
+                if latency:
+                    time.sleep(latency / 1000.0)
+                return outcome, prof
+
+            def _generate(self, model: str, key: str) -> Tuple[str, int]:
+                try:
+                    payload = json.loads(self._body() or b"{}")
+                except ValueError:
+                    self._json(400, {"error": {"code": 400, "message": "Invalid JSON payload received.", "status": "INVALID_ARGUMENT"}})
+                    return "bad_request", 400
+                outcome, prof = self._serve("generate", key, model)
+                if self._failure(outcome, prof):
+                    return outcome, self._status_of(outcome, prof)
+                prompt = "\n".join(
+                    str(part.get("text") or "")
+                    for content in payload.get("contents") or [] for part in content.get("parts") or [] if isinstance(part, dict)
+                )
+                json_mode = (payload.get("generationConfig") or {}).get("responseMimeType") == "application/json"
+                body = {
+                    "candidates": [{"content": {"parts": [{"text": _prompt_answer(prompt, json_mode)}], "role": "model"},
+                                    "finishReason": "STOP", "index": 0}],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": 40},
+                    "modelVersion": model,
+                }
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                if outcome == "malformed":
+                    self._send(200, raw[: len(raw) * 2 // 3])
+                elif outcome == "truncate":
+                    self._cut(200, raw)
+                else:
+                    self._send(200, raw)
+                return outcome, 200
+
+            def _models(self, key: str) -> Tuple[str, int]:
+                outcome, prof = self._serve("models", key)
+                if self._failure(outcome, prof):
+                    return outcome, self._status_of(outcome, prof)
+                raw = json.dumps({"models": [
+                    {"name": f"models/{m}", "displayName": m, "supportedGenerationMethods": ["generateContent", "countTokens"]}
+                    for m in api.model_names
+                ] + [{"name": "models/text-embedding-004", "supportedGenerationMethods": ["embedContent"]}]}).encode("utf-8")
+                if outcome == "malformed":
+                    self._send(200, raw[: len(raw) // 2])
+                elif outcome == "truncate":
+                    self._cut(200, raw)
+                else:
+                    self._send(200, raw)
+                return outcome, 200
+
+            def _perplexity(self, prompt: str) -> Tuple[str, int]:
+                outcome, prof = self._serve("perplexity")
+                if self._failure(outcome, prof):
+                    return outcome, self._status_of(outcome, prof)
+                raw = json.dumps({"status": "success", "answer": _prompt_answer(prompt, "JSON" in prompt)}, ensure_ascii=False).encode("utf-8")
+                if outcome == "malformed":
+                    self._send(200, b"<html><body>upstream error</body></html>", "text/html")
+                elif outcome == "truncate":
+                    self._cut(200, raw)
+                else:
+                    self._send(200, raw)
+                return outcome, 200
+
+            def _web_page(self) -> Tuple[str, int]:
+                outcome, prof = self._serve("web_page")
+                if self._failure(outcome, prof):
+                    return outcome, self._status_of(outcome, prof)
+                token = api._new_token() if outcome != "malformed" else ""
+                html = (
+                    "<!doctype html><html><head><script>window.WIZ_global_data = {"
+                    f'"SNlM0e":"{token}","cfb2h":"boq_assistant-bard-web-server_stub","FdrFJe":"-4242",'
+                    f'"bl":"boq_assistant-bard-web-server_stub","f.sid":"-4242"'
+                    "};</script></head><body>stub</body></html>"
+                ).encode("utf-8")
+                if outcome == "truncate":
+                    self._cut(200, html, "text/html; charset=utf-8")
+                else:
+                    self._send(200, html, "text/html; charset=utf-8", {"Set-Cookie": "NID=stub; Path=/"})
+                return outcome, 200
+
+            def _web_stream(self) -> Tuple[str, int]:
+                prompt, token = _web_prompt(dict(parse_qsl(self._body().decode("utf-8"), keep_blank_values=True)))
+                if not token.startswith("stub-at-"):
+                    self._json(400, {"error": "missing or unknown at token"})
+                    return "bad_request", 400
+                outcome, prof = self._serve("web_stream")
+                if self._failure(outcome, prof):
+                    return outcome, self._status_of(outcome, prof)
+                answer = _prompt_answer(prompt, "JSON" in prompt)
+                chunks = max(1, int(prof.get("chunks") or 1))
+                step = max(1, math.ceil(len(answer) / chunks))
+                frames = [_wrb_frame(answer[: i + step]) for i in range(0, len(answer), step)]
+                if outcome == "malformed":
+                    frames = ['[["wrb.fr",null,"[null,{broken"]]' for _ in frames]
+                frames.append('[["e",4,null,null,1234]]')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                cut_at = len(frames) // 2 if outcome == "truncate" else len(frames)
+                try:
+                    self._chunk(")]}'\n\n")
+                    for i, frame in enumerate(frames[:cut_at]):
+                        if i and prof.get("chunk_ms"):
+                            time.sleep(float(prof["chunk_ms"]) / 1000.0)
+                        self._chunk(f"{len(frame)}\n{frame}\n")
+                    if outcome == "truncate":
+                        self._drop()
+                    else:
+                        self.wfile.write(b"0\r\n\r\n")
+                except OSError:
+                    pass
+                return outcome, 200
+
+            def _chunk(self, text: str) -> None:
+                raw = text.encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+                self.wfile.flush()
+
+            @staticmethod
+            def _status_of(outcome: str, prof: Dict[str, Any]) -> int:
+                return {"quota": 429, "forbidden": 403, "server_error": 503, "hang": 0, "status": int(prof.get("status") or 0)}.get(outcome, 200)
+
+            def _route(self) -> None:
+                started = time.perf_counter()
+                url = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+                key = query.get("key", "")
+                path = url.path
+                model = ""
+                if path.startswith("/v1beta/models/") and path.endswith(":generateContent"):
+                    endpoint = "generate"
+                    model = path[len("/v1beta/models/"):-len(":generateContent")]
+                    outcome, status = self._generate(model, key)
+                elif path.rstrip("/") == "/v1beta/models":
+                    endpoint = "models"
+                    outcome, status = self._models(key)
+                elif path.rstrip("/") == "/api/ask":
+                    endpoint = "perplexity"
+                    outcome, status = self._perplexity(query.get("prompt", ""))
+                elif path.rstrip("/") == "/app":
+                    endpoint = "web_page"
+                    outcome, status = self._web_page()
+                elif path == STREAM_PATH:
+                    endpoint = "web_stream"
+                    outcome, status = self._web_stream()
+                else:
+                    self._json(404, {"error": {"code": 404, "message": f"no stub for {path}", "status": "NOT_FOUND"}})
+                    return
+                api._note(endpoint, outcome, key, model, started, status)
+
+            do_GET = _route
+            do_POST = _route
+
+        return Handler
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--script", default="", help="JSON profile script (see module docstring)")
+    ap.add_argument("--latency", default=None, help="default latency spec, e.g. lognormal:900:0.5")
+    for name in FAILURES:
+        ap.add_argument(f"--{name.replace('_', '-')}", type=float, default=None, help=f"default probability of a {name} reply")
+    ap.add_argument("--exhausted-key", action="append", default=[], help="API key that always gets 429 (repeatable)")
+    ap.add_argument("--down-model", action="append", default=[], help="model name that always gets 404 (repeatable)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--record", default="", help="append every call to this JSONL file")
+    args = ap.parse_args()
+
+    script: Dict[str, Any] = {}
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    default = dict(script.get("default") or {})
+    if args.latency is not None:
+        default["latency"] = args.latency
+    for name in FAILURES:
+        value = getattr(args, name)
+        if value is not None:
+            default[name] = value
+    script["default"] = default
+    for key in args.exhausted_key:
+        script.setdefault("keys", {})[key] = {"quota": 1.0}
+    for model in args.down_model:
+        script.setdefault("models", {})[model] = {"status": 404}
+    parse_latency(str(default.get("latency") or ""))  # fail early on a bad spec
+
+    api = FakeAiBackend(args.host, args.port, script=script, record=args.record, seed=args.seed)
+    print(f"fake AI backend on {api.start()} (Ctrl+C to stop)")
+    for k, v in api.env().items():
+        print(f"  {k}={v}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(api.stats(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Local stand-in for the Telegram Bot API, for load tests.
+
+Usage:
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 40 --jitter-ms 20 --rate-limit 0.02 --record calls.jsonl
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 python Probaho_replytext_memory_on.py
+
+Answers POST /bot<token>/<method> like Telegram does. Sending methods return messages,
+copyMessage a MessageId, getChatMember a member, and the rest `true`. The methods
+implemented on purpose are sendMessage, sendPoll, copyMessage, getChatMember,
+editMessageText, deleteMessage(s), answerCallbackQuery and getMe.
+Options:
+- --latency-ms / --jitter-ms: delay added to every reply.
+- --rate-limit P: answer a fraction P of non-startup calls with 429 + retry_after.
+- --record FILE: append every call (method, params, status, server time) to a JSONL file.
+
+benchmarks/replay_updates.py runs this in-process (FakeBotApi) and reads stats() back.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    "id": 7000000001, "is_bot": True, "first_name": "Probaho Bench", "username": "probaho_bench_bot",
+    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False,
+}
+# Calls made while the application starts; never rate limited so startup is deterministic.
+STARTUP_METHODS = {"getMe", "deleteWebhook", "getUpdates", "setMyCommands", "getMyCommands", "close", "logOut"}
+
+
+def _param(params: Dict[str, str], key: str, default: Any = None) -> Any:
+    """Bot API parameters arrive as strings; non-string values are JSON encoded."""
+    raw = params.get(key)
+    if raw is None:
+        return default
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return raw
+
+
+def _chat(chat_id: Any) -> Dict[str, Any]:
+    if isinstance(chat_id, int) and chat_id > 0:
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+    if isinstance(chat_id, int):
+        return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"}
+    return {"id": -1009999999999, "type": "channel", "title": str(chat_id), "username": str(chat_id).lstrip("@")}
+
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: int = 1, member_status: str = "member",
+                 record: str = "", seed: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1000)
+        self._record_file = open(record, "a", encoding="utf-8") if record else None
+        self.calls: Dict[str, int] = {}
+        self.rate_limited: Dict[str, int] = {}
+        self.server_ms: List[float] = []
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._record_file:
+            self._record_file.close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.rate_limited.clear()
+            self.server_ms.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ms = sorted(self.server_ms)
+        return {
+            "calls": dict(sorted(self.calls.items())),
+            "rate_limited": dict(sorted(self.rate_limited.items())),
+            "total_calls": sum(self.calls.values()),
+            "mean_server_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        }
+
+    # ---- request handling ------------------------------------------------
+
+    def _delay(self) -> None:
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                jitter = self._rng.uniform(0, self.jitter_ms)
+            time.sleep((self.latency_ms + jitter) / 1000.0)
+
+    def _should_rate_limit(self, method: str) -> bool:
+        if not self.rate_limit or method in STARTUP_METHODS:
+            return False
+        with self._lock:
+            return self._rng.random() < self.rate_limit
+
+    def _message(self, params: Dict[str, str], **extra: Any) -> Dict[str, Any]:
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": _chat(_param(params, "chat_id", 0)),
+            "from": {k: BOT_USER[k] for k in ("id", "is_bot", "first_name", "username")},
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        if "caption" in params:
+            msg["caption"] = params["caption"]
+        msg.update(extra)
+        return msg
+
+    def _poll(self, params: Dict[str, str]) -> Dict[str, Any]:
+        options = []
+        for opt in _param(params, "options", []) or []:
+            text = opt.get("text", "") if isinstance(opt, dict) else str(opt)
+            options.append({"text": text, "voter_count": 0})
+        poll = {
+            "id": str(next(self._message_ids)),
+            "question": str(params.get("question", "")),
+            "options": options,
+            "total_voter_count": 0,
+            "is_closed": False,
+            "is_anonymous": bool(_param(params, "is_anonymous", True)),
+            "type": str(params.get("type", "regular")),
+            "allows_multiple_answers": False,
+        }
+        if "correct_option_id" in params:
+            poll["correct_option_id"] = int(_param(params, "correct_option_id", 0))
+        if "explanation" in params:
+            poll["explanation"] = params["explanation"]
+        return poll
+
+    def respond(self, method: str, params: Dict[str, str]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method in ("getUpdates", "getMyCommands", "getChatAdministrators"):
+            return []
+        if method == "getChatMemberCount":
+            return 0
+        if method == "getChatMember":
+            uid = _param(params, "user_id", 0)
+            return {"status": self.member_status, "user": {"id": uid, "is_bot": False, "first_name": f"User {uid}"}}
+        if method == "getChat":
+            return dict(_chat(_param(params, "chat_id", 0)), accent_color_id=0, max_reaction_count=11)
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("copyMessages", "forwardMessages"):
+            return [{"message_id": next(self._message_ids)} for _ in _param(params, "message_ids", []) or []]
+        if method == "sendPoll":
+            return self._message(params, poll=self._poll(params))
+        if method.startswith("editMessage") and "inline_message_id" in params:
+            return True
+        if method.startswith(("send", "edit", "forward")):
+            return self._message(params)
+        return True
+
+    def _handle(self, method: str, params: Dict[str, str]):
+        t = time.perf_counter()
+        self._delay()
+        if self._should_rate_limit(method):
+            status, body = 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        else:
+            status, body = 200, {"ok": True, "result": self.respond(method, params)}
+        elapsed = (time.perf_counter() - t) * 1000.0
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if status == 429:
+                self.rate_limited[method] = self.rate_limited.get(method, 0) + 1
+            self.server_ms.append(elapsed)
+            if self._record_file:
+                self._record_file.write(json.dumps({
+                    "ts": round(time.time(), 6), "method": method, "status": status,
+                    "server_ms": round(elapsed, 3), "params": params,
+                }, ensure_ascii=False) + "\n")
+        return status, body
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):  # keep load-test output readable
+                pass
+
+            def _params(self) -> Dict[str, str]:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                ctype = self.headers.get("Content-Type", "")
+                if ctype.startswith("application/json"):
+                    data = json.loads(body or b"{}")
+                    return {k: v if isinstance(v, str) else json.dumps(v) for k, v in data.items()}
+                if ctype.startswith("multipart/form-data"):
+                    msg = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {ctype}\r\n\r\n".encode() + body)
+                    out = {}
+                    for part in msg.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        if name and not part.get_filename():
+                            out[name] = part.get_content() if part.get_content_maintype() == "text" else part.get_payload(decode=True).decode("utf-8", "replace")
+                    return out
+                return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+
+            def _reply(self, status: int, body: Any) -> None:
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self):
+                parts = self.path.split("?", 1)[0].strip("/").split("/")
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                self._reply(*api._handle(parts[1], self._params()))
+
+            do_GET = do_POST
+
+        return Handler
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of calls answered with 429")
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--member-status", default="member", help="getChatMember status (member/left/kicked/...)")
+    ap.add_argument("--record", default="", help="append every call to this JSONL file")
+    args = ap.parse_args()
+    api = FakeBotApi(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                     rate_limit=args.rate_limit, retry_after=args.retry_after,
+                     member_status=args.member_status, record=args.record)
+    print(f"fake Bot API on {api.start()} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(api.stats(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
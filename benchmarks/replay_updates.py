@@ -0,0 +1,294 @@
+"""Replay synthetic Telegram updates through build_app() against the fake Bot API.
+
+Usage:
+    python benchmarks/replay_updates.py --rate 200 --updates 2000 --concurrency 8,32,64
+    python benchmarks/replay_updates.py --mix private_text=3,poll=1,emoji_tap=6 --latency-ms 40 --rate-limit 0.02 --report replay.json
+
+Starts benchmarks/fake_bot_api.py in-process and points the bot at it with
+TELEGRAM_API_BASE_URL. The bot runs on a throwaway database filled by synthetic.py.
+For each --concurrency value it builds the application with that
+BOT_CONCURRENT_UPDATES and pushes --updates updates into app.update_queue at --rate
+per second. Arrivals follow a fixed schedule (open loop), so a slow bot builds a queue.
+Latency is measured from enqueue until app.process_update returns for that update.
+
+Update kinds (--mix weights):
+  private_text  an admin pastes quiz text in private chat (parse -> buffer)
+  poll          an admin forwards a quiz poll in private chat
+  emoji_tap     a user taps an answer button on a channel emoji quiz
+  group_sh      /sh <question> in a group. This calls the AI backends configured in
+                the bot, so it is 0 by default.
+
+The report gives, per concurrency value:
+- throughput and latency p50/p90/p99/max
+- handler errors
+- Bot API calls per method, including the 429s that were injected
+"""
+import argparse
+import asyncio
+import glob
+import importlib.util
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import synthetic
+from fake_bot_api import FakeBotApi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+GOLDEN_DIR = os.path.join(ROOT, "benchmarks", "golden", "quiz_text")
+GROUP_CHAT_ID = -1001555000111
+CHANNEL_CHAT_ID = -1001000000000
+DEFAULT_MIX = "private_text=3,poll=2,emoji_tap=5,group_sh=0"
+SH_QUESTIONS = [
+    "নিউটনের দ্বিতীয় সূত্রটি ব্যাখ্যা করো",
+    "What is the difference between mitosis and meiosis?",
+    "২৫ এর বর্গমূল কত?",
+]
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _quiz_blocks() -> List[str]:
+    blocks = []
+    for path in sorted(glob.glob(os.path.join(GOLDEN_DIR, "0*.txt"))):
+        with open(path, encoding="utf-8") as f:
+            blocks.extend(b.strip() for b in f.read().split("\n\n") if b.strip())
+    return blocks
+
+
+class UpdateFactory:
+    """Builds Bot API update dicts; ids and choices come from one seeded RNG."""
+
+    def __init__(self, *, users: int, admins: List[int], quizzes: int, seed: int):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.admins = admins
+        self.quizzes = quizzes
+        self.blocks = _quiz_blocks()
+        self.update_id = 0
+        self.message_id = 5000
+
+    def _ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    @staticmethod
+    def _user(uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": f"User {uid}", "username": f"user{uid}", "language_code": "bn"}
+
+    def _private_message(self, uid: int, **body: Any) -> Dict[str, Any]:
+        update_id, message_id = self._ids()
+        msg = {"message_id": message_id, "date": int(time.time()), "from": self._user(uid),
+               "chat": {"id": uid, "type": "private", "first_name": f"User {uid}"}}
+        msg.update(body)
+        return {"update_id": update_id, "message": msg}
+
+    def private_text(self) -> Dict[str, Any]:
+        return self._private_message(self.rng.choice(self.admins), text=self.rng.choice(self.blocks))
+
+    def poll(self) -> Dict[str, Any]:
+        payload = synthetic.quiz_payload(self.rng.randrange(1000))
+        opts = [payload[f"option{i}"] for i in range(1, 6) if payload[f"option{i}"]]
+        poll = {
+            "id": str(self.rng.getrandbits(48)), "question": payload["questions"],
+            "options": [{"text": o, "voter_count": 0} for o in opts], "total_voter_count": 0,
+            "is_closed": True, "is_anonymous": True, "type": "quiz", "allows_multiple_answers": False,
+            "correct_option_id": int(payload["answer"]) - 1,
+        }
+        if payload["explanation"]:
+            poll["explanation"] = payload["explanation"]
+        return self._private_message(self.rng.choice(self.admins), poll=poll)
+
+    def emoji_tap(self) -> Dict[str, Any]:
+        update_id, _ = self._ids()
+        i = self.rng.randrange(self.quizzes)
+        uid = synthetic.user_id(self.rng.randrange(self.users))
+        return {"update_id": update_id, "callback_query": {
+            "id": str(self.rng.getrandbits(60)), "from": self._user(uid), "chat_instance": "bench",
+            "data": f"eq:{synthetic.emoji_quiz_id(i)}:{self.rng.randint(1, 4)}",
+            "message": {"message_id": 1000 + i, "date": int(time.time()),
+                        "chat": {"id": CHANNEL_CHAT_ID - i % 10, "type": "channel", "title": "Bench Channel"},
+                        "text": synthetic.emoji_quiz_payload(i)["question"]},
+        }}
+
+    def group_sh(self) -> Dict[str, Any]:
+        update_id, message_id = self._ids()
+        uid = synthetic.user_id(self.rng.randrange(self.users))
+        text = "/sh " + self.rng.choice(SH_QUESTIONS)
+        return {"update_id": update_id, "message": {
+            "message_id": message_id, "date": int(time.time()), "from": self._user(uid),
+            "chat": {"id": GROUP_CHAT_ID, "type": "supergroup", "title": "Bench Group"},
+            "text": text, "entities": [{"type": "bot_command", "offset": 0, "length": 3}],
+        }}
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        if part.strip():
+            name, _, weight = part.partition("=")
+            if not hasattr(UpdateFactory, name.strip()):
+                raise SystemExit(f"unknown update kind in --mix: {name}")
+            mix[name.strip()] = float(weight or 1)
+    return {k: w for k, w in mix.items() if w > 0}
+
+
+def _pct(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, int(round(p / 100.0 * (len(sorted_ms) - 1))))]
+
+
+async def _run_level(bot, api: FakeBotApi, factory: UpdateFactory, mix: Dict[str, float], *,
+                     concurrency: int, updates: int, rate: float, drain_timeout: float) -> Dict[str, Any]:
+    from telegram import Update
+
+    bot.BOT_CONCURRENT_UPDATES = concurrency
+    app = bot.build_app()
+    sent_at: Dict[int, float] = {}
+    kind_of: Dict[int, str] = {}
+    latencies: Dict[str, List[float]] = {k: [] for k in mix}
+    errors: List[str] = []
+    done = asyncio.Event()
+    finished = 0
+    last_done = 0.0
+    process_update = app.process_update
+
+    async def _timed_process_update(update):
+        nonlocal finished, last_done
+        try:
+            await process_update(update)
+        finally:
+            uid = getattr(update, "update_id", None)
+            if uid in sent_at:
+                last_done = time.perf_counter()
+                latencies[kind_of[uid]].append((last_done - sent_at[uid]) * 1000.0)
+                finished += 1
+                if finished >= updates:
+                    done.set()
+
+    async def _count_error(update, context):
+        errors.append(type(context.error).__name__)
+
+    app.process_update = _timed_process_update
+    app.add_error_handler(_count_error)
+    await app.initialize()
+    await app.start()
+    api.reset_stats()
+    kinds, weights = list(mix), list(mix.values())
+    try:
+        t0 = time.perf_counter()
+        for i in range(updates):
+            delay = t0 + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = factory.rng.choices(kinds, weights)[0]
+            update = Update.de_json(getattr(factory, kind)(), app.bot)
+            sent_at[update.update_id] = time.perf_counter()
+            kind_of[update.update_id] = kind
+            await app.update_queue.put(update)
+        offered_s = time.perf_counter() - t0
+        try:
+            await asyncio.wait_for(done.wait(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        await app.stop()
+        await app.shutdown()
+
+    all_ms = sorted(ms for v in latencies.values() for ms in v)
+    wall = max(last_done - t0, 1e-9) if finished else 0.0
+    return {
+        "concurrency": concurrency,
+        "offered_rate": round(updates / max(offered_s, 1e-9), 1),
+        "sent": updates,
+        "completed": finished,
+        "throughput": round(finished / wall, 1) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(_pct(all_ms, 50), 2), "p90": round(_pct(all_ms, 90), 2),
+            "p99": round(_pct(all_ms, 99), 2), "max": round(all_ms[-1], 2) if all_ms else 0.0,
+            "mean": round(statistics.fmean(all_ms), 2) if all_ms else 0.0,
+        },
+        "by_kind": {k: {"count": len(v), "p50_ms": round(_pct(sorted(v), 50), 2), "p99_ms": round(_pct(sorted(v), 99), 2)}
+                    for k, v in latencies.items()},
+        "handler_errors": {e: errors.count(e) for e in sorted(set(errors))},
+        "bot_api": api.stats(),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rate", type=float, default=100.0, help="updates per second offered")
+    ap.add_argument("--updates", type=int, default=1000, help="updates per concurrency level")
+    ap.add_argument("--concurrency", default="64", help="comma-separated BOT_CONCURRENT_UPDATES values to sweep")
+    ap.add_argument("--mix", default=DEFAULT_MIX)
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--admins", type=int, default=50, help="users promoted to admin (senders of pastes / polls)")
+    ap.add_argument("--quizzes", type=int, default=500)
+    ap.add_argument("--responses", type=int, default=50_000)
+    ap.add_argument("--latency-ms", type=float, default=30.0, help="fake Bot API base latency")
+    ap.add_argument("--jitter-ms", type=float, default=20.0)
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of Bot API calls answered with 429")
+    ap.add_argument("--record", default="", help="JSONL file for every Bot API call")
+    ap.add_argument("--drain-timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--report", default="", help="write the report JSON here")
+    args = ap.parse_args()
+    mix = _parse_mix(args.mix)
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    report_path = os.path.abspath(args.report) if args.report else ""
+    record_path = os.path.abspath(args.record) if args.record else ""
+
+    api = FakeBotApi(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=args.rate_limit,
+                     record=record_path, seed=args.seed)
+    os.environ["TELEGRAM_API_BASE_URL"] = api.start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            bot = _load_bot(tmp)
+            for name in ("httpx", "telegram", "apscheduler"):  # one line per Bot API call otherwise
+                logging.getLogger(name).setLevel(logging.WARNING)
+            counts = synthetic.populate(bot, users=args.users, responses=args.responses, quizzes=args.quizzes, buffered=0, posted=0)
+            admins = [synthetic.user_id(i) for i in range(0, args.users, max(1, args.users // max(1, args.admins)))][:args.admins]
+            conn = bot.db_connect()
+            conn.executemany("UPDATE users SET role=?, is_banned=0 WHERE user_id=?", [(bot.ROLE_ADMIN, a) for a in admins])
+            conn.commit()
+            conn.close()
+            print(f"data: {counts}, {len(admins)} admins; fake Bot API at {api.base_url}; mix {mix}")
+            for level in levels:
+                factory = UpdateFactory(users=args.users, admins=admins, quizzes=args.quizzes, seed=args.seed)
+                r = asyncio.run(_run_level(bot, api, factory, mix, concurrency=level, updates=args.updates,
+                                           rate=args.rate, drain_timeout=args.drain_timeout))
+                results.append(r)
+                lat = r["latency_ms"]
+                print(f"concurrency {level:4d}: offered {r['offered_rate']:7.1f}/s  throughput {r['throughput']:7.1f}/s  "
+                      f"completed {r['completed']}/{r['sent']}  p50 {lat['p50']:8.1f} ms  p90 {lat['p90']:8.1f}  "
+                      f"p99 {lat['p99']:8.1f}  max {lat['max']:8.1f}  errors {sum(r['handler_errors'].values())}  "
+                      f"api calls {r['bot_api']['total_calls']} (429: {sum(r['bot_api']['rate_limited'].values())})")
+    finally:
+        api.stop()
+
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "data": counts, "levels": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"wrote {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
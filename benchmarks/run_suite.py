@@ -0,0 +1,373 @@
+"""Hot-path benchmark suite; writes JSON so runs can be compared across patches.
+
+Usage:
+    python benchmarks/run_suite.py --out results.json
+    python benchmarks/run_suite.py --db /tmp/bench.sqlite3 --out after.json --compare before.json
+    python benchmarks/run_suite.py --users 2000 --responses 20000 --only emoji_quiz
+
+Covers text parsing (split_blocks / parse_text_block), rendering (clean_latex,
+_answer_to_tg_html, quiz_to_poll_parts), the SQLite helpers against a populated
+database (see synthetic.py; 100k users / 1M emoji-quiz responses / 1M posted
+questions by default) and the permission / membership decorators with a stubbed
+Bot API.
+
+Each case is timed as the best of --repeat runs of an auto-sized loop (~--min-time
+seconds each); the JSON keeps per-call best and median in microseconds. With
+--db PATH the generated database is kept and reused, so later runs skip the fill and
+time the same data. --compare prints the change per case and exits 1 when a case got
+slower than --threshold.
+"""
+import argparse
+import asyncio
+import glob
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+from bench_clean_latex import CHEMISTRY, PHYSICS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "Probaho_replytext_memory_on.py")
+GOLDEN_DIR = os.path.join(ROOT, "benchmarks", "golden", "quiz_text")
+
+ANSWER_MARKDOWN = (
+    "**সঠিক উত্তর:** (খ) শাপলা\n\n"
+    "### ব্যাখ্যা\n"
+    "- শাপলা বাংলাদেশের **জাতীয় ফুল**; এটি `জাতীয় প্রতীক`-এও আছে।\n"
+    "- গোলাপ, জবা ও রজনীগন্ধা জাতীয় ফুল নয়।\n\n"
+    "> Tip: জাতীয় প্রতীকগুলো একসাথে মনে রাখো।\n\n"
+) + PHYSICS
+
+CASES = []
+
+
+def case(name: str, *, kind: str = "sync"):
+    def _register(setup):
+        CASES.append((name, kind, setup))
+        return setup
+    return _register
+
+
+def _load_bot(workdir: str):
+    os.chdir(workdir)  # DB_PATH is relative to the working directory
+    spec = importlib.util.spec_from_file_location("probaho_bot", BOT_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _golden_paste() -> str:
+    pastes = []
+    for path in sorted(glob.glob(os.path.join(GOLDEN_DIR, "*.txt"))):
+        if os.path.basename(path) != "filters.txt":
+            with open(path, encoding="utf-8", newline="") as f:
+                pastes.append(f.read())
+    return "\n\n".join(pastes * 5)
+
+
+# ---- text ---------------------------------------------------------------
+
+@case("split_blocks")
+def _split_blocks(bot, env):
+    paste = env["paste"]
+    return lambda: bot.split_blocks(paste)
+
+
+@case("parse_text_block")
+def _parse_text_block(bot, env):
+    blocks = bot.split_blocks(env["paste"])
+    admin = env["admin"]
+    it = iter(range(1 << 62))
+    return lambda: bot.parse_text_block(blocks[next(it) % len(blocks)], admin)
+
+
+@case("clean_latex")
+def _clean_latex(bot, env):
+    texts = (PHYSICS, CHEMISTRY)
+    it = iter(range(1 << 62))
+    return lambda: bot.clean_latex(texts[next(it) & 1])
+
+
+@case("_answer_to_tg_html")
+def _answer_html(bot, env):
+    return lambda: bot._answer_to_tg_html(ANSWER_MARKDOWN, model_name="Gemini")
+
+
+@case("quiz_to_poll_parts")
+def _poll_parts(bot, env):
+    payloads = [synthetic.quiz_payload(i) for i in range(50)]
+    it = iter(range(1 << 62))
+    return lambda: bot.quiz_to_poll_parts(payloads[next(it) % len(payloads)])
+
+
+# ---- SQLite helpers -----------------------------------------------------
+
+@case("ensure_user")
+def _ensure_user(bot, env):
+    fake = synthetic.FakeBot()
+    rng = random.Random(1)
+    updates = [synthetic.fake_update(fake, synthetic.user_id(rng.randrange(env["users"]))) for _ in range(256)]
+    it = iter(range(1 << 62))
+    return lambda: bot.ensure_user(updates[next(it) & 255])
+
+
+@case("buffer_add")
+def _buffer_add(bot, env):
+    uid = synthetic.user_id(env["users"])  # outside the populated range: keeps the admin's buffer intact
+    bot.buffer_clear(uid)
+    it = iter(range(1 << 62))
+    return lambda: bot.buffer_add(uid, synthetic.quiz_payload(next(it)))
+
+
+@case("buffer_add_duplicate")
+def _buffer_add_duplicate(bot, env):
+    uid = synthetic.user_id(env["users"] + 1)
+    payload = synthetic.quiz_payload(3)
+    bot.buffer_clear(uid)
+    bot.buffer_add(uid, payload)
+    return lambda: bot.buffer_add(uid, payload)
+
+
+@case("buffer_list")
+def _buffer_list(bot, env):
+    admin = env["admin"]
+    return lambda: bot.buffer_list(admin)
+
+
+@case("posted_preflight")
+def _posted_preflight(bot, env):
+    items = bot.buffer_list(env["admin"])
+    return lambda: bot.posted_preflight(synthetic.POSTED_CHANNEL, items)
+
+
+@case("posted_record")
+def _posted_record(bot, env):
+    it = iter(range(1 << 62))
+    return lambda: bot.posted_record(synthetic.POSTED_CHANNEL - 1, [(next(it), 1)], env["admin"])
+
+
+@case("emoji_quiz_get")
+def _quiz_get(bot, env):
+    ids = env["quiz_ids"]
+    it = iter(range(1 << 62))
+    return lambda: bot.emoji_quiz_get(ids[next(it) % len(ids)])
+
+
+@case("emoji_quiz_has_answered")
+def _quiz_answered(bot, env):
+    ids, users = env["quiz_ids"], env["users"]
+    rng = random.Random(2)
+    pairs = [(rng.choice(ids), synthetic.user_id(rng.randrange(users))) for _ in range(256)]
+    it = iter(range(1 << 62))
+    return lambda: bot.emoji_quiz_has_answered(*pairs[next(it) & 255])
+
+
+@case("emoji_quiz_record_answer")
+def _quiz_record(bot, env):
+    ids, users = env["quiz_ids"], env["users"]
+    rng = random.Random(3)
+    rows = [(rng.choice(ids), synthetic.user_id(rng.randrange(users)), rng.randint(1, 4)) for _ in range(256)]
+    it = iter(range(1 << 62))
+
+    def _record():
+        qid, uid, opt = rows[next(it) & 255]
+        bot.emoji_quiz_record_answer(qid, uid, opt, opt == 2)
+    return _record
+
+
+@case("emoji_quiz_counts")
+def _quiz_counts(bot, env):
+    ids = env["quiz_ids"]
+    it = iter(range(1 << 62))
+    return lambda: bot.emoji_quiz_counts(ids[next(it) % len(ids)])
+
+
+# ---- decorators with a stubbed Bot API ----------------------------------
+
+async def _noop_handler(update, context):
+    return True
+
+
+@case("require_admin[admin]", kind="async")
+def _require_admin_ok(bot, env):
+    fake = synthetic.FakeBot()
+    handler = bot.require_admin(_noop_handler)
+    update, context = synthetic.fake_update(fake, env["admin"], "/done"), synthetic.fake_context(fake)
+    return lambda: handler(update, context)
+
+
+@case("require_admin[user]", kind="async")
+def _require_admin_denied(bot, env):
+    fake = synthetic.FakeBot()
+    handler = bot.require_admin(_noop_handler)
+    update, context = synthetic.fake_update(fake, synthetic.user_id(2), "/done"), synthetic.fake_context(fake)
+    return lambda: handler(update, context)
+
+
+@case("require_admin_silent[user]", kind="async")
+def _require_admin_silent(bot, env):
+    fake = synthetic.FakeBot()
+    handler = bot.require_admin_silent(_noop_handler)
+    update, context = synthetic.fake_update(fake, synthetic.user_id(3), "hello"), synthetic.fake_context(fake)
+    return lambda: handler(update, context)
+
+
+@case("enforce_required_memberships[member]", kind="async")
+def _membership_ok(bot, env):
+    fake = synthetic.FakeBot("member")
+    update, context = synthetic.fake_update(fake, synthetic.user_id(4)), synthetic.fake_context(fake)
+    return lambda: bot.enforce_required_memberships(update, context)
+
+
+# ---- runner -------------------------------------------------------------
+
+def _calibrate(run_n, min_time: float) -> int:
+    n = 1
+    while True:
+        elapsed = run_n(n)
+        if elapsed >= min_time or n >= 1 << 20:
+            return n
+        n = max(n * 2, int(n * min_time / max(elapsed, 1e-9) * 1.2))
+
+
+def _timer(kind: str, fn, loop):
+    if kind == "async":
+        async def _many(n):
+            t = time.perf_counter()
+            for _ in range(n):
+                await fn()
+            return time.perf_counter() - t
+        return lambda n: loop.run_until_complete(_many(n))
+
+    def _many_sync(n):
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return time.perf_counter() - t
+    return _many_sync
+
+
+def _git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "-C", ROOT, "status", "--porcelain", "--", os.path.basename(BOT_FILE)], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except Exception:
+        return ""
+
+
+def _compare(results, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = baseline.get("results", {})
+    print(f"\nvs {baseline_path} ({baseline.get('meta', {}).get('revision') or '?'})")
+    regressions = 0
+    for name, r in results.items():
+        if name not in old:
+            print(f"  {name:40s} new")
+            continue
+        before, after = old[name]["best_us"], r["best_us"]
+        change = (after - before) / max(before, 1e-9)
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"  {name:40s} {before:10.2f} -> {after:10.2f} us  ({change:+7.1%}){flag}")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--responses", type=int, default=1_000_000)
+    ap.add_argument("--quizzes", type=int, default=2_000)
+    ap.add_argument("--posted", type=int, default=1_000_000, help="posted-question history rows")
+    ap.add_argument("--db", default="", help="keep the populated SQLite file here and reuse it on later runs")
+    ap.add_argument("--only", default="", help="run only cases whose name contains this text")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--min-time", type=float, default=0.2)
+    ap.add_argument("--out", default="", help="write results JSON here")
+    ap.add_argument("--compare", default="", help="baseline results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="relative slowdown reported as a regression")
+    args = ap.parse_args()
+    out_path = os.path.abspath(args.out) if args.out else ""
+    compare_path = os.path.abspath(args.compare) if args.compare else ""
+    db_path = os.path.abspath(args.db) if args.db else ""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = _load_bot(tmp)
+        reuse = bool(db_path) and os.path.exists(db_path)
+        if reuse:
+            shutil.copyfile(db_path, bot.DB_PATH)
+            bot.db_init()
+            bot.extra_db_init()
+            counts = {"users": args.users, "quizzes": args.quizzes, "responses": args.responses, "posted": args.posted, "reused": 1}
+        else:
+            t = time.perf_counter()
+            counts = synthetic.populate(bot, users=args.users, responses=args.responses, quizzes=args.quizzes, posted=args.posted)
+            print(f"populated in {time.perf_counter() - t:.1f}s: {counts}")
+            if db_path:
+                shutil.copyfile(bot.DB_PATH, db_path)
+        admins = synthetic.admin_ids(args.users)
+        env = {
+            "users": args.users,
+            "admins": admins,
+            "admin": admins[0],
+            "quiz_ids": [synthetic.emoji_quiz_id(i) for i in range(args.quizzes)],
+            "paste": _golden_paste(),
+        }
+
+        loop = asyncio.new_event_loop()
+        results = {}
+        try:
+            for name, kind, setup in CASES:
+                if args.only and args.only not in name:
+                    continue
+                fn = setup(bot, env)
+                run_n = _timer(kind, fn, loop)
+                n = _calibrate(run_n, args.min_time)
+                per_call = [run_n(n) / n * 1e6 for _ in range(args.repeat)]
+                results[name] = {
+                    "best_us": round(min(per_call), 3),
+                    "median_us": round(statistics.median(per_call), 3),
+                    "calls": n,
+                    "repeat": args.repeat,
+                }
+                print(f"{name:40s} {min(per_call):10.2f} us/call  (median {statistics.median(per_call):.2f}, {n} calls x {args.repeat})")
+        finally:
+            loop.close()
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "data": counts,
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "results": results,
+    }
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"wrote {out_path}")
+    if compare_path:
+        return _compare(results, compare_path, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Synthetic data and Telegram stubs shared by the benchmark suite.
+
+populate() fills the bot's SQLite file the way a busy deployment looks: many users
+(a few admins, some banned), channels with emoji quizzes and a large
+emoji_quiz_responses table, per-admin filters, buffered questions and a long
+posted-question history. Everything is
+seeded, so two runs against the same counts produce the same database.
+
+FakeBot / fake_update() stand in for python-telegram-bot objects so decorators and
+membership checks run without the network: every Bot API call returns immediately
+and is counted.
+"""
+import json
+import random
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+BASE_USER_ID = 10_000_000
+ADMIN_EVERY = 5_000  # one admin per this many users
+BANNED_EVERY = 997
+POSTED_CHANNEL = -1001000000000  # channel whose history holds every other buffered question
+
+SAMPLE_QUESTIONS = [
+    ("বাংলাদেশের জাতীয় ফুল কোনটি?", ["গোলাপ", "শাপলা", "জবা", "রজনীগন্ধা"], 2, "শাপলা বাংলাদেশের জাতীয় ফুল।"),
+    ("What is the SI unit of electric charge?", ["Ampere", "Coulomb", "Volt", "Ohm"], 2, "1 C = 1 A × 1 s."),
+    ("২৫ এর বর্গমূল কত?", ["৩", "৪", "৫", "৬"], 3, ""),
+    ("The powerhouse of the cell is", ["Nucleus", "Mitochondria", "Ribosome", "Lysosome", "Golgi body"], 2, "Mitochondria produce ATP."),
+    ("Speed of light in vacuum is approximately", ["3 × 10^6 m/s", "3 × 10^8 m/s", "3 × 10^10 m/s", "3 × 10^5 m/s"], 2, "$c \\approx 3 \\times 10^8\\,\\text{m/s}$"),
+]
+
+
+def user_id(i: int) -> int:
+    return BASE_USER_ID + i
+
+
+def admin_ids(users: int) -> List[int]:
+    return [user_id(i) for i in range(0, users, ADMIN_EVERY)]
+
+
+def quiz_payload(i: int) -> Dict[str, Any]:
+    q, opts, answer, expl = SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]
+    padded = opts + [""] * (5 - len(opts))
+    return {
+        "questions": f"{q} ({i})",
+        "option1": padded[0], "option2": padded[1], "option3": padded[2],
+        "option4": padded[3], "option5": padded[4],
+        "answer": answer, "explanation": expl, "type": 1, "section": 1,
+    }
+
+
+def emoji_quiz_id(i: int) -> str:
+    """Same shape as the bot's uuid4().hex[:10] ids (the eq: callback pattern needs hex)."""
+    return f"{i:010x}"
+
+
+def emoji_quiz_payload(i: int) -> Dict[str, Any]:
+    q, opts, answer, expl = SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]
+    return {"question": f"{q} ({i})", "options": list(opts), "correct_answer": answer, "explanation": expl}
+
+
+def _batched(cur, sql: str, rows, batch: int = 50_000) -> None:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            cur.executemany(sql, chunk)
+            chunk = []
+    if chunk:
+        cur.executemany(sql, chunk)
+
+
+def populate(bot, *, users: int = 100_000, responses: int = 1_000_000, quizzes: int = 2_000,
+             buffered: int = 100, posted: int = 1_000_000, seed: int = 7) -> Dict[str, int]:
+    """Create all tables and fill them. Returns the row counts written."""
+    bot.db_init()
+    bot.extra_db_init()
+    rng = random.Random(seed)
+    now = bot.now_iso()
+    admins = admin_ids(users)
+    conn = bot.db_connect()
+    cur = conn.cursor()
+
+    def _users():
+        for i in range(users):
+            uid = user_id(i)
+            role = bot.ROLE_ADMIN if i % ADMIN_EVERY == 0 else bot.ROLE_USER
+            yield (uid, role, f"User {i}", f"user{i}", 1 if i % BANNED_EVERY == 1 else 0, now, now)
+
+    _batched(cur, "INSERT OR REPLACE INTO users(user_id, role, first_name, username, is_banned, created_at, last_seen_at) VALUES (?,?,?,?,?,?,?)", _users())
+
+    quiz_ids = [emoji_quiz_id(i) for i in range(quizzes)]
+    cur.executemany(
+        "INSERT OR REPLACE INTO emoji_quizzes(quiz_id, channel_chat_id, message_id, payload_json, created_by, created_at) VALUES (?,?,?,?,?,?)",
+        [(qid, -1001000000000 - i % 10, 1000 + i, json.dumps(emoji_quiz_payload(i), ensure_ascii=False), admins[i % len(admins)], now)
+         for i, qid in enumerate(quiz_ids)],
+    )
+
+    per_quiz = max(1, min(users, responses // max(1, quizzes)))
+
+    def _responses():
+        written = 0
+        for i, qid in enumerate(quiz_ids):
+            n = min(per_quiz, responses - written)
+            if n <= 0:
+                return
+            # A contiguous id window per quiz keeps (quiz_id, user_id) unique without a set.
+            start = rng.randrange(max(1, users - n + 1))
+            for k in range(n):
+                opt = rng.randint(1, 4)
+                yield (qid, user_id(start + k), opt, 1 if opt == 2 else 0, now)
+            written += n
+
+    _batched(cur, "INSERT OR REPLACE INTO emoji_quiz_responses(quiz_id, user_id, selected_option, is_correct, clicked_at) VALUES (?,?,?,?,?)", _responses())
+
+    cur.executemany(
+        "INSERT OR IGNORE INTO filters(user_id, phrase, created_at) VALUES (?,?,?)",
+        [(a, p, now) for a in admins[:20] for p in ("@WhiteApronBD", "Join our channel", "সংগৃহীত", "t.me/medprep")],
+    )
+    cur.executemany(
+        "INSERT INTO quiz_buffer(user_id, payload_json, created_at, fingerprint) VALUES (?,?,?,?)",
+        [(admins[0], json.dumps(quiz_payload(i), ensure_ascii=False), now, bot.buffer_fingerprint(quiz_payload(i))) for i in range(buffered)],
+    )
+
+    def _posted():
+        # Even buffered questions are real history hits; the rest are random keys spread
+        # over ten channels, like years of posts.
+        hits = [bot.posted_key_for_payload(quiz_payload(i)) for i in range(0, buffered, 2)]
+        for i in range(posted):
+            if i < len(hits):
+                yield (POSTED_CHANNEL, hits[i], 1_000_000 + i, admins[0], now)
+            else:
+                yield (POSTED_CHANNEL - i % 10, rng.getrandbits(64) - (1 << 63), 1_000_000 + i, admins[i % len(admins)], now)
+
+    _batched(cur, "INSERT OR IGNORE INTO posted_questions(channel_chat_id, fingerprint, message_id, posted_by, posted_at) VALUES (?,?,?,?,?)", _posted())
+    cur.execute(
+        "INSERT OR IGNORE INTO required_memberships(chat_id, title, chat_type, added_by, created_at) VALUES (?,?,?,?,?)",
+        (-1001234567890, "@BenchRequiredChannel", "channel", admins[0], now),
+    )
+    conn.commit()
+    cur.execute("SELECT COUNT(*) AS c FROM emoji_quiz_responses")
+    written = int(cur.fetchone()["c"])
+    conn.close()
+    return {"users": users, "admins": len(admins), "quizzes": quizzes, "responses": written, "buffered": buffered, "posted": posted}
+
+
+class FakeBot:
+    """Bot API stub: every call succeeds instantly; calls are counted by method name."""
+
+    def __init__(self, member_status: str = "member"):
+        self.member_status = member_status
+        self.calls: Dict[str, int] = {}
+        self._next_message_id = 1
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _message(self, chat_id: int = 0, text: str = "") -> SimpleNamespace:
+        self._next_message_id += 1
+        return SimpleNamespace(message_id=self._next_message_id, chat_id=chat_id, text=text)
+
+    async def get_chat_member(self, chat_id, user_id):
+        self._count("get_chat_member")
+        return SimpleNamespace(status=self.member_status, user=SimpleNamespace(id=user_id))
+
+    async def send_message(self, chat_id, text="", **kwargs):
+        self._count("send_message")
+        return self._message(chat_id, text)
+
+    async def delete_message(self, chat_id=None, message_id=None, **kwargs):
+        self._count("delete_message")
+        return True
+
+    async def send_chat_action(self, *args, **kwargs):
+        self._count("send_chat_action")
+        return True
+
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat: SimpleNamespace, user: SimpleNamespace, text: str):
+        self._bot = bot
+        self.chat = chat
+        self.chat_id = chat.id
+        self.from_user = user
+        self.text = text
+        self.caption = None
+        self.message_id = 1
+        self.reply_to_message = None
+        self.message_thread_id = None
+        self.poll = None
+        self.photo = None
+        self.document = None
+
+    async def reply_text(self, text="", **kwargs):
+        return await self._bot.send_message(self.chat.id, text, **kwargs)
+
+    async def reply_html(self, text="", **kwargs):
+        return await self._bot.send_message(self.chat.id, text, **kwargs)
+
+
+def fake_update(bot: FakeBot, uid: int, text: str = "/start", chat_type: str = "private",
+                chat_id: Optional[int] = None) -> SimpleNamespace:
+    user = SimpleNamespace(id=uid, first_name=f"User {uid}", username=f"user{uid}", is_bot=False, language_code="bn")
+    chat = SimpleNamespace(id=uid if chat_id is None else chat_id, type=chat_type, title=None, username=None)
+    message = FakeMessage(bot, chat, user, text)
+    return SimpleNamespace(
+        update_id=1, effective_user=user, effective_chat=chat, message=message,
+        effective_message=message, callback_query=None, edited_message=None, channel_post=None,
+    )
+
+
+def fake_context(bot: FakeBot, args: Optional[List[str]] = None) -> SimpleNamespace:
+    return SimpleNamespace(bot=bot, args=list(args or []), user_data={}, chat_data={}, bot_data={}, application=None)